@@ -0,0 +1,6 @@
+"""
+Performance benchmarks
+Synthetic academic images through OCR and the /process endpoint
+
+Usage (from backend/): python -m benchmarks --output report.json
+"""
@@ -0,0 +1,147 @@
+"""
+Synthetic academic images for the benchmarks
+Text pages, math exercises and tables rendered with PIL, with scan-like noise
+"""
+
+import io
+import random
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+TEXT_LINES = [
+    "A fotossíntese converte energia luminosa em energia química.",
+    "As células vegetais possuem parede celular e cloroplastos.",
+    "Explique a diferença entre mitose e meiose com exemplos.",
+    "O período colonial brasileiro terminou com a independência em 1822.",
+    "Identifique o sujeito e o predicado nas orações abaixo.",
+    "A velocidade média é a razão entre o deslocamento e o tempo.",
+]
+
+MATH_LINES = [
+    "Resolva: 2x + 5 = 17",
+    "Calcule a derivada de f(x) = 3x^2 - 4x + 7",
+    "Determine as raízes de x^2 - 5x + 6 = 0",
+    "Simplifique: (a + b)^2 - (a - b)^2",
+    "Integral de 0 a 2 de (4x + 1) dx",
+    "Se log2(x) = 5, quanto vale x?",
+]
+
+TABLE_HEADER = ["Elemento", "Símbolo", "Número", "Massa"]
+TABLE_ROWS = [
+    ["Hidrogênio", "H", "1", "1.008"],
+    ["Carbono", "C", "6", "12.011"],
+    ["Nitrogênio", "N", "7", "14.007"],
+    ["Oxigênio", "O", "8", "15.999"],
+    ["Sódio", "Na", "11", "22.990"],
+]
+
+KINDS = ("text", "math", "table")
+
+@dataclass
+class BenchmarkImage:
+    """One encoded benchmark image and the text rendered into it"""
+    name: str
+    kind: str
+    size: Tuple[int, int]
+    noise: float
+    data: bytes  # PNG (JPEG above 4 megapixels, like phone photos)
+    ground_truth: str
+
+def load_font(size: int) -> ImageFont.ImageFont:
+    """DejaVu Sans when installed, PIL's bundled font otherwise"""
+    for name in ("DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "Arial.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+def render_lines(size: Tuple[int, int], lines: Sequence[str]) -> Image.Image:
+    """Lines of text filling the page top to bottom"""
+    width, height = size
+    font_size = max(12, height // 28)
+    font = load_font(font_size)
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    y = font_size
+    for line in lines:
+        draw.text((width // 20, y), line, fill=0, font=font)
+        y += int(font_size * 1.8)
+        if y > height - font_size * 2:
+            break
+    return image
+
+def render_table(size: Tuple[int, int]) -> Image.Image:
+    """Grid table with a header row"""
+    width, height = size
+    rows = [TABLE_HEADER] + TABLE_ROWS
+    margin = width // 20
+    row_height = min((height - 2 * margin) // len(rows), height // 8)
+    column_width = (width - 2 * margin) // len(TABLE_HEADER)
+    font = load_font(max(12, int(row_height * 0.45)))
+    image = Image.new("L", size, 255)
+    draw = ImageDraw.Draw(image)
+    for row_index, row in enumerate(rows):
+        top = margin + row_index * row_height
+        for column_index, cell in enumerate(row):
+            left = margin + column_index * column_width
+            draw.rectangle([left, top, left + column_width, top + row_height], outline=0, width=2)
+            draw.text((left + row_height // 4, top + row_height // 4), cell, fill=0, font=font)
+    return image
+
+def add_noise(image: Image.Image, level: float, rng: random.Random) -> Image.Image:
+    """
+    Scan/photo degradation: slight rotation, blur and gaussian noise
+
+    level 0 leaves the image untouched; around 0.1 looks like a phone
+    photo of a notebook, 0.2 is hard to read.
+    """
+    if level <= 0:
+        return image
+    image = image.rotate(rng.uniform(-4, 4) * level * 5, resample=Image.BILINEAR, fillcolor=255, expand=False)
+    image = image.filter(ImageFilter.GaussianBlur(radius=level * 6))
+    pixels = np.asarray(image, dtype=np.float32)
+    noise = np.random.default_rng(rng.randrange(1 << 30)).normal(0, 255 * level, pixels.shape)
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+def render(kind: str, size: Tuple[int, int]) -> Tuple[Image.Image, str]:
+    if kind == "text":
+        return render_lines(size, TEXT_LINES), "\n".join(TEXT_LINES)
+    if kind == "math":
+        return render_lines(size, MATH_LINES), "\n".join(MATH_LINES)
+    if kind == "table":
+        return render_table(size), "\n".join(" ".join(row) for row in [TABLE_HEADER] + TABLE_ROWS)
+    raise ValueError(f"Unknown image kind: {kind}")
+
+def encode(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    if image.size[0] * image.size[1] > 4_000_000:
+        image.convert("RGB").save(buffer, format="JPEG", quality=88)
+    else:
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def generate_corpus(sizes: Sequence[Tuple[int, int]], noise_levels: Sequence[float],
+                    kinds: Sequence[str] = KINDS, seed: int = 7) -> List[BenchmarkImage]:
+    """Every kind x size x noise combination, deterministic for a given seed"""
+    rng = random.Random(seed)
+    corpus = []
+    for kind in kinds:
+        for size in sizes:
+            for noise in noise_levels:
+                image, ground_truth = render(kind, size)
+                corpus.append(BenchmarkImage(
+                    name=f"{kind}-{size[0]}x{size[1]}-n{noise:g}",
+                    kind=kind,
+                    size=size,
+                    noise=noise,
+                    data=encode(add_noise(image, noise, rng)),
+                    ground_truth=ground_truth
+                ))
+    return corpus
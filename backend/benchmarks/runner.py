@@ -0,0 +1,316 @@
+"""
+Benchmark runner
+Drives OCRService.extract_text and POST /process over the synthetic corpus
+and writes a JSON report that can be compared across commits
+"""
+
+import argparse
+import base64
+import difflib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Patches only reach OCR that runs in this process
+os.environ["OCR_EXECUTOR_MODE"] = "thread"
+
+import numpy as np
+
+from benchmarks.images import KINDS, BenchmarkImage, generate_corpus
+from benchmarks.stubs import make_ocr_service, stubbed_services
+from services.metrics import metrics
+
+# Stage histograms reported by each suite (name prefixes)
+OCR_STAGES = ("ocr_",)
+API_STAGES = ("ocr_", "llm_", "processing_seconds", "response_serialize_seconds", "http_request_duration_seconds")
+
+# Report fields where a higher value is an improvement
+HIGHER_IS_BETTER = ("images_per_sec", "images_per_sec_per_core", "accuracy")
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+def proc_status_mb(field: str) -> Optional[float]:
+    """VmRSS/VmHWM of this process from /proc/self/status (Linux only)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def reset_peak_rss() -> bool:
+    """
+    Restart the peak RSS counter so the next reading covers one suite only
+
+    Writing 5 to /proc/self/clear_refs resets VmHWM (Linux). Elsewhere
+    nothing is reset: ru_maxrss (and an exec'd child) keeps the peak of
+    the whole process, so the reading is marked as process-wide.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb() -> float:
+    """Peak resident set size since reset_peak_rss() (ru_maxrss fallback is KB on Linux, bytes on macOS)"""
+    peak = proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def start_memory_window() -> Dict[str, Any]:
+    """Reset the peak and remember the RSS a suite starts from"""
+    return {"scope": "suite" if reset_peak_rss() else "process", "start_mb": proc_status_mb("VmRSS")}
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def percentiles(samples: Sequence[float]) -> Dict[str, Optional[float]]:
+    """Exact p50/p95/p99 and mean of the samples (seconds)"""
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(samples))}
+
+def stage_report(prefixes: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-stage quantiles from the metrics registry
+
+    These come from the bucketed histograms the app records in production,
+    so they are interpolated estimates, not exact percentiles.
+    """
+    stages = {}
+    for name, labels, histogram in sorted(metrics.histograms(), key=lambda item: (item[0], sorted(item[1].items()))):
+        if not name.startswith(prefixes) or not histogram.count:
+            continue
+        key = name + ("{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}" if labels else "")
+        stages[key] = {
+            "count": histogram.count,
+            "p50": histogram.quantile(0.50),
+            "p95": histogram.quantile(0.95),
+            "p99": histogram.quantile(0.99),
+            "mean": histogram.sum / histogram.count
+        }
+    return stages
+
+def similarity(expected: str, actual: str) -> float:
+    """Character-level similarity of the OCR text to the rendered text (0..1)"""
+    normalize = lambda text: " ".join(text.split()).lower()
+    return difflib.SequenceMatcher(None, normalize(expected), normalize(actual)).ratio()
+
+def summarize(samples: List[float], failures: int, wall: float, cpu: float,
+              accuracy: Optional[List[float]], prefixes: Sequence[str], memory: Dict[str, Any]) -> Dict[str, Any]:
+    images = len(samples)
+    peak = peak_rss_mb()
+    return {
+        "images": images,
+        "failures": failures,
+        "end_to_end": percentiles(samples),
+        "stages": stage_report(prefixes),
+        "images_per_sec": images / wall if wall else None,
+        # CPU seconds, not cores on the box: stays comparable across machines and thread counts
+        "images_per_sec_per_core": images / cpu if cpu else None,
+        "accuracy": float(np.mean(accuracy)) if accuracy else None,
+        # Peak of this suite alone when peak_rss_scope is "suite"; growth is relative to its starting RSS
+        "peak_rss_mb": peak,
+        "peak_rss_scope": memory["scope"],
+        "rss_growth_mb": peak - memory["start_mb"] if memory["start_mb"] is not None else None
+    }
+
+def run_ocr_suite(corpus: List[BenchmarkImage], iterations: int, plan: str, fake_tesseract: bool,
+                  tesseract_cost: float, cloud_latency: float) -> Dict[str, Any]:
+    """OCRService.extract_text on every image, result caches off"""
+    memory = start_memory_window()
+    service = make_ocr_service(fake_tesseract, tesseract_cost, cloud_latency)
+    # Warm-up: imports, thread pools, tesseract startup
+    service.extract_text(corpus[0].data, plan)
+    metrics.reset()
+
+    samples, accuracy, failures = [], [], 0
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for _ in range(iterations):
+        for image in corpus:
+            start = time.perf_counter()
+            result = service.extract_text(image.data, plan)
+            samples.append(time.perf_counter() - start)
+            if not result.success:
+                failures += 1
+            elif not fake_tesseract:
+                accuracy.append(similarity(image.ground_truth, result.text))
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    return summarize(samples, failures, wall, cpu, accuracy, OCR_STAGES, memory)
+
+def run_api_suite(corpus: List[BenchmarkImage], iterations: int, plan: str, fake_tesseract: bool,
+                  tesseract_cost: float, cloud_latency: float, llm_latency: float) -> Dict[str, Any]:
+    """POST /process (sync mode) through TestClient with stubbed OCR clouds and LLM providers"""
+    memory = start_memory_window()
+    from fastapi.testclient import TestClient
+    import main
+
+    payloads = [base64.b64encode(image.data).decode() for image in corpus]
+    samples, failures = [], 0
+    with stubbed_services(fake_tesseract, tesseract_cost, cloud_latency, llm_latency), TestClient(main.app) as client:
+        request_number = 0
+
+        def post(payload: str):
+            nonlocal request_number
+            request_number += 1
+            # One user per request: the monthly quota is never the bottleneck
+            token = f"benchmark-{os.getpid()}-{request_number}"
+            main.user_sessions[token] = main.UserProfile(
+                id=token, email="benchmark@academicassistant.com.br", plan=plan,
+                usage_count=0, usage_month=datetime.now().month, created_at=datetime.now()
+            )
+            return client.post(
+                "/process", json={"image_data": payload}, headers={"Authorization": f"Bearer {token}"}
+            )
+
+        post(payloads[0])
+        metrics.reset()
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        for _ in range(iterations):
+            for payload in payloads:
+                start = time.perf_counter()
+                response = post(payload)
+                samples.append(time.perf_counter() - start)
+                if response.status_code != 200 or not response.json().get("success"):
+                    failures += 1
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    return summarize(samples, failures, wall, cpu, None, API_STAGES, memory)
+
+def flatten(report: Dict[str, Any]) -> Dict[str, float]:
+    """Comparable numbers of a report as 'suite.field' -> value"""
+    flat = {}
+    for suite, result in report.get("suites", {}).items():
+        for field in ("images_per_sec", "images_per_sec_per_core", "accuracy", "peak_rss_mb"):
+            if result.get(field) is not None:
+                flat[f"{suite}.{field}"] = result[field]
+        for quantile, value in result.get("end_to_end", {}).items():
+            if value is not None:
+                flat[f"{suite}.end_to_end.{quantile}"] = value
+        for stage, values in result.get("stages", {}).items():
+            for quantile in ("p50", "p95", "p99"):
+                if values.get(quantile) is not None:
+                    flat[f"{suite}.{stage}.{quantile}"] = values[quantile]
+    return flat
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Print the relative change of every shared number
+
+    Returns the fields that regressed by more than threshold (0.1 = 10%):
+    latencies and memory that grew, throughput and accuracy that dropped.
+    """
+    old, new = flatten(baseline), flatten(current)
+    regressions = []
+    print(f"{'metric':<70} {'baseline':>12} {'current':>12} {'change':>9}", file=sys.stderr)
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        change = (after - before) / before if before else 0.0
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(key)
+            flag = "  ⚠️"
+        print(f"{key:<70} {before:>12.4f} {after:>12.4f} {change:>+8.1%}{flag}", file=sys.stderr)
+    return regressions
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="OCR and /process benchmarks on synthetic images (run from backend/)"
+    )
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(800, 600), (1600, 1200), (3000, 2250)],
+                        help="Image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--noise", nargs="+", type=float, default=[0.0, 0.05, 0.15],
+                        help="Noise levels (0 = clean render)")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--iterations", type=int, default=3, help="Passes over the corpus per suite")
+    parser.add_argument("--plan", default="free", choices=["free", "pro", "max"],
+                        help="Plan whose OCR/LLM routing is exercised")
+    parser.add_argument("--suite", nargs="+", choices=["ocr", "api"], default=["ocr", "api"])
+    parser.add_argument("--fake-tesseract", action="store_true",
+                        help="Skip recognition (for machines without the tesseract binary)")
+    parser.add_argument("--tesseract-cost", type=float, default=0.0,
+                        help="Seconds per megapixel the fake tesseract sleeps")
+    parser.add_argument("--cloud-latency", type=float, default=0.3, help="Stubbed Vision/Azure latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Stubbed LLM provider latency (s)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report here (stdout otherwise)")
+    parser.add_argument("--compare", help="Baseline report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change that counts as a regression")
+    return parser
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if not args.fake_tesseract:
+        import pytesseract
+        try:
+            pytesseract.get_tesseract_version()
+        except pytesseract.TesseractNotFoundError:
+            print("❌ tesseract binary not found; install it or pass --fake-tesseract", file=sys.stderr)
+            return 2
+
+    corpus = generate_corpus(args.sizes, args.noise, args.kinds, args.seed)
+    print(f"🖼️ {len(corpus)} images x {args.iterations} iterations", file=sys.stderr)
+
+    suites = {}
+    if "ocr" in args.suite:
+        suites["ocr"] = run_ocr_suite(
+            corpus, args.iterations, args.plan, args.fake_tesseract, args.tesseract_cost, args.cloud_latency
+        )
+    if "api" in args.suite:
+        suites["api"] = run_api_suite(
+            corpus, args.iterations, args.plan, args.fake_tesseract, args.tesseract_cost,
+            args.cloud_latency, args.llm_latency
+        )
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        "suites": suites
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📄 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regressions above {args.threshold:.0%}", file=sys.stderr)
+            return 1
+    return 0
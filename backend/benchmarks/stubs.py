@@ -0,0 +1,111 @@
+"""
+Stand-ins for external services during benchmarks
+Cloud OCR providers and LLM APIs answer locally with a configurable latency
+"""
+
+import asyncio
+import json
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Iterator
+from unittest.mock import patch
+
+import httpx
+from PIL import Image
+
+from config import LLM_PROVIDERS
+from models import OCRResult, OCRProvider
+from services.llm_router import LLMRouter
+from services.llm_service import LLMService
+from services.ocr_service import OCRService
+
+STUB_TEXT = "Resolva: 2x + 5 = 17"
+
+class FakeTesseractEngine:
+    """
+    Tesseract engine that skips recognition
+
+    Returns one word per 200x40 pixel cell after sleeping cost_per_mp
+    seconds per megapixel, so the rest of the pipeline (decode, normalize,
+    preprocess, tiling) can be measured where the binary is missing.
+    """
+
+    name = "fake"
+
+    def __init__(self, cost_per_mp: float = 0.0):
+        self.cost_per_mp = cost_per_mp
+
+    def image_to_data(self, image: Image.Image) -> dict:
+        width, height = image.size
+        if self.cost_per_mp:
+            time.sleep(self.cost_per_mp * width * height / 1_000_000)
+        data = {key: [] for key in (
+            'text', 'conf', 'left', 'top', 'width', 'height', 'page_num', 'block_num', 'par_num', 'line_num'
+        )}
+        for line, top in enumerate(range(0, max(1, height - 40), 40)):
+            for left in range(0, max(1, width - 200), 200):
+                for key, value in (('text', 'palavra'), ('conf', 90), ('left', left), ('top', top),
+                                   ('width', 200), ('height', 40), ('page_num', 1), ('block_num', 1),
+                                   ('par_num', 1), ('line_num', line)):
+                    data[key].append(value)
+        return data
+
+    def get_stats(self):
+        return {'backend': self.name}
+
+def stub_cloud_result(provider: OCRProvider, latency: float) -> OCRResult:
+    time.sleep(latency)
+    return OCRResult(
+        provider=provider,
+        text=STUB_TEXT,
+        confidence=0.95,
+        processing_time=latency,
+        success=True
+    )
+
+def llm_handler(latency: float):
+    """httpx.MockTransport handler answering OpenAI- and Anthropic-style requests"""
+    async def handle(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        text = "Subtraia 5 dos dois lados e divida por 2: x = 6."
+        if request.url.path.endswith("/messages"):
+            body = {"content": [{"type": "text", "text": text}], "usage": {"input_tokens": 50, "output_tokens": 20}}
+        else:
+            body = {"choices": [{"message": {"content": text}}], "usage": {"total_tokens": 70}}
+        return httpx.Response(200, content=json.dumps(body).encode(), headers={"content-type": "application/json"})
+    return handle
+
+def make_ocr_service(fake_tesseract: bool, tesseract_cost: float = 0.0, cloud_latency: float = 0.3) -> OCRService:
+    """OCRService without result caches (every image is really processed) and with stubbed cloud providers"""
+    service = OCRService()
+    service.result_cache = None
+    service.near_duplicates = None
+    if fake_tesseract:
+        service.tesseract_engine = FakeTesseractEngine(tesseract_cost)
+    service._extract_with_google_vision = lambda image: stub_cloud_result(OCRProvider.GOOGLE_VISION, cloud_latency)
+    service._extract_with_azure_cv = lambda image: stub_cloud_result(OCRProvider.AZURE_CV, cloud_latency)
+    return service
+
+@contextmanager
+def stubbed_services(fake_tesseract: bool, tesseract_cost: float = 0.0, cloud_latency: float = 0.3,
+                     llm_latency: float = 0.5) -> Iterator[OCRService]:
+    """
+    Patch the API's module-level services for a benchmark run
+
+    OCR goes through a cache-free OCRService, cloud OCR providers and LLM
+    APIs are local stubs with a fixed latency, and the per-minute rate
+    limit is off so the load is not rejected.
+    """
+    import main
+    service = make_ocr_service(fake_tesseract, tesseract_cost, cloud_latency)
+    with ExitStack() as stack:
+        stack.enter_context(patch('services.ocr_service.ocr_service', service))
+        stack.enter_context(patch('services.ocr_service.GOOGLE_VISION_AVAILABLE', True))
+        stack.enter_context(patch('services.ocr_service.AZURE_CV_AVAILABLE', True))
+        for name, value in (('llm_live_calls', True), ('llm_cache_enabled', False), ('rate_limit_enabled', False)):
+            stack.enter_context(patch.object(main.settings, name, value))
+        for provider in LLM_PROVIDERS:
+            stack.enter_context(patch.object(main.settings, f"{provider}_api_key", f"benchmark-{provider}-key"))
+        llm = LLMService(transport=httpx.MockTransport(llm_handler(llm_latency)), router=LLMRouter())
+        stack.enter_context(patch.object(main, 'llm_service', llm))
+        yield service
@@ -24,6 +24,7 @@ class Settings(BaseSettings):
     
     # OCR Services Configuration
     google_vision_api_key: Optional[str] = None
+    google_vision_endpoint: Optional[str] = None  # e.g. http://127.0.0.1:9100 (load-test stand-in), REST without Google credentials
     azure_cv_endpoint: Optional[str] = None
     azure_cv_key: Optional[str] = None
     
@@ -35,11 +36,122 @@ class Settings(BaseSettings):
     # OpenRouter Configuration (Fallback)
     openrouter_api_key: Optional[str] = None
     
+    # LLM HTTP Clients (one pooled httpx.AsyncClient per provider)
+    llm_live_calls: bool = False  # False = template explanations, no provider traffic
+    llm_http2: bool = True  # Used when the h2 package is installed
+    llm_connect_timeout: float = 5.0
+    llm_max_tokens: int = 1024
+    groq_base_url: str = "https://api.groq.com/openai/v1"
+    anthropic_base_url: str = "https://api.anthropic.com/v1"
+    openai_base_url: str = "https://api.openai.com/v1"
+    openrouter_base_url: str = "https://openrouter.ai/api/v1"
+    
+    # Semantic LLM Response Cache (MinHash near-duplicate lookup)
+    llm_cache_enabled: bool = True
+    llm_cache_threshold: float = 0.8  # Estimated Jaccard similarity of character shingles
+    llm_cache_ttl: int = 7 * 24 * 3600  # 7 days
+    llm_cache_max_entries: int = 5000
+    llm_cache_shingle_size: int = 5
+    
+    # LLM Router (rolling latency per provider/model + circuit breakers)
+    llm_router_window: float = 300.0  # Seconds of latency/error samples kept
+    llm_router_max_samples: int = 200
+    llm_router_min_samples: int = 5  # Calls before a target is ranked by latency and errors
+    llm_router_max_error_rate: float = 0.5  # Targets failing more often than this are tried last
+    llm_circuit_failure_threshold: int = 3  # Consecutive failures that open the circuit
+    llm_circuit_backoff_base: float = 5.0  # First open period (seconds), doubled per further failure
+    llm_circuit_backoff_factor: float = 2.0
+    llm_circuit_max_backoff: float = 300.0
+    llm_circuit_probe_timeout: float = 60.0
+    
     # Redis Configuration (Upstash)
     redis_url: Optional[str] = None
     
+    # Shared State (sessions, quota counters and results across workers)
+    state_backend: str = "memory"  # memory (per process) | sqlite (one node) | redis (requires redis, REDIS_URL)
+    state_db_path: str = "./data/state.db"
+    state_key_prefix: str = "aa:"
+    state_socket_timeout: float = 2.0
+    
+    # OCR Worker Pool
+    ocr_executor_mode: str = "thread"  # thread | process
+    ocr_max_workers: int = 0  # 0 = one worker per CPU core
+    ocr_max_queue_size: int = 32  # Waiting jobs before answering 503
+    
+    # Tesseract Engine
+    tesseract_backend: str = "subprocess"  # subprocess | pooled (requires tesserocr)
+    tesseract_pool_size: int = 0  # Warm handles for the pooled backend, 0 = one per CPU core
+    tesseract_lang: str = "eng"
+    
+    # Resolution Normalization
+    ocr_max_megapixels: float = 4.0  # Decode budget, JPEGs above it use DCT draft scaling
+    ocr_target_text_height: int = 30  # Median glyph height (px) images are rescaled to
+    ocr_max_upscale: float = 2.0
+    
+    # Adaptive Preprocessing (noise sigma thresholds pick none/median/nlmeans)
+    ocr_denoise_none_max_sigma: float = 1.5
+    ocr_denoise_median_max_sigma: float = 5.0
+    ocr_low_contrast_spread: float = 100.0  # Ink/paper gray level gap below this bumps one profile
+    
+    # Tiled OCR (layout blocks of large pages recognized in parallel)
+    ocr_tiling_enabled: bool = True
+    ocr_tiling_min_pixels: int = 1_500_000  # Preprocessed pages smaller than this run in one pass
+    ocr_tiling_max_blocks: int = 64  # More blocks than this means a noisy layout, run in one pass
+    ocr_tiling_workers: int = 0  # 0 = one thread per CPU core; capped at the OCR executor workers
+    
+    # Hedged OCR (race providers for paid plans)
+    ocr_hedging_enabled: bool = True
+    ocr_hedge_plans: list = ['pro', 'max']
+    ocr_hedge_delay: float = 1.5  # Seconds before hedging until enough latency samples exist
+    ocr_hedge_quantile: float = 0.95  # Provider latency quantile used as hedge delay
+    ocr_hedge_min_samples: int = 20
+    ocr_hedge_min_delay: float = 0.1
+    ocr_hedge_workers: int = 16  # Tesseract runs among them still share the OCR executor slots
+    
+    # OCR Result Cache
+    ocr_cache_enabled: bool = True
+    ocr_cache_memory_items: int = 2048
+    ocr_cache_ttl: int = 7 * 24 * 3600  # 7 days
+    ocr_cache_dir: Optional[str] = None  # Set to enable the persistent SQLite tier
+    ocr_cache_max_disk_items: int = 100000
+    
+    # Near-duplicate Detection (perceptual hash)
+    ocr_phash_enabled: bool = True
+    ocr_phash_threshold: int = 2  # Max Hamming distance out of 256 bits (capped at 15), only nominates candidates
+    ocr_phash_verify_side: int = 1024  # Longest side of the binarized thumbnail a candidate must match
+    ocr_phash_max_diff_pixels: int = 0  # Ink pixels allowed to differ (beyond 1px jitter) between the thumbnails
+    ocr_phash_max_entries: int = 10000
+    
+    # Async Jobs (/process?mode=async)
+    job_max_concurrent: int = 64  # Background jobs running at once
+    job_max_waiting: int = 256  # Jobs waiting for a slot before answering 503 (each holds its upload)
+    job_callback_timeout: float = 10.0
+    job_callback_retries: int = 2
+    job_callback_secret: Optional[str] = None  # HMAC key of X-Callback-Signature (default: secret_key)
+    job_callback_allowed_hosts: list = []  # Empty = any public host; entries also match subdomains
+    job_long_poll_max: float = 30.0  # Upper bound for GET /process/{id}?wait=
+    job_poll_interval: float = 0.25
+    job_busy_retries: int = 3  # Waits on a saturated OCR queue before failing a job
+    
+    # Metrics (Prometheus text format at /metrics, per worker process)
+    metrics_enabled: bool = True
+    metrics_token: Optional[str] = None  # Bearer token of /metrics/system (unset = endpoint disabled)
+    
+    # Processing History (per-user index for /history)
+    history_backend: str = "memory"  # memory (per process) | sqlite (one host); ignored when STATE_BACKEND is shared
+    history_db_path: str = "./data/history.db"
+    
+    # Result & Session Stores (bounded in-process state)
+    result_store_max_items: int = 10000  # Requests kept (summaries; full payloads without spill)
+    result_store_ttl: int = 24 * 3600
+    result_store_dir: Optional[str] = None  # Set to spill older full results to SQLite (zlib)
+    result_store_hot_items: int = 500  # Full results kept in memory when spilling
+    session_max_items: int = 50000
+    session_ttl: int = 12 * 3600
+    
     # File Storage
     max_file_size: int = 10 * 1024 * 1024  # 10MB
+    upload_spool_max_size: int = 1024 * 1024  # Multipart uploads spill to disk above 1MB
     allowed_file_types: list = ['.jpg', '.jpeg', '.png', '.pdf', '.webp']
     
     # Rate Limiting by Plan
@@ -48,6 +160,8 @@ class Settings(BaseSettings):
         'pro': {'requests_per_month': 500, 'requests_per_minute': 10},
         'max': {'requests_per_month': -1, 'requests_per_minute': 20}  # -1 = unlimited
     }
+    rate_limit_enabled: bool = True  # Per-minute limit on the /process endpoints (GCRA)
+    rate_limit_burst: int = 0  # Back-to-back requests allowed, 0 = the plan's requests_per_minute
     
     # CORS Configuration
     cors_origins: list = [
@@ -62,6 +176,22 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
     
+    # Authentication (Supabase access tokens)
+    auth_mode: str = "mock"  # mock (any bearer token, development) | supabase (requires python-jose)
+    auth_mock_plan: str = "free"  # Plan of the demo users created in mock mode
+    supabase_jwt_secret: Optional[str] = None  # HS256 projects; asymmetric keys come from the JWKS
+    auth_jwks_url: Optional[str] = None  # Default: {supabase_url}/auth/v1/.well-known/jwks.json
+    auth_jwks_ttl: float = 3600.0
+    auth_jwks_min_refresh: float = 30.0  # Unknown kids refetch the JWKS at most this often
+    auth_jwks_timeout: float = 5.0
+    auth_jwt_algorithms: list = ["RS256", "ES256", "HS256"]
+    auth_jwt_audience: Optional[str] = "authenticated"
+    auth_jwt_leeway: int = 30  # Clock skew tolerated on exp/nbf (seconds)
+    auth_claims_cache_size: int = 10000  # Verified tokens kept until they expire
+    auth_claims_max_ttl: float = 3600.0
+    auth_profile_cache_size: int = 10000
+    auth_profile_ttl: float = 60.0
+    
     # Payment Configuration
     stripe_publishable_key: Optional[str] = None
     stripe_secret_key: Optional[str] = None
@@ -111,24 +241,60 @@ PLAN_FEATURES = {
 }
 
 # LLM Model routing based on plan
+# alternates: same-tier (provider, model) targets the router may prefer when faster/healthier
 LLM_ROUTING = {
     'free': {
         'primary': 'groq',
         'model': 'llama3-8b-8192',
+        'alternates': [('openrouter', 'meta-llama/llama-3-8b-instruct')],
         'fallback': None
     },
     'pro': {
         'primary': 'anthropic',
         'model': 'claude-3-haiku-20240307',
+        'alternates': [('openai', 'gpt-4o-mini'), ('openrouter', 'anthropic/claude-3-haiku')],
         'fallback': 'groq'
     },
     'max': {
         'primary': 'anthropic',
         'model': 'claude-3-sonnet-20240229',
+        'alternates': [('openrouter', 'anthropic/claude-3-sonnet')],
         'fallback': 'claude-3-haiku-20240307'
     }
 }
 
+# LLM provider HTTP settings (API style, connection pool, per-call timeout in seconds)
+LLM_PROVIDERS = {
+    'groq': {
+        'api': 'openai',
+        'default_model': 'llama3-8b-8192',
+        'max_connections': 50,
+        'max_keepalive': 20,
+        'timeout': 15.0
+    },
+    'anthropic': {
+        'api': 'anthropic',
+        'default_model': 'claude-3-haiku-20240307',
+        'max_connections': 50,
+        'max_keepalive': 20,
+        'timeout': 60.0
+    },
+    'openai': {
+        'api': 'openai',
+        'default_model': 'gpt-4o-mini',
+        'max_connections': 20,
+        'max_keepalive': 10,
+        'timeout': 45.0
+    },
+    'openrouter': {
+        'api': 'openai',
+        'default_model': 'anthropic/claude-3-haiku',
+        'max_connections': 10,
+        'max_keepalive': 5,
+        'timeout': 60.0
+    }
+}
+
 # OCR Service routing based on plan
 OCR_ROUTING = {
     'free': ['tesseract'],
@@ -0,0 +1,9 @@
+"""
+Load testing
+Fake Vision/Azure/LLM providers, a closed-loop student load generator and
+a harness that finds the API's saturation point per worker/executor setting
+
+Usage (from backend/):
+    python -m loadtest --workers 1 2 4 --executor thread process --output loadtest.json
+    python -m loadtest.fake_providers --port 9100  # fakes only, for manual runs
+"""
@@ -0,0 +1,246 @@
+"""
+Local stand-ins for the external providers
+Google Vision text_detection, Azure Read (read_in_stream + get_read_result
+polling) and OpenAI/Anthropic-style chat endpoints with configurable
+latency distributions and error rates
+
+Usage (from backend/): python -m loadtest.fake_providers --port 9100
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+OCR_TEXT = "Resolva: 2x + 5 = 17\nDetermine o valor de x e verifique a resposta."
+LLM_TEXT = (
+    "Vamos resolver passo a passo. Subtraia 5 dos dois lados: 2x = 12. "
+    "Divida os dois lados por 2: x = 6. Verificação: 2 * 6 + 5 = 17."
+)
+
+@dataclass
+class LatencyDistribution:
+    """
+    Response time model of one provider (seconds)
+
+    Specs: fixed:S, uniform:LOW:HIGH, normal:MEAN:STD, lognormal:MEDIAN:SIGMA,
+    exponential:MEAN. Lognormal is the usual shape of API latencies: most
+    calls near the median with a long right tail.
+    """
+    kind: str
+    params: Tuple[float, ...]
+
+    KINDS = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exponential': 1}
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, *values = spec.split(":")
+        if kind not in cls.KINDS or len(values) != cls.KINDS[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        return cls(kind, tuple(float(value) for value in values))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            value = rng.gauss(*self.params)
+        elif self.kind == 'lognormal':
+            value = rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        else:
+            value = rng.expovariate(1.0 / self.params[0])
+        return max(0.0, value)
+
+    def __str__(self) -> str:
+        return ":".join([self.kind] + [f"{value:g}" for value in self.params])
+
+@dataclass
+class ProviderProfile:
+    """Latency and failure behaviour of one fake provider"""
+    latency: LatencyDistribution
+    error_rate: float = 0.0  # Fraction of calls answered with error_status
+    error_status: int = 503
+
+    def to_dict(self) -> Dict[str, object]:
+        return {'latency': str(self.latency), 'error_rate': self.error_rate, 'error_status': self.error_status}
+
+@dataclass
+class FakeProviders:
+    """State of the fake servers: profiles, pending Azure reads and call counts"""
+    vision: ProviderProfile
+    azure: ProviderProfile
+    llm: ProviderProfile
+    seed: Optional[int] = None
+    rng: random.Random = field(init=False)
+    operations: Dict[str, float] = field(default_factory=dict)  # Azure operation id -> ready at (monotonic)
+    calls: Dict[str, int] = field(default_factory=dict)
+    errors: Dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+
+    def count(self, provider: str, failed: bool = False):
+        self.calls[provider] = self.calls.get(provider, 0) + 1
+        if failed:
+            self.errors[provider] = self.errors.get(provider, 0) + 1
+
+    def fails(self, profile: ProviderProfile) -> bool:
+        return self.rng.random() < profile.error_rate
+
+def create_app(providers: FakeProviders) -> FastAPI:
+    """FastAPI app serving the Vision, Azure and LLM stand-ins on one port"""
+    app = FastAPI(title="Fake providers", docs_url=None, redoc_url=None)
+
+    # Google Vision REST (images:annotate, what text_detection calls)
+    @app.post("/v1/images:annotate")
+    async def annotate(request: Request):
+        body = await request.json()
+        await asyncio.sleep(providers.vision.latency.sample(providers.rng))
+        if providers.fails(providers.vision):
+            providers.count("vision", failed=True)
+            status = providers.vision.error_status
+            return JSONResponse(
+                {"error": {"code": status, "message": "Simulated Vision error", "status": "UNAVAILABLE"}},
+                status_code=status
+            )
+        providers.count("vision")
+        annotation = {"description": OCR_TEXT, "locale": "pt"}
+        return {"responses": [
+            {"textAnnotations": [annotation], "fullTextAnnotation": {"text": OCR_TEXT}}
+            for _ in body.get("requests", [{}])
+        ]}
+
+    # Azure Read: submit, then poll until the operation leaves notStarted/running
+    @app.post("/vision/{version}/read/analyze")
+    async def azure_analyze(version: str, request: Request):
+        await request.body()
+        if providers.fails(providers.azure):
+            providers.count("azure", failed=True)
+            return JSONResponse(
+                {"error": {"code": "InternalServerError", "message": "Simulated Azure error"}},
+                status_code=providers.azure.error_status
+            )
+        providers.count("azure")
+        operation_id = str(uuid.uuid4())
+        providers.operations[operation_id] = time.monotonic() + providers.azure.latency.sample(providers.rng)
+        location = f"{str(request.base_url).rstrip('/')}/vision/{version}/read/analyzeResults/{operation_id}"
+        return Response(status_code=202, headers={"Operation-Location": location})
+
+    @app.get("/vision/{version}/read/analyzeResults/{operation_id}")
+    async def azure_result(version: str, operation_id: str):
+        ready_at = providers.operations.get(operation_id)
+        if ready_at is None:
+            return JSONResponse({"error": {"code": "NotFound", "message": "Operation not found"}}, status_code=404)
+        if time.monotonic() < ready_at:
+            return {"status": "running"}
+        del providers.operations[operation_id]
+        lines = [
+            {"boundingBox": [0, 40 * i, 600, 40 * i, 600, 40 * i + 30, 0, 40 * i + 30], "text": text, "words": []}
+            for i, text in enumerate(OCR_TEXT.split("\n"))
+        ]
+        return {
+            "status": "succeeded",
+            "analyzeResult": {
+                "version": "3.2.0",
+                "readResults": [{"page": 1, "angle": 0, "width": 800, "height": 600, "unit": "pixel", "lines": lines}]
+            }
+        }
+
+    # LLM chat endpoints (groq/openai/openrouter base URLs and anthropic all point at /v1)
+    async def chat(request: Request, api: str):
+        payload = await request.json()
+        latency = providers.llm.latency.sample(providers.rng)
+        if providers.fails(providers.llm):
+            await asyncio.sleep(latency * 0.1)
+            providers.count("llm", failed=True)
+            status = providers.llm.error_status
+            headers = {"Retry-After": "1"} if status == 429 else None
+            return JSONResponse({"error": {"message": "Simulated provider error"}}, status_code=status, headers=headers)
+        providers.count("llm")
+
+        if payload.get("stream"):
+            return StreamingResponse(stream_chat(latency, api), media_type="text/event-stream")
+
+        await asyncio.sleep(latency)
+        if api == "anthropic":
+            return {"content": [{"type": "text", "text": LLM_TEXT}], "usage": {"input_tokens": 120, "output_tokens": 60}}
+        return {"choices": [{"message": {"role": "assistant", "content": LLM_TEXT}}], "usage": {"total_tokens": 180}}
+
+    async def stream_chat(latency: float, api: str):
+        # Time to first token is a third of the total, the rest is spread over the chunks
+        words = LLM_TEXT.split(" ")
+        await asyncio.sleep(latency / 3)
+        for word in words:
+            delta = word + " "
+            if api == "anthropic":
+                event = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": delta}}
+            else:
+                event = {"choices": [{"delta": {"content": delta}}]}
+            yield f"data: {json.dumps(event)}\n\n"
+            await asyncio.sleep(latency * 2 / 3 / len(words))
+        if api != "anthropic":
+            yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await chat(request, "openai")
+
+    @app.post("/v1/messages")
+    async def messages(request: Request):
+        return await chat(request, "anthropic")
+
+    @app.get("/_stats")
+    async def stats():
+        return {
+            'calls': providers.calls,
+            'errors': providers.errors,
+            'pending_azure_operations': len(providers.operations)
+        }
+
+    return app
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """--vision/--azure/--llm latency specs and error rates (shared with the harness)"""
+    for name, latency, status in (("vision", "lognormal:0.35:0.4", 503), ("azure", "lognormal:1.2:0.5", 500),
+                                  ("llm", "lognormal:1.5:0.6", 429)):
+        parser.add_argument(f"--{name}-latency", default=latency, type=LatencyDistribution.parse,
+                            help=f"{name} latency distribution (default {latency})")
+        parser.add_argument(f"--{name}-error-rate", default=0.0, type=float)
+        parser.add_argument(f"--{name}-error-status", default=status, type=int)
+
+def providers_from_args(args: argparse.Namespace) -> FakeProviders:
+    return FakeProviders(
+        vision=ProviderProfile(args.vision_latency, args.vision_error_rate, args.vision_error_status),
+        azure=ProviderProfile(args.azure_latency, args.azure_error_rate, args.azure_error_status),
+        llm=ProviderProfile(args.llm_latency, args.llm_error_rate, args.llm_error_status),
+        seed=args.seed
+    )
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(prog="python -m loadtest.fake_providers",
+                                     description="Fake Vision, Azure and LLM providers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--seed", type=int, default=None)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    providers = providers_from_args(args)
+    print(f"🎭 Fake providers on http://{args.host}:{args.port} "
+          f"(vision {args.vision_latency}, azure {args.azure_latency}, llm {args.llm_latency})")
+    uvicorn.run(create_app(providers), host=args.host, port=args.port, log_level="warning",
+                access_log=False, backlog=4096)
+
+if __name__ == "__main__":
+    main()
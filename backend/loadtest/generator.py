@@ -0,0 +1,144 @@
+"""
+Closed-loop load generator
+Simulated students posting images to /process at stepped concurrency
+"""
+
+import asyncio
+import base64
+import json
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+import numpy as np
+
+@dataclass
+class StageResult:
+    """Outcome of one concurrency step"""
+    concurrency: int
+    duration: float
+    requests: int  # Finished inside the stage window
+    succeeded: int
+    throughput: float  # Successful requests per second
+    latency: Dict[str, Optional[float]]  # p50/p95/p99/max of successful requests (seconds)
+    statuses: Dict[str, int] = field(default_factory=dict)  # HTTP status (or error type) -> count
+    unfinished: int = 0  # Still running when the stage ended
+
+    @property
+    def error_rate(self) -> float:
+        return 1.0 - self.succeeded / self.requests if self.requests else 0.0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {**asdict(self), 'error_rate': self.error_rate}
+
+def latency_summary(samples: Sequence[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99), 'max': float(max(samples))}
+
+async def run_stage(base_url: str, concurrency: int, duration: float, payloads: Sequence[bytes],
+                    think_time: float = 1.0, timeout: float = 60.0, token_prefix: str = "student",
+                    seed: Optional[int] = None) -> StageResult:
+    """
+    Run `concurrency` students against POST /process for `duration` seconds
+
+    Each student is a loop: send one image, wait for the answer, think for
+    an exponentially distributed time (mean think_time), repeat. This is
+    how real users behave, so when the app slows down the offered load
+    drops instead of piling up forever. Every student has its own bearer
+    token, i.e. its own user, session, quota and rate limit bucket.
+    """
+    rng = random.Random(seed)
+    statuses: Dict[str, int] = {}
+    latencies: List[float] = []
+    finished = 0
+    stage_start = time.perf_counter()
+    deadline = stage_start + duration
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+
+        async def student(number: int):
+            nonlocal finished
+            headers = {"Authorization": f"Bearer {token_prefix}-{number}", "Content-Type": "application/json"}
+            # Spread the first requests over one think time instead of a thundering herd
+            await asyncio.sleep(rng.uniform(0, think_time))
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/process", content=rng.choice(payloads), headers=headers)
+                    outcome = str(response.status_code)
+                    if response.status_code == 200 and not response.json().get("success"):
+                        outcome = "200_failed"
+                except httpx.TimeoutException:
+                    outcome = "timeout"
+                except httpx.HTTPError as e:
+                    outcome = type(e).__name__
+                end = time.perf_counter()
+                if end > deadline:
+                    break
+                finished += 1
+                statuses[outcome] = statuses.get(outcome, 0) + 1
+                if outcome == "200":
+                    latencies.append(end - start)
+                if think_time:
+                    await asyncio.sleep(rng.expovariate(1.0 / think_time))
+
+        tasks = [asyncio.create_task(student(number)) for number in range(concurrency)]
+        _, pending = await asyncio.wait(tasks, timeout=duration + 1.0)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    elapsed = min(time.perf_counter(), deadline) - stage_start
+    return StageResult(
+        concurrency=concurrency,
+        duration=elapsed,
+        requests=finished,
+        succeeded=len(latencies),
+        throughput=len(latencies) / elapsed if elapsed else 0.0,
+        latency=latency_summary(latencies),
+        statuses=statuses,
+        unfinished=len(pending)
+    )
+
+def find_saturation(stages: Sequence[StageResult], min_gain: float = 0.10, max_error_rate: float = 0.01,
+                    p95_slo: Optional[float] = None) -> Dict[str, object]:
+    """
+    Saturation point of a concurrency sweep
+
+    The app is saturated at the last stage before one of: more than
+    max_error_rate of requests failing (429/503/timeouts), p95 latency
+    above p95_slo, or throughput growing by less than min_gain (relative)
+    although concurrency went up. Past that knee extra students only add
+    queueing delay.
+    """
+    peak = max(stages, key=lambda stage: stage.throughput, default=None)
+    result = {
+        'peak_throughput': peak.throughput if peak else 0.0,
+        'peak_concurrency': peak.concurrency if peak else None,
+        'saturated_at': None,
+        'reason': None
+    }
+    previous = None
+    for stage in stages:
+        reason = None
+        if stage.error_rate > max_error_rate:
+            reason = f"error rate {stage.error_rate:.1%}"
+        elif p95_slo is not None and (stage.latency['p95'] or 0.0) > p95_slo:
+            reason = f"p95 {stage.latency['p95']:.2f}s above {p95_slo:g}s"
+        elif previous and stage.concurrency > previous.concurrency and stage.throughput < previous.throughput * (1 + min_gain):
+            reason = f"throughput {stage.throughput:.1f}/s vs {previous.throughput:.1f}/s"
+        if reason:
+            result['saturated_at'] = previous.concurrency if previous else stage.concurrency
+            result['reason'] = f"{reason} at {stage.concurrency} students"
+            break
+        previous = stage
+    return result
+
+def encode_payloads(images: Sequence[bytes]) -> List[bytes]:
+    """JSON bodies for /process, encoded once up front"""
+    return [json.dumps({"image_data": base64.b64encode(image).decode()}).encode() for image in images]
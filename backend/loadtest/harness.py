@@ -0,0 +1,249 @@
+"""
+Load-test harness
+Starts the fake providers and the API under uvicorn, sweeps student
+concurrency for every worker/executor combination and reports throughput
+and saturation points as JSON
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import httpx
+
+from benchmarks.images import KINDS, generate_corpus
+from config import LLM_PROVIDERS
+from loadtest.fake_providers import add_profile_arguments, providers_from_args
+from loadtest.generator import encode_payloads, find_saturation, run_stage
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@dataclass(frozen=True)
+class AppConfig:
+    """One API deployment shape under test"""
+    workers: int  # uvicorn worker processes
+    executor: str  # OCR_EXECUTOR_MODE
+    ocr_workers: int  # OCR_MAX_WORKERS (0 = one per core)
+
+    @property
+    def name(self) -> str:
+        return f"uvicorn={self.workers} executor={self.executor} ocr_workers={self.ocr_workers or 'cpu'}"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_ready(url: str, timeout: float, process: subprocess.Popen):
+    """Poll url until it answers 200 (or fail when the process died or timeout passed)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before it was ready")
+        try:
+            if httpx.get(url, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout:.0f}s")
+
+@contextmanager
+def running(command: List[str], ready_url: str, env: Optional[Dict[str, str]] = None,
+            log: Optional[str] = None, timeout: float = 60.0) -> Iterator[subprocess.Popen]:
+    """Run command in the background until the with-block ends"""
+    output = open(log, "a") if log else subprocess.DEVNULL
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=output, stderr=subprocess.STDOUT)
+    try:
+        wait_ready(ready_url, timeout, process)
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if log:
+            output.close()
+
+def app_environment(config: AppConfig, fake_url: str, args: argparse.Namespace) -> Dict[str, str]:
+    """
+    Settings of the API under test
+
+    Every provider points at the fakes, the per-minute limit is off and mock
+    users get the --plan plan (max = unlimited monthly quota), so the sweep
+    measures capacity instead of the plan limits. Result caches are off
+    unless --keep-caches, otherwise repeated corpus images never reach OCR.
+    """
+    env = dict(os.environ)
+    env.update({
+        'OCR_EXECUTOR_MODE': config.executor,
+        'OCR_MAX_WORKERS': str(config.ocr_workers),
+        'OCR_MAX_QUEUE_SIZE': str(args.ocr_queue),
+        'GOOGLE_VISION_API_KEY': 'loadtest',
+        'GOOGLE_VISION_ENDPOINT': fake_url,
+        'AZURE_CV_ENDPOINT': fake_url,
+        'AZURE_CV_KEY': 'loadtest',
+        'LLM_LIVE_CALLS': 'true',
+        'LLM_HTTP2': 'false',
+        'AUTH_MODE': 'mock',
+        'AUTH_MOCK_PLAN': args.plan,
+        'RATE_LIMIT_ENABLED': 'false'
+    })
+    for provider in LLM_PROVIDERS:
+        env[f"{provider.upper()}_API_KEY"] = 'loadtest'
+        env[f"{provider.upper()}_BASE_URL"] = f"{fake_url}/v1"
+    if not args.keep_caches:
+        env.update({'OCR_CACHE_ENABLED': 'false', 'OCR_PHASH_ENABLED': 'false', 'LLM_CACHE_ENABLED': 'false'})
+    if config.workers > 1 and 'STATE_BACKEND' not in os.environ:
+        # Sessions and results must be visible to every worker
+        env.update({'STATE_BACKEND': 'sqlite', 'STATE_DB_PATH': os.path.join(args.work_dir, 'loadtest-state.db')})
+    return env
+
+def sweep(config: AppConfig, fake_url: str, payloads: Sequence[bytes], args: argparse.Namespace) -> Dict[str, object]:
+    """Start the API with config and run every concurrency stage against it"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    command = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(config.workers), "--log-level", "warning", "--no-access-log", "--backlog", "4096"
+    ]
+    print(f"🚀 {config.name}", file=sys.stderr)
+    stages = []
+    with running(command, f"{base_url}/health", app_environment(config, fake_url, args), args.app_log):
+        for concurrency in args.stages:
+            stage = asyncio.run(run_stage(
+                base_url, concurrency, args.stage_duration, payloads, args.think_time, args.timeout,
+                token_prefix=f"student-{port}", seed=args.seed
+            ))
+            stages.append(stage)
+            print(f"   {concurrency:>5} students: {stage.throughput:7.1f} req/s  "
+                  f"p95 {stage.latency['p95'] or 0:6.2f}s  errors {stage.error_rate:6.1%}  {stage.statuses}",
+                  file=sys.stderr)
+            if args.cooldown:
+                time.sleep(args.cooldown)
+    saturation = find_saturation(stages, args.min_gain, args.max_error_rate, args.p95_slo)
+    return {
+        'config': {'workers': config.workers, 'executor': config.executor, 'ocr_workers': config.ocr_workers},
+        'stages': [stage.to_dict() for stage in stages],
+        'saturation': saturation
+    }
+
+def missing_sdks() -> List[str]:
+    """Cloud OCR SDKs the API needs to reach the Vision/Azure fakes"""
+    modules = {'google-cloud-vision': 'google.cloud.vision',
+               'azure-cognitiveservices-vision-computervision': 'azure.cognitiveservices.vision.computervision'}
+    missing = []
+    for package, module in modules.items():
+        try:
+            if importlib.util.find_spec(module) is None:
+                missing.append(package)
+        except ModuleNotFoundError:
+            missing.append(package)
+    return missing
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m loadtest",
+        description="Sweep student concurrency against the API with fake providers (run from backend/)"
+    )
+    parser.add_argument("--workers", nargs="+", type=int, default=[1], help="uvicorn worker counts")
+    parser.add_argument("--executor", nargs="+", choices=["thread", "process"], default=["thread"],
+                        help="OCR executor modes")
+    parser.add_argument("--ocr-workers", nargs="+", type=int, default=[0], help="OCR_MAX_WORKERS values (0 = per core)")
+    parser.add_argument("--ocr-queue", type=int, default=32, help="OCR_MAX_QUEUE_SIZE of the API")
+    parser.add_argument("--stages", nargs="+", type=int, default=[50, 100, 250, 500, 1000, 1500],
+                        help="Concurrent students per stage")
+    parser.add_argument("--stage-duration", type=float, default=30.0, help="Seconds per stage")
+    parser.add_argument("--think-time", type=float, default=2.0, help="Mean pause between a student's requests (s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Client timeout per request (s)")
+    parser.add_argument("--cooldown", type=float, default=2.0, help="Pause between stages (s)")
+    parser.add_argument("--plan", choices=["free", "pro", "max"], default="max",
+                        help="Plan of the simulated students (max = Vision + Azure hedging, unlimited quota)")
+    parser.add_argument("--sizes", nargs="+", default=["1200x900", "2400x1800"], help="Upload sizes (WIDTHxHEIGHT)")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--keep-caches", action="store_true", help="Leave the OCR/LLM result caches on")
+    parser.add_argument("--min-gain", type=float, default=0.10,
+                        help="Throughput growth below this (relative) between stages marks saturation")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--p95-slo", type=float, default=None, help="p95 latency (s) above which a stage counts as saturated")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--work-dir", default=os.path.join(BACKEND_DIR, "data"),
+                        help="Directory for the shared state DB of multi-worker runs")
+    parser.add_argument("--app-log", help="Append API and fake provider output to this file")
+    parser.add_argument("--output", help="Write the JSON report here (stdout otherwise)")
+    add_profile_arguments(parser)
+    return parser
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    missing = missing_sdks()
+    if missing and args.plan != "free":
+        print(f"⚠️ {', '.join(missing)} not installed: OCR of the {args.plan} plan falls back to Tesseract "
+              f"instead of the fake cloud providers", file=sys.stderr)
+
+    sizes = [tuple(int(part) for part in size.lower().split("x")) for size in args.sizes]
+    corpus = generate_corpus(sizes, [0.0, 0.05], args.kinds, args.seed)
+    payloads = encode_payloads([image.data for image in corpus])
+
+    fake_port = free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    profiles = {name: getattr(providers_from_args(args), name).to_dict() for name in ("vision", "azure", "llm")}
+    fake_command = [sys.executable, "-m", "loadtest.fake_providers", "--port", str(fake_port), "--seed", str(args.seed)]
+    for name, profile in profiles.items():
+        fake_command += [f"--{name}-latency", profile['latency'], f"--{name}-error-rate", str(profile['error_rate']),
+                         f"--{name}-error-status", str(profile['error_status'])]
+
+    results = []
+    with running(fake_command, f"{fake_url}/_stats", log=args.app_log):
+        for workers, executor, ocr_workers in itertools.product(args.workers, args.executor, args.ocr_workers):
+            results.append(sweep(AppConfig(workers, executor, ocr_workers), fake_url, payloads, args))
+        provider_calls = httpx.get(f"{fake_url}/_stats").json()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'plan': args.plan,
+            'images': len(payloads),
+            'stage_duration': args.stage_duration,
+            'think_time': args.think_time,
+            'providers': profiles,
+            'missing_sdks': missing
+        },
+        'runs': results,
+        'provider_calls': provider_calls
+    }
+
+    print("\n📊 Saturation", file=sys.stderr)
+    for run in results:
+        config, saturation = AppConfig(**run['config']), run['saturation']
+        print(f"   {config.name}: peak {saturation['peak_throughput']:.1f} req/s at "
+              f"{saturation['peak_concurrency']} students, saturated at {saturation['saturated_at']} "
+              f"({saturation['reason'] or 'not reached'})", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📄 Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
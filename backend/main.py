@@ -3,28 +3,53 @@ Academic Assistant SaaS - Backend API
 FastAPI + Supabase + Multi-LLM Integration
 """
 
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import json
 import os
 import uuid
 import time
 import base64
+import secrets
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Optional, TypeVar, Union
 
 from dotenv import load_dotenv
+import anyio
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import uvicorn
 
 # Import local modules
-from config import settings, PLAN_FEATURES, LLM_ROUTING
+from config import settings, PLAN_FEATURES, LLM_ROUTING, LLM_PROVIDERS
 from models import (
     ImageUploadRequest, ProcessingResponse, ProcessingResult, RequestStatus,
-    UserProfile, UserUsage, RateLimitInfo, HealthCheck, ErrorResponse
+    UserProfile, UserUsage, RateLimitInfo, HealthCheck, ErrorResponse,
+    OCRResult, LLMResponse, SystemMetrics, PlanType, ProcessingSummary
 )
-from services.ocr_service import ocr_service
+from services.ocr_service import run_extraction
+from services.llm_service import llm_service
+from services.llm_router import llm_router
+from services.semantic_cache import semantic_cache
+from services.single_flight import single_flight, content_key
+from services.history_store import history_store, parse_history_cursor, format_history_cursor, HistoryCursor
+from services.result_store import create_result_store
+from services.state_backend import state_backend, ModelStore
+from services.rate_limiter import rate_limiter
+from services.quota import quota_service, QuotaReservation
+from services.auth import token_verifier, profile_from_claims, AuthError
+from services.billing import verify_stripe_signature, plan_change_from_event, PlanChange, WebhookSignatureError
+from services.metrics import metrics, daily_activity, RequestMetricsMiddleware
+from services.ocr_executor import ocr_executor, OCRQueueFullError
+from services.ocr_cache import ocr_result_cache
+from services.phash_index import phash_index
+from services.job_runner import job_runner, resolve_callback_url, CallbackURLError, JobQueueFullError
+from services.upload_stream import read_image_upload, UploadError, UploadTooLargeError
 
 # Load environment variables
 load_dotenv()
@@ -32,10 +57,28 @@ load_dotenv()
 # Security
 security = HTTPBearer()
 
-# In-memory storage for demo (replace with Redis in production)
-user_sessions = {}
-processing_requests = {}
-usage_tracking = {}
+def forget_history(request_id: str, summary: ProcessingSummary):
+    """Drop a result pushed out of the bounded result store from its owner's history"""
+    if summary.user_id:
+        history_store.remove(summary.user_id, request_id, summary.created_at)
+
+# Sessions, results and usage counters live in the state backend (per process, SQLite or Redis)
+user_sessions = ModelStore(state_backend, "session", UserProfile, settings.session_ttl)
+processing_requests = create_result_store(state_backend, on_evict=forget_history)
+
+T = TypeVar("T")
+
+async def state_io(fn: Callable[..., T], *args: Any) -> T:
+    """
+    Call a session/quota/rate-limit/result/history store method from async code
+    
+    SQLite and Redis calls (and result spills to disk) block on locks and
+    round trips, so they run in the threadpool instead of stalling every
+    request on the worker; the in-memory backend is called inline.
+    """
+    if state_backend.blocking or processing_requests.blocking or history_store.blocking:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -44,9 +87,13 @@ async def lifespan(app: FastAPI):
     print("🚀 Academic Assistant API starting...")
     print(f"📊 Environment: {'Development' if settings.debug else 'Production'}")
     print(f"🔗 CORS origins: {settings.cors_origins}")
+    ocr_executor.start()
+    print(f"🧵 OCR executor: {ocr_executor.max_workers} {ocr_executor.mode} workers")
     yield
     # Shutdown
     print("📝 Academic Assistant API shutting down...")
+    ocr_executor.shutdown()
+    await llm_service.aclose()
 
 # Initialize FastAPI
 app = FastAPI(
@@ -65,40 +112,126 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Dependency to verify JWT token (mock for now)
+# Request latency/count per route (outermost, so it times everything)
+app.add_middleware(RequestMetricsMiddleware)
+
+metrics.describe("http_request_duration_seconds", "HTTP request latency by route template")
+metrics.describe("http_requests_total", "HTTP requests by route template and status")
+metrics.describe("processing_seconds", "OCR + AI pipeline time of completed requests")
+metrics.describe("processing_requests_total", "Processing requests by outcome")
+metrics.describe("ocr_decode_seconds", "Image decode and RGB conversion")
+metrics.describe("ocr_normalize_seconds", "Resolution normalization")
+metrics.describe("ocr_preprocess_seconds", "OCR preprocessing by profile")
+metrics.describe("ocr_provider_seconds", "OCR provider call by provider")
+metrics.describe("llm_request_seconds", "LLM completion by provider, model and outcome")
+metrics.describe("llm_first_token_seconds", "Time to the first streamed LLM token")
+metrics.describe("response_serialize_seconds", "ProcessingResponse JSON serialization by endpoint")
+
+def plan_key(user_id: str) -> str:
+    return f"plan:{user_id}"
+
+async def with_current_plan(profile: UserProfile) -> UserProfile:
+    """Apply the plan bought since the profile was created (see stripe_webhook)"""
+    plan = await state_io(state_backend.get, plan_key(profile.id))
+    if plan is not None:
+        profile.plan = PlanType(plan.decode())
+    return profile
+
+async def load_user_profile(claims: dict) -> UserProfile:
+    """Profile loader of the token verifier: token claims plus the current plan"""
+    return await with_current_plan(await profile_from_claims(claims))
+
+token_verifier.profile_loader = load_user_profile
+
+async def change_user_plan(change: PlanChange):
+    """Store a user's new plan and drop their cached profile so it applies on the next request"""
+    if change.ttl is None:
+        await state_io(state_backend.delete, plan_key(change.user_id))
+    else:
+        await state_io(state_backend.set, plan_key(change.user_id), change.plan.encode(), change.ttl)
+    token_verifier.invalidate_user(change.user_id)
+    print(f"💳 Plan of user {change.user_id} is now {change.plan}")
+
+# Dependency to verify JWT token
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserProfile:
     """
     Verify JWT token and return current user
-    TODO: Implement proper Supabase JWT verification
+    
+    AUTH_MODE=supabase verifies the Supabase access token (claims and
+    profile are cached, see services.auth). The default mock mode accepts
+    any token and creates a demo user per token.
     """
     token = credentials.credentials
     
+    if settings.auth_mode == "supabase":
+        try:
+            return await token_verifier.get_user(token)
+        except AuthError as e:
+            raise HTTPException(
+                status_code=401,
+                detail=f"Token inválido: {str(e)}",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+    
     # Mock user for development
-    if token in user_sessions:
-        return user_sessions[token]
+    session = await state_io(user_sessions.get, token)
+    if session is not None:
+        return await with_current_plan(session)
     
     # For demo purposes, create a mock user
     mock_user = UserProfile(
         id=str(uuid.uuid4()),
         email="demo@academicassistant.com.br",
         full_name="Usuário Demo",
-        plan="free",
+        plan=settings.auth_mock_plan,
         usage_count=0,
         usage_month=datetime.now().month,
         created_at=datetime.now()
     )
-    user_sessions[token] = mock_user
+    await state_io(user_sessions.__setitem__, token, mock_user)
     return mock_user
 
+async def rate_limited_user(response: Response,
+                            current_user: UserProfile = Depends(get_current_user)) -> UserProfile:
+    """
+    Per-minute rate limit of the processing endpoints (GCRA per user)
+    
+    Sets X-RateLimit-Limit/Remaining/Reset on the response and answers 429
+    with Retry-After when the plan's requests_per_minute is exceeded.
+    """
+    if not settings.rate_limit_enabled:
+        return current_user
+    
+    limits = settings.rate_limits.get(current_user.plan, settings.rate_limits['free'])
+    decision = await state_io(
+        rate_limiter.check, current_user.id, limits['requests_per_minute'], settings.rate_limit_burst or None
+    )
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "Rate limit exceeded",
+                "message": f"Limite de {decision.limit} solicitações por minuto do plano {current_user.plan.upper()}. "
+                           f"Tente novamente em {decision.headers()['Retry-After']}s",
+                "retry_after": decision.retry_after
+            },
+            headers=decision.headers()
+        )
+    
+    response.headers.update(decision.headers())
+    return current_user
+
 async def check_rate_limit(user: UserProfile) -> RateLimitInfo:
     """
     Check if user has exceeded their plan limits
     """
     current_month = datetime.now().month
     
-    # Reset usage if new month
+    # Usage is counted by the quota service, so every worker sees the same number
+    user.usage_count = await state_io(quota_service.usage, user.id)
+    
+    # New month: the counter key rolled over, move the reset date
     if user.usage_month != current_month:
-        user.usage_count = 0
         user.usage_month = current_month
         user.usage_reset_date = datetime.now().replace(day=1) + timedelta(days=32)
         user.usage_reset_date = user.usage_reset_date.replace(day=1)
@@ -129,10 +262,27 @@ async def health_check():
         timestamp=datetime.now(),
         services={
             "ocr": True,
+            "ocr_queue": ocr_executor.has_capacity(),
+            **{
+                f"llm_{provider}": healthy
+                for provider, healthy in llm_router.provider_health(
+                    [provider for provider in LLM_PROVIDERS if llm_service.is_configured(provider)]
+                ).items()
+            },
             "database": True,  # TODO: Check Supabase connection
-            "redis": True      # TODO: Check Redis connection
+            "state": await state_io(state_backend.ping)
         },
-        uptime=time.time()
+        uptime=time.time(),
+        caches={
+            "ocr": ocr_result_cache.get_stats(),
+            "ocr_near_duplicates": phash_index.get_stats(),
+            "llm": semantic_cache.get_stats(),
+            "in_flight": single_flight.get_stats(),
+            "results": processing_requests.get_stats(),
+            "sessions": user_sessions.get_stats(),
+            "quota": quota_service.get_stats(),
+            "auth": token_verifier.get_stats()
+        }
     )
 
 # Root endpoint
@@ -168,35 +318,159 @@ async def get_user_usage(current_user: UserProfile = Depends(get_current_user)):
         plan=current_user.plan
     )
 
-# Main OCR + AI processing endpoint
-@app.post("/process", response_model=ProcessingResponse)
-async def process_image(
-    request: ImageUploadRequest,
-    current_user: UserProfile = Depends(get_current_user)
-):
+# Logout
+@app.post("/auth/logout", status_code=204)
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
-    Process image with OCR and AI explanation
+    Forget the token's cached claims (and its demo session in mock mode)
+    
+    A Supabase access token itself stays valid until it expires; the
+    client discards it and signs out of Supabase for the refresh token.
     """
-    # Check rate limits
-    rate_limit = await check_rate_limit(current_user)
-    if rate_limit.requests_remaining <= 0:
+    token = credentials.credentials
+    token_verifier.invalidate_token(token)
+    await state_io(user_sessions.__delitem__, token)
+    return Response(status_code=204)
+
+# Subscription webhook
+@app.post("/webhooks/stripe", include_in_schema=False)
+async def stripe_webhook(request: Request):
+    """
+    Apply plan upgrades, downgrades and cancellations from Stripe
+    
+    The body must carry a valid Stripe-Signature for STRIPE_WEBHOOK_SECRET
+    (404 when it is not configured). The new plan is seen on the user's
+    next request on this worker, and on other workers once their cached
+    profile expires (AUTH_PROFILE_TTL).
+    """
+    if not settings.stripe_webhook_secret:
+        raise HTTPException(status_code=404, detail="Not Found")
+    
+    body = await request.body()
+    try:
+        verify_stripe_signature(body, request.headers.get("Stripe-Signature"))
+        event = json.loads(body)
+    except (WebhookSignatureError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Webhook inválido: {str(e)}")
+    
+    change = plan_change_from_event(event)
+    if change:
+        await change_user_plan(change)
+    return {"received": True}
+
+def build_template_explanation(text: str, plan: str) -> str:
+    """Static explanation used when live LLM calls are off or every provider failed"""
+    plan_config = PLAN_FEATURES.get(plan, PLAN_FEATURES['free'])
+    return f"""
+        **Texto extraído:** {text}
+        
+        **Análise (Plano {plan_config['name']}):**
+        
+        Com base no texto extraído, posso ajudar a explicar o conteúdo. 
+        
+        {"✨ Esta é uma explicação detalhada do plano " + plan_config['name'] + "!" if plan != 'free' else "💡 Upgrade para o plano Pro para explicações mais detalhadas!"}
+        
+        **Próximos passos:**
+        1. Revise o conteúdo extraído
+        2. Faça perguntas específicas se necessário
+        3. {"Aproveite as funcionalidades premium!" if plan != 'free' else "Considere fazer upgrade para mais recursos!"}
+        """
+
+async def store_completed_result(request_id: str, user: UserProfile, created_at: datetime, ocr_result: OCRResult,
+                                 llm_response: Optional[LLMResponse], ai_response: str,
+                                 start_time: float) -> ProcessingResult:
+    """Build the COMPLETED result and store it"""
+    total_time = time.time() - start_time
+    
+    result = ProcessingResult(
+        request_id=request_id,
+        status=RequestStatus.COMPLETED,
+        ocr_result=ocr_result,
+        llm_response=llm_response,
+        extracted_text=ocr_result.text,
+        ai_explanation=ai_response,
+        subject_detected="Geral",  # TODO: Implement subject detection
+        confidence_score=ocr_result.confidence,
+        processing_time_total=total_time,
+        created_at=created_at,
+        user_id=user.id
+    )
+    
+    metrics.histogram("processing_seconds").observe(total_time)
+    
+    # Store result
+    await state_io(processing_requests.__setitem__, request_id, result)
+    await state_io(history_store.add, user.id, request_id, created_at)
+    
+    print(f"✅ Request {request_id} completed in {total_time:.2f}s")
+    return result
+
+async def reserve_quota(user: UserProfile) -> QuotaReservation:
+    """
+    Hold one request of the user's monthly quota before any work starts
+    
+    Raises 429 when the quota is used up. The caller settles the
+    reservation with settle_quota once the request finished or failed.
+    """
+    plan_config = PLAN_FEATURES.get(user.plan, PLAN_FEATURES['free'])
+    reservation = await state_io(quota_service.reserve, user.id, plan_config['requests_per_month'])
+    if reservation is None:
+        rate_limit = await check_rate_limit(user)
         raise HTTPException(
             status_code=429,
             detail={
                 "error": "Rate limit exceeded",
-                "message": f"Você excedeu o limite de {rate_limit.plan_limit} solicitações por mês do plano {current_user.plan.upper()}",
+                "message": f"Você excedeu o limite de {rate_limit.plan_limit} solicitações por mês do plano {user.plan.upper()}",
                 "reset_time": rate_limit.reset_time.isoformat(),
                 "upgrade_url": "/plans"
             }
         )
+    user.usage_count = reservation.used
+    daily_activity.record(user.id, PlanType(user.plan).value)
+    return reservation
+
+async def settle_quota(reservation: QuotaReservation, success: bool):
+    """Commit the reserved request when it succeeded, refund it otherwise (and count the outcome)"""
+    metrics.counter("processing_requests_total", status="completed" if success else "failed").inc()
+    if success:
+        quota_service.commit(reservation)
+    else:
+        await state_io(quota_service.release, reservation)
+
+async def extract_text_coalesced(image_data: Union[str, bytes], plan: str) -> OCRResult:
+    """OCR where identical in-flight uploads (same content and plan) share one run"""
+    ocr_result, shared = await single_flight.do(
+        ("ocr", plan, content_key(image_data)),
+        lambda: ocr_executor.run(run_extraction, image_data, plan, plan=plan)
+    )
+    if shared:
+        print(f"🤝 Reused in-flight OCR for identical upload ({plan})")
+    return ocr_result
+
+async def explain_coalesced(text: str, plan: str, question: Optional[str] = None,
+                            subject: Optional[str] = None) -> Optional[LLMResponse]:
+    """LLM explanation where identical in-flight prompts share one provider call"""
+    llm_response, _ = await single_flight.do(
+        ("llm", plan, content_key(text, question, subject)),
+        lambda: llm_service.explain(text, plan, question, subject)
+    )
+    return llm_response
+
+async def run_pipeline(request_id: str, image_data: Union[str, bytes], user: UserProfile,
+                       created_at: datetime, question: Optional[str] = None,
+                       subject: Optional[str] = None) -> ProcessingResponse:
+    """
+    OCR + AI pipeline shared by the sync and async /process modes
     
-    request_id = str(uuid.uuid4())
+    Stores the result on success. OCRQueueFullError is propagated so each
+    mode can decide how to handle backpressure.
+    """
     start_time = time.time()
     
     try:
-        # Step 1: OCR Processing
+        # Step 1: OCR Processing (off the event loop, prioritized by plan, coalesced)
         print(f"🔍 Processing OCR for request {request_id}")
-        ocr_result = ocr_service.extract_text(request.image_data, current_user.plan)
+        ocr_result = await extract_text_coalesced(image_data, user.plan)
         
         if not ocr_result.success or not ocr_result.text.strip():
             return ProcessingResponse(
@@ -207,51 +481,23 @@ async def process_image(
                 message="Não foi possível extrair texto da imagem. Tente uma imagem mais clara."
             )
         
-        # Step 2: AI Processing (mock for now)
+        # Step 2: AI Processing (pooled async provider clients, template when disabled)
         print(f"🤖 Processing AI for request {request_id}")
         
-        # Mock AI response based on plan
-        plan_config = PLAN_FEATURES.get(current_user.plan, PLAN_FEATURES['free'])
-        ai_response = f"""
-        **Texto extraído:** {ocr_result.text}
-        
-        **Análise (Plano {plan_config['name']}):**
-        
-        Com base no texto extraído, posso ajudar a explicar o conteúdo. 
-        
-        {"✨ Esta é uma explicação detalhada do plano " + plan_config['name'] + "!" if current_user.plan != 'free' else "💡 Upgrade para o plano Pro para explicações mais detalhadas!"}
-        
-        **Próximos passos:**
-        1. Revise o conteúdo extraído
-        2. Faça perguntas específicas se necessário
-        3. {"Aproveite as funcionalidades premium!" if current_user.plan != 'free' else "Considere fazer upgrade para mais recursos!"}
-        """
+        llm_response = None
+        if settings.llm_live_calls:
+            llm_response = await explain_coalesced(ocr_result.text, user.plan, question, subject)
         
-        # Step 3: Create result
-        total_time = time.time() - start_time
+        if llm_response and llm_response.success:
+            ai_response = llm_response.response
+        else:
+            ai_response = build_template_explanation(ocr_result.text, user.plan)
         
-        result = ProcessingResult(
-            request_id=request_id,
-            status=RequestStatus.COMPLETED,
-            ocr_result=ocr_result,
-            llm_response=None,  # TODO: Implement actual LLM integration
-            extracted_text=ocr_result.text,
-            ai_explanation=ai_response,
-            subject_detected="Geral",  # TODO: Implement subject detection
-            confidence_score=ocr_result.confidence,
-            processing_time_total=total_time,
-            created_at=datetime.now(),
-            user_id=current_user.id
+        # Step 3: Create and store result
+        result = await store_completed_result(
+            request_id, user, created_at, ocr_result, llm_response, ai_response, start_time
         )
         
-        # Update usage count
-        current_user.usage_count += 1
-        
-        # Store result
-        processing_requests[request_id] = result
-        
-        print(f"✅ Request {request_id} completed in {total_time:.2f}s")
-        
         return ProcessingResponse(
             success=True,
             request_id=request_id,
@@ -260,6 +506,9 @@ async def process_image(
             message="Processamento concluído com sucesso!"
         )
         
+    except OCRQueueFullError:
+        raise
+        
     except Exception as e:
         print(f"❌ Error processing request {request_id}: {str(e)}")
         
@@ -271,22 +520,439 @@ async def process_image(
             message=f"Erro interno no processamento: {str(e)}"
         )
 
+async def run_processing_job(request_id: str, image_data: Union[str, bytes], user: UserProfile,
+                             created_at: datetime, question: Optional[str] = None,
+                             subject: Optional[str] = None,
+                             reservation: Optional[QuotaReservation] = None) -> ProcessingResponse:
+    """
+    Background body of /process?mode=async
+    
+    Moves the stored result through PENDING -> PROCESSING -> COMPLETED/FAILED.
+    A saturated OCR queue is waited out instead of failing the accepted job.
+    The quota reservation is refunded unless the job completes. When the
+    PENDING entry was evicted meanwhile, the job record is rebuilt.
+    """
+    start_time = time.time()
+    fallback = ProcessingResult(
+        request_id=request_id,
+        status=RequestStatus.FAILED,
+        processing_time_total=0.0,
+        created_at=created_at,
+        user_id=user.id
+    )
+    
+    response = None
+    try:
+        stored = await state_io(processing_requests.get, request_id)
+        await state_io(
+            processing_requests.__setitem__, request_id,
+            (stored or fallback).model_copy(update={"status": RequestStatus.PROCESSING})
+        )
+        
+        for attempt in range(settings.job_busy_retries + 1):
+            try:
+                response = await run_pipeline(request_id, image_data, user, created_at, question, subject)
+                break
+            except OCRQueueFullError as e:
+                if attempt == settings.job_busy_retries:
+                    response = ProcessingResponse(
+                        success=False,
+                        request_id=request_id,
+                        status=RequestStatus.FAILED,
+                        error="OCR_BUSY",
+                        message="Serviço de OCR sobrecarregado. Tente novamente em instantes."
+                    )
+                    break
+                await asyncio.sleep(e.retry_after)
+                
+    except Exception as e:
+        print(f"❌ Error processing job {request_id}: {str(e)}")
+        response = ProcessingResponse(
+            success=False,
+            request_id=request_id,
+            status=RequestStatus.FAILED,
+            error="PROCESSING_ERROR",
+            message=f"Erro interno no processamento: {str(e)}"
+        )
+        
+    finally:
+        if reservation:
+            await settle_quota(reservation, response is not None and response.success)
+    
+    if not response.success:
+        stored = await state_io(processing_requests.get, request_id)
+        failed = (stored or fallback).model_copy(update={
+            "status": RequestStatus.FAILED,
+            "error": response.error,
+            "processing_time_total": time.time() - start_time
+        })
+        await state_io(processing_requests.__setitem__, request_id, failed)
+        response.result = failed
+    
+    return response
+
+async def fail_processing_job(request_id: str, user: UserProfile, created_at: datetime,
+                              error: Exception) -> ProcessingResponse:
+    """
+    Record a crashed async job as FAILED (JobRunner on_error hook)
+    
+    Runs when run_processing_job itself raised, e.g. because the state
+    backend failed while it stored the outcome. The FAILED response is
+    returned (and sent to the callback) even when storing it fails too.
+    """
+    failed = ProcessingResult(
+        request_id=request_id,
+        status=RequestStatus.FAILED,
+        error="PROCESSING_ERROR",
+        processing_time_total=0.0,
+        created_at=created_at,
+        user_id=user.id
+    )
+    try:
+        await state_io(processing_requests.__setitem__, request_id, failed)
+    except Exception as e:
+        print(f"❌ Could not store the failure of job {request_id}: {str(e)}")
+    
+    return ProcessingResponse(
+        success=False,
+        request_id=request_id,
+        status=RequestStatus.FAILED,
+        result=failed,
+        error="PROCESSING_ERROR",
+        message=f"Erro interno no processamento: {str(error)}"
+    )
+
+async def submit_processing(image_data: Union[str, bytes], user: UserProfile, mode: str,
+                            background_tasks: BackgroundTasks, response: Response,
+                            callback_url: Optional[str] = None, question: Optional[str] = None,
+                            subject: Optional[str] = None) -> ProcessingResponse:
+    """
+    Shared body of the /process endpoints
+    
+    mode=sync answers with the finished result. mode=async answers 202
+    right away and runs the pipeline in the background. A callback_url
+    that is not a public http(s) endpoint is refused with 400; both modes
+    answer 503 with Retry-After when their queue is full.
+    """
+    if mode == "async" and callback_url:
+        try:
+            await resolve_callback_url(callback_url)
+        except CallbackURLError as e:
+            raise HTTPException(status_code=400, detail=f"callback_url inválida: {str(e)}")
+    
+    reservation = await reserve_quota(user)
+    
+    request_id = str(uuid.uuid4())
+    created_at = datetime.now()
+    
+    if mode == "async":
+        try:
+            job_runner.admit()
+        except JobQueueFullError as e:
+            print(f"⏳ Job queue full, rejecting request {request_id}")
+            await state_io(quota_service.release, reservation)
+            raise HTTPException(
+                status_code=503,
+                detail="Fila de processamento cheia. Tente novamente em instantes.",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        
+        try:
+            pending = ProcessingResult(
+                request_id=request_id,
+                status=RequestStatus.PENDING,
+                processing_time_total=0.0,
+                created_at=created_at,
+                user_id=user.id
+            )
+            await state_io(processing_requests.__setitem__, request_id, pending)
+            await state_io(history_store.add, user.id, request_id, created_at)
+            
+            background_tasks.add_task(
+                job_runner.run,
+                request_id,
+                partial(run_processing_job, request_id, image_data, user, created_at, question, subject, reservation),
+                callback_url,
+                admitted=True,
+                on_error=partial(fail_processing_job, request_id, user, created_at)
+            )
+        except BaseException:
+            # The job never got scheduled: hand back the quota and the waiting slot
+            job_runner.cancel_admission()
+            await state_io(quota_service.release, reservation)
+            raise
+        
+        response.status_code = status.HTTP_202_ACCEPTED
+        response.headers["Location"] = f"/process/{request_id}"
+        
+        return ProcessingResponse(
+            success=True,
+            request_id=request_id,
+            status=RequestStatus.PENDING,
+            result=pending.model_copy(),
+            message=f"Solicitação recebida. Acompanhe o status em /process/{request_id}"
+        )
+    
+    result = None
+    try:
+        result = await run_pipeline(request_id, image_data, user, created_at, question, subject)
+        return result
+        
+    except OCRQueueFullError as e:
+        print(f"⏳ OCR queue saturated, rejecting request {request_id}")
+        raise HTTPException(
+            status_code=503,
+            detail="Serviço de OCR sobrecarregado. Tente novamente em instantes.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+        
+    finally:
+        await settle_quota(reservation, result is not None and result.success)
+
+def serialize_processing(result: ProcessingResponse, response: Response, endpoint: str) -> Response:
+    """
+    JSON-encode a ProcessingResponse with pydantic's serializer (timed)
+    
+    Returning a Response skips FastAPI's re-validation and jsonable_encoder
+    pass; the status code and headers set on the injected response
+    (202 + Location, X-RateLimit-*) are carried over.
+    """
+    with metrics.time("response_serialize_seconds", endpoint=endpoint):
+        body = result.model_dump_json()
+    return Response(
+        content=body,
+        status_code=response.status_code or status.HTTP_200_OK,
+        headers=dict(response.headers),
+        media_type="application/json"
+    )
+
+# Main OCR + AI processing endpoint
+@app.post("/process", response_model=ProcessingResponse)
+async def process_image(
+    request: ImageUploadRequest,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    mode: str = Query("sync", pattern="^(sync|async)$"),
+    current_user: UserProfile = Depends(rate_limited_user)
+):
+    """
+    Process image with OCR and AI explanation
+    
+    mode=sync (default) answers with the finished result. mode=async answers
+    202 right away and runs the pipeline in the background; poll
+    GET /process/{request_id} or pass callback_url to be notified.
+    """
+    result = await submit_processing(
+        request.image_data, current_user, mode, background_tasks, response,
+        str(request.callback_url) if request.callback_url else None,
+        request.question, request.subject
+    )
+    return serialize_processing(result, response, "process")
+
+# Multipart upload endpoint (no base64 round-trip)
+@app.post(
+    "/process/upload",
+    response_model=ProcessingResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["file"],
+                        "properties": {
+                            "file": {"type": "string", "format": "binary"},
+                            "question": {"type": "string"},
+                            "subject": {"type": "string"},
+                            "callback_url": {"type": "string", "format": "uri"}
+                        }
+                    }
+                }
+            }
+        }
+    }
+)
+async def process_upload(
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    response: Response,
+    mode: str = Query("sync", pattern="^(sync|async)$"),
+    current_user: UserProfile = Depends(rate_limited_user)
+):
+    """
+    Process a multipart/form-data image upload
+    
+    The body is parsed as it streams in, so files over settings.max_file_size
+    are rejected with 413 before the rest of the body is read. The raw bytes
+    go straight to the OCR layer without base64 encoding.
+    """
+    try:
+        upload = await read_image_upload(http_request.headers, http_request.stream())
+    except UploadTooLargeError as e:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Arquivo excede o limite de {e.max_size // (1024 * 1024)}MB"
+        )
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    result = await submit_processing(
+        upload.data, current_user, mode, background_tasks, response,
+        upload.fields.get("callback_url") or None,
+        upload.fields.get("question") or None, upload.fields.get("subject") or None
+    )
+    return serialize_processing(result, response, "upload")
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def stream_pipeline(request_id: str, image_data: str, user: UserProfile, created_at: datetime,
+                          question: Optional[str] = None, subject: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    OCR + AI pipeline as an SSE stream
+    
+    Events: ocr (extracted text, sent as soon as OCR finishes), token (LLM
+    text deltas), done (the stored ProcessingResponse) and error.
+    """
+    start_time = time.time()
+    
+    try:
+        ocr_result = await extract_text_coalesced(image_data, user.plan)
+    except OCRQueueFullError as e:
+        yield sse_event("error", {
+            "request_id": request_id,
+            "error": "OCR_BUSY",
+            "message": "Serviço de OCR sobrecarregado. Tente novamente em instantes.",
+            "retry_after": e.retry_after
+        })
+        return
+    except Exception as e:
+        print(f"❌ Error processing request {request_id}: {str(e)}")
+        yield sse_event("error", {
+            "request_id": request_id,
+            "error": "PROCESSING_ERROR",
+            "message": f"Erro interno no processamento: {str(e)}"
+        })
+        return
+    
+    if not ocr_result.success or not ocr_result.text.strip():
+        yield sse_event("error", {
+            "request_id": request_id,
+            "error": "OCR_FAILED",
+            "message": "Não foi possível extrair texto da imagem. Tente uma imagem mais clara."
+        })
+        return
+    
+    yield sse_event("ocr", {
+        "request_id": request_id,
+        "text": ocr_result.text,
+        "confidence": ocr_result.confidence,
+        "provider": ocr_result.provider.value
+    })
+    
+    llm_response = None
+    if settings.llm_live_calls:
+        async for item in llm_service.explain_stream(ocr_result.text, user.plan, question, subject):
+            if isinstance(item, LLMResponse):
+                llm_response = item
+            else:
+                yield sse_event("token", {"text": item})
+    
+    if llm_response and llm_response.success:
+        ai_response = llm_response.response
+    else:
+        # Live calls off or no provider finished; the done event carries the template
+        ai_response = build_template_explanation(ocr_result.text, user.plan)
+        if not llm_response:
+            yield sse_event("token", {"text": ai_response})
+    
+    result = await store_completed_result(
+        request_id, user, created_at, ocr_result, llm_response, ai_response, start_time
+    )
+    yield sse_event("done", ProcessingResponse(
+        success=True,
+        request_id=request_id,
+        status=RequestStatus.COMPLETED,
+        result=result,
+        message="Processamento concluído com sucesso!"
+    ).model_dump(mode="json"))
+
+class StreamSettlement:
+    """
+    Quota settlement of one streamed request
+
+    The stream only marks whether the done event went out; settle() runs
+    as the response's background task, which Starlette awaits even when
+    the client disconnected before the first chunk (the generator's own
+    finally would never run then) and shields from the disconnect cancel.
+    """
+    
+    def __init__(self, reservation: QuotaReservation):
+        self.reservation = reservation
+        self.completed = False
+    
+    async def track(self, events: AsyncIterator[str]) -> AsyncIterator[str]:
+        async for event in events:
+            if event.startswith("event: done"):
+                self.completed = True
+            yield event
+    
+    async def settle(self):
+        """Commit the reservation once the done event went out; refund on error or client disconnect"""
+        with anyio.CancelScope(shield=True):
+            await settle_quota(self.reservation, self.completed)
+
+# Streaming OCR + AI endpoint
+@app.post("/process/stream")
+async def process_image_stream(
+    request: ImageUploadRequest,
+    response: Response,
+    current_user: UserProfile = Depends(rate_limited_user)
+):
+    """
+    Process image and stream the result as Server-Sent Events
+    
+    The OCR text is sent as soon as it is ready and the explanation follows
+    token by token, so the first bytes arrive after OCR instead of after
+    the whole pipeline.
+    """
+    settlement = StreamSettlement(await reserve_quota(current_user))
+    
+    return StreamingResponse(
+        settlement.track(stream_pipeline(
+            str(uuid.uuid4()), request.image_data, current_user, datetime.now(),
+            request.question, request.subject
+        )),
+        background=BackgroundTask(settlement.settle),
+        media_type="text/event-stream",
+        # StreamingResponse is returned as-is, so copy the rate limit headers over
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **response.headers}
+    )
+
 # Get processing result
 @app.get("/process/{request_id}", response_model=ProcessingResponse)
 async def get_processing_result(
     request_id: str,
+    response: Response,
+    wait: float = Query(0, ge=0, description="Seconds to long-poll while the job is still running"),
     current_user: UserProfile = Depends(get_current_user)
 ):
-    """Get processing result by request ID"""
+    """
+    Get processing result by request ID
     
-    if request_id not in processing_requests:
+    With ?wait=N the call holds for up to N seconds (capped by
+    settings.job_long_poll_max) while the job is pending or processing.
+    """
+    
+    result = await state_io(processing_requests.get, request_id)
+    if result is None:
         raise HTTPException(
             status_code=404,
             detail="Request not found"
         )
     
-    result = processing_requests[request_id]
-    
     # Check if user owns this request
     if result.user_id != current_user.id:
         raise HTTPException(
@@ -294,36 +960,134 @@ async def get_processing_result(
             detail="Access denied"
         )
     
-    return ProcessingResponse(
-        success=True,
+    deadline = time.time() + min(wait, settings.job_long_poll_max)
+    while result.status in (RequestStatus.PENDING, RequestStatus.PROCESSING) and time.time() < deadline:
+        await asyncio.sleep(settings.job_poll_interval)
+        result = await state_io(processing_requests.get, request_id, result)
+    
+    if result.status == RequestStatus.FAILED:
+        message = "Falha no processamento"
+    elif result.status == RequestStatus.COMPLETED:
+        message = "Resultado recuperado com sucesso"
+    else:
+        message = "Processamento em andamento"
+    
+    return serialize_processing(ProcessingResponse(
+        success=result.status != RequestStatus.FAILED,
         request_id=request_id,
         status=result.status,
         result=result,
-        message="Resultado recuperado com sucesso"
-    )
+        error=result.error,
+        message=message
+    ), response, "result")
+
+def history_page(user_id: str, limit: int, before: Optional[HistoryCursor]):
+    """
+    Newest history entries of a user whose results still exist
+    
+    Entries whose result is gone (evicted or expired) are dropped from the
+    index on the way, so the page, next_cursor and total all come from
+    live entries. One extra live entry is looked up to decide whether
+    there is a next page.
+    
+    Returns:
+        (summaries, next_cursor or None, total)
+    """
+    page = []
+    has_more = False
+    while not has_more:
+        wanted = limit + 1 - len(page)
+        entries = history_store.latest(user_id, wanted, before)
+        for created_at, request_id in entries:
+            summary = processing_requests.get_summary(request_id)
+            if summary is None:
+                history_store.remove(user_id, request_id, created_at)
+            elif len(page) < limit:
+                page.append(((created_at, request_id), summary))
+            else:
+                has_more = True
+                break
+        if len(entries) < wanted:
+            break
+        before = entries[-1]
+    
+    next_cursor = format_history_cursor(*page[-1][0]) if has_more else None
+    return [summary for _, summary in page], next_cursor, history_store.count(user_id)
 
 # List user's processing history
 @app.get("/history")
 async def get_processing_history(
-    limit: int = 10,
+    limit: int = Query(10, ge=1, le=100),
+    before: Optional[str] = Query(None, description="Cursor '<created_at>,<request_id>' from next_cursor"),
     current_user: UserProfile = Depends(get_current_user)
 ):
-    """Get user's processing history"""
+    """
+    Get user's processing history, newest first
     
-    user_requests = [
-        result for result in processing_requests.values()
-        if result.user_id == current_user.id
-    ]
+    Reads the per-user history index instead of scanning every stored
+    request and returns summaries; the full result comes from
+    GET /process/{id}. Pass the returned next_cursor as ?before= for the
+    next page.
+    """
+    try:
+        cursor = parse_history_cursor(before) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
     
-    # Sort by creation time (newest first)
-    user_requests.sort(key=lambda x: x.created_at, reverse=True)
+    summaries, next_cursor, total = await state_io(history_page, current_user.id, limit, cursor)
     
     return {
-        "requests": user_requests[:limit],
-        "total": len(user_requests),
-        "limit": limit
+        "requests": summaries,
+        "total": total,
+        "limit": limit,
+        "next_cursor": next_cursor
     }
 
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Histograms and counters in Prometheus text format
+    
+    Values are per worker process (scrape every worker). OCR stage
+    timings are only visible here with OCR_EXECUTOR_MODE=thread.
+    """
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+async def require_metrics_token(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
+):
+    """Internal access only: Bearer METRICS_TOKEN (404 when metrics or the token are not configured)"""
+    if not settings.metrics_enabled or not settings.metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials, settings.metrics_token):
+        raise HTTPException(
+            status_code=401,
+            detail="Token de métricas inválido",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+# Aggregated system metrics
+@app.get("/metrics/system", response_model=SystemMetrics, dependencies=[Depends(require_metrics_token)])
+async def get_system_metrics():
+    """Today's activity plus response time and error rate since startup (internal)"""
+    
+    active_users, requests_today, plans = daily_activity.snapshot()
+    processing = metrics.histogram("processing_seconds")
+    completed = metrics.counter("processing_requests_total", status="completed").value
+    failed = metrics.counter("processing_requests_total", status="failed").value
+    
+    return SystemMetrics(
+        active_users=active_users,
+        total_requests_today=requests_today,
+        avg_response_time=processing.sum / processing.count if processing.count else 0.0,
+        p95_response_time=processing.quantile(0.95),
+        error_rate=failed / (completed + failed) if completed + failed else 0.0,
+        popular_plans=plans
+    )
+
 # Plans information
 @app.get("/plans")
 async def get_plans():
@@ -346,7 +1110,8 @@ async def http_exception_handler(request, exc):
             "error": "HTTP_ERROR",
             "message": str(exc.detail),
             "status_code": exc.status_code
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
@@ -41,6 +41,15 @@ class ImageUploadRequest(BaseModel):
     image_data: str = Field(..., description="Base64 encoded image data")
     question: Optional[str] = Field(None, description="Specific question about the image")
     subject: Optional[str] = Field(None, description="Subject area (math, physics, etc.)")
+    callback_url: Optional[HttpUrl] = Field(None, description="URL notified when an async job finishes")
+
+class OCRWord(BaseModel):
+    text: str
+    confidence: float
+    left: int
+    top: int
+    width: int
+    height: int
 
 class OCRResult(BaseModel):
     provider: OCRProvider
@@ -49,6 +58,7 @@ class OCRResult(BaseModel):
     processing_time: float
     success: bool = True
     error: Optional[str] = None
+    words: Optional[List[OCRWord]] = None
 
 class LLMResponse(BaseModel):
     provider: LLMProvider
@@ -71,6 +81,19 @@ class ProcessingResult(BaseModel):
     processing_time_total: float
     created_at: datetime
     user_id: str
+    error: Optional[str] = None
+
+class ProcessingSummary(BaseModel):
+    """History listing entry; the full result comes from GET /process/{id}"""
+    request_id: str
+    status: RequestStatus
+    created_at: datetime
+    subject_detected: Optional[str] = None
+    confidence_score: Optional[float] = None
+    processing_time_total: float
+    error: Optional[str] = None
+    text_preview: Optional[str] = None
+    user_id: Optional[str] = None
 
 class ProcessingResponse(BaseModel):
     success: bool
@@ -123,9 +146,10 @@ class SystemMetrics(BaseModel):
     active_users: int
     total_requests_today: int
     avg_response_time: float
+    p95_response_time: Optional[float] = None
     error_rate: float
     popular_plans: Dict[str, int]
-    revenue_monthly: float
+    revenue_monthly: Optional[float] = None  # Not tracked by the API (payment provider data)
 
 # Configuration Models
 class PlanConfig(BaseModel):
@@ -162,6 +186,7 @@ class HealthCheck(BaseModel):
     timestamp: datetime
     services: Dict[str, bool]
     uptime: float
+    caches: Optional[Dict[str, Dict[str, Any]]] = None
 
 # Payment Models
 class PaymentIntent(BaseModel):
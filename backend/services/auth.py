@@ -0,0 +1,209 @@
+"""
+Supabase JWT authentication
+Cached signing keys + verified-claims LRU + short-lived profile cache
+"""
+
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from models import UserProfile, PlanType
+from services.result_store import BoundedTTLDict
+from config import settings
+
+try:
+    from jose import jwk, jwt, JOSEError
+    JOSE_AVAILABLE = True
+except ImportError:
+    JOSE_AVAILABLE = False
+
+class AuthError(Exception):
+    """Token missing, malformed, expired or not signed by a trusted key"""
+
+ProfileLoader = Callable[[Dict[str, Any]], Awaitable[UserProfile]]
+
+async def profile_from_claims(claims: Dict[str, Any]) -> UserProfile:
+    """Default profile loader: everything Supabase puts in the access token"""
+    user_metadata = claims.get("user_metadata") or {}
+    app_metadata = claims.get("app_metadata") or {}
+    plan = app_metadata.get("plan", PlanType.FREE.value)
+    return UserProfile(
+        id=claims["sub"],
+        email=claims.get("email", ""),
+        full_name=user_metadata.get("full_name"),
+        avatar_url=user_metadata.get("avatar_url"),
+        plan=plan if plan in {p.value for p in PlanType} else PlanType.FREE,
+        usage_month=datetime.now().month,
+        created_at=datetime.fromtimestamp(claims.get("iat", time.time()))
+    )
+
+class JWKSCache:
+    """
+    Signing keys from the project's JWKS endpoint, parsed once
+
+    Keys are refreshed after auth_jwks_ttl seconds, or early when a token
+    names an unknown kid (key rotation), but at most once every
+    auth_jwks_min_refresh seconds so garbage kids cannot hammer the
+    endpoint. Concurrent refreshes share one fetch.
+    """
+
+    def __init__(self, url: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.url = url or settings.auth_jwks_url or f"{settings.supabase_url}/auth/v1/.well-known/jwks.json"
+        self._transport = transport
+        self._keys: Dict[str, Any] = {}
+        self._fetched_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+        # Statistics
+        self._refreshes = 0
+
+    async def _refresh(self):
+        async with httpx.AsyncClient(transport=self._transport, timeout=settings.auth_jwks_timeout) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+        keys = {}
+        for key_data in response.json().get("keys", []):
+            if "kid" in key_data:
+                keys[key_data["kid"]] = jwk.construct(key_data, key_data.get("alg"))
+        self._keys = keys
+        self._fetched_at = time.time()
+        self._refreshes += 1
+        print(f"🔑 Loaded {len(keys)} JWT signing keys")
+
+    async def get_key(self, kid: Optional[str]):
+        now = time.time()
+        key = self._keys.get(kid)
+        if key is not None and now - self._fetched_at < settings.auth_jwks_ttl:
+            return key
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another request may have refreshed while this one waited
+            key = self._keys.get(kid)
+            stale = time.time() - self._fetched_at >= settings.auth_jwks_ttl
+            if (key is None or stale) and time.time() - self._fetched_at >= settings.auth_jwks_min_refresh:
+                try:
+                    await self._refresh()
+                except (httpx.HTTPError, ValueError, JOSEError) as e:
+                    # Keep serving the keys we have
+                    print(f"⚠️ JWKS refresh failed: {str(e)}")
+                key = self._keys.get(kid)
+
+        if key is None:
+            raise AuthError("Unknown signing key")
+        return key
+
+class TokenVerifier:
+    """
+    Verifies Supabase access tokens and resolves the user profile
+
+    A token's claims are cached (by SHA-256 of the token) until the token
+    expires, so only the first request with a token pays for the signature
+    check; later ones are a dict lookup. Profiles are cached for
+    auth_profile_ttl seconds; call invalidate_user() when a profile
+    changes (plan upgrade, webhook) and invalidate_token() on logout.
+    """
+
+    def __init__(self, jwks: Optional[JWKSCache] = None, profile_loader: Optional[ProfileLoader] = None):
+        self.jwks = jwks or JWKSCache()
+        self.profile_loader = profile_loader or profile_from_claims
+        self._claims: BoundedTTLDict[Dict[str, Any]] = BoundedTTLDict(
+            settings.auth_claims_cache_size, settings.auth_claims_max_ttl
+        )
+        self._profiles: BoundedTTLDict[UserProfile] = BoundedTTLDict(
+            settings.auth_profile_cache_size, settings.auth_profile_ttl
+        )
+
+        # Statistics
+        self._claims_hits = 0
+        self._verifications = 0
+        self._failures = 0
+
+    @staticmethod
+    def _cache_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    async def _decode(self, token: str) -> Dict[str, Any]:
+        """Full signature and claims check"""
+        if not JOSE_AVAILABLE:
+            raise AuthError("python-jose is not installed")
+        try:
+            header = jwt.get_unverified_header(token)
+            algorithm = header.get("alg")
+            if algorithm not in settings.auth_jwt_algorithms:
+                raise AuthError(f"Algorithm {algorithm} not allowed")
+            if algorithm.startswith("HS"):
+                if not settings.supabase_jwt_secret:
+                    raise AuthError("SUPABASE_JWT_SECRET is not configured")
+                key = settings.supabase_jwt_secret
+            else:
+                key = await self.jwks.get_key(header.get("kid"))
+            return jwt.decode(
+                token, key, algorithms=[algorithm],
+                audience=settings.auth_jwt_audience,
+                options={"verify_aud": bool(settings.auth_jwt_audience), "leeway": settings.auth_jwt_leeway}
+            )
+        except JOSEError as e:
+            raise AuthError(str(e))
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """Verified claims of the token (cached until it expires)"""
+        cache_key = self._cache_key(token)
+        claims = self._claims.get(cache_key)
+        if claims is not None:
+            self._claims_hits += 1
+            return claims
+
+        try:
+            claims = await self._decode(token)
+        except AuthError:
+            self._failures += 1
+            raise
+        self._verifications += 1
+
+        if "sub" not in claims:
+            raise AuthError("Token has no subject")
+        ttl = min(settings.auth_claims_max_ttl, claims.get("exp", 0) - time.time())
+        if ttl > 0:
+            self._claims.set(cache_key, claims, ttl)
+        return claims
+
+    async def get_user(self, token: str) -> UserProfile:
+        """Profile of the token's user (claims and profile both cached)"""
+        claims = await self.verify(token)
+        profile = self._profiles.get(claims["sub"])
+        if profile is None:
+            profile = await self.profile_loader(claims)
+            self._profiles[claims["sub"]] = profile
+        return profile.model_copy()
+
+    def invalidate_user(self, user_id: str):
+        """Drop a cached profile so the next request reloads it"""
+        if user_id in self._profiles:
+            del self._profiles[user_id]
+
+    def invalidate_token(self, token: str):
+        """Forget a token's verified claims (logout, revocation)"""
+        cache_key = self._cache_key(token)
+        if cache_key in self._claims:
+            del self._claims[cache_key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return verifier statistics"""
+        total = self._claims_hits + self._verifications
+        return {
+            'claims_cached': len(self._claims),
+            'profiles_cached': len(self._profiles),
+            'claims_hit_rate': self._claims_hits / total if total else 0.0,
+            'verifications': self._verifications,
+            'failures': self._failures,
+            'jwks_refreshes': self.jwks._refreshes
+        }
+
+# Global instance
+token_verifier = TokenVerifier()
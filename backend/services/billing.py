@@ -0,0 +1,85 @@
+"""
+Subscription webhooks (Stripe)
+Signature check and plan changes, without the Stripe SDK
+"""
+
+import hashlib
+import hmac
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from models import PlanType
+from config import settings
+
+# Subscription states that keep the paid plan
+ACTIVE_SUBSCRIPTION_STATUSES = {"active", "trialing", "past_due"}
+
+# Plan kept after current_period_end while Stripe retries the renewal
+PLAN_GRACE_SECONDS = 3 * 24 * 3600
+
+class WebhookSignatureError(ValueError):
+    """Stripe-Signature header is missing, malformed, stale or does not match"""
+
+@dataclass
+class PlanChange:
+    user_id: str
+    plan: str
+    ttl: Optional[float]  # Seconds the plan stays valid; None for the free plan
+
+def verify_stripe_signature(body: bytes, header: Optional[str], secret: Optional[str] = None,
+                            tolerance: float = 300.0) -> None:
+    """
+    Check a Stripe-Signature header ("t=<timestamp>,v1=<hex>[,v1=...]")
+
+    v1 is HMAC-SHA256 of "{t}.{body}" with the endpoint's signing secret;
+    timestamps older than tolerance seconds are refused (replays).
+
+    Raises:
+        WebhookSignatureError: when the signature does not check out
+    """
+    if not header:
+        raise WebhookSignatureError("Missing Stripe-Signature header")
+    timestamp = None
+    signatures = []
+    for item in header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        raise WebhookSignatureError("Malformed Stripe-Signature header")
+    if abs(time.time() - int(timestamp)) > tolerance:
+        raise WebhookSignatureError("Stale webhook timestamp")
+
+    key = (secret or settings.stripe_webhook_secret or "").encode()
+    expected = hmac.new(key, timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise WebhookSignatureError("Signature mismatch")
+
+def plan_change_from_event(event: Dict[str, Any]) -> Optional[PlanChange]:
+    """
+    Plan change carried by a subscription event, None for other events
+
+    The checkout puts the user's ID and the bought plan in the
+    subscription metadata. A paid plan lasts until the end of the paid
+    period (plus a grace period); a cancelled or unpaid subscription
+    falls back to the free plan.
+    """
+    if not event.get("type", "").startswith("customer.subscription."):
+        return None
+    subscription = (event.get("data") or {}).get("object") or {}
+    metadata = subscription.get("metadata") or {}
+    user_id = metadata.get("user_id")
+    if not user_id:
+        return None
+
+    plan = metadata.get("plan")
+    if (event["type"] == "customer.subscription.deleted"
+            or subscription.get("status") not in ACTIVE_SUBSCRIPTION_STATUSES
+            or plan not in {p.value for p in PlanType}):
+        return PlanChange(user_id, PlanType.FREE.value, None)
+
+    period_end = subscription.get("current_period_end") or time.time() + 31 * 24 * 3600
+    return PlanChange(user_id, plan, max(60.0, period_end - time.time() + PLAN_GRACE_SECONDS))
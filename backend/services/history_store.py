@@ -0,0 +1,268 @@
+"""
+Per-user processing history index
+In-memory sorted index → SQLite (or any SQL) backed index → Redis sorted sets
+"""
+
+import bisect
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from services.state_backend import StateBackend, state_backend
+
+# (created_at, request_id): history order, request_id breaks timestamp ties
+HistoryCursor = Tuple[datetime, str]
+
+def parse_history_cursor(cursor: str) -> HistoryCursor:
+    """
+    Parse a '<created_at ISO>,<request_id>' cursor
+
+    Raises:
+        ValueError: when the cursor is malformed
+    """
+    created_at, separator, request_id = cursor.partition(",")
+    if not separator or not request_id:
+        raise ValueError("Cursor must be '<created_at>,<request_id>'")
+    return datetime.fromisoformat(created_at), request_id
+
+def format_history_cursor(created_at: datetime, request_id: str) -> str:
+    return f"{created_at.isoformat()},{request_id}"
+
+class MemoryHistoryStore:
+    """
+    Sorted (created_at, request_id) list per user
+
+    New requests are almost always the newest, so inserts are appends;
+    the latest N before a cursor is a bisect plus a slice. Entries expire
+    with the results they point to (result_store_ttl); expired ones are
+    skipped on read and swept every 1000 adds.
+    """
+
+    name = "memory"
+    blocking = False
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl or settings.result_store_ttl
+        self._index: Dict[str, List[HistoryCursor]] = {}
+        self._lock = threading.Lock()
+        self._adds = 0
+
+    def _cutoff(self) -> HistoryCursor:
+        """Sorts before every entry that has not expired yet"""
+        return datetime.now() - timedelta(seconds=self.ttl), ""
+
+    def add(self, user_id: str, request_id: str, created_at: datetime):
+        """Index a request (no-op when already indexed)"""
+        key = (created_at, request_id)
+        with self._lock:
+            entries = self._index.setdefault(user_id, [])
+            position = bisect.bisect_left(entries, key)
+            if position == len(entries) or entries[position] != key:
+                entries.insert(position, key)
+            self._adds += 1
+            if self._adds % 1000 == 0:
+                self._sweep()
+
+    def _sweep(self):
+        """Drop expired entries of every user (caller holds the lock)"""
+        cutoff = self._cutoff()
+        for user_id in list(self._index):
+            entries = self._index[user_id]
+            del entries[:bisect.bisect_left(entries, cutoff)]
+            if not entries:
+                del self._index[user_id]
+
+    def remove(self, user_id: str, request_id: str, created_at: datetime):
+        key = (created_at, request_id)
+        with self._lock:
+            entries = self._index.get(user_id, [])
+            position = bisect.bisect_left(entries, key)
+            if position < len(entries) and entries[position] == key:
+                del entries[position]
+            if not entries:
+                self._index.pop(user_id, None)
+
+    def latest(self, user_id: str, limit: int, before: Optional[HistoryCursor] = None) -> List[HistoryCursor]:
+        """(created_at, request_id) entries, newest first, strictly older than the cursor"""
+        with self._lock:
+            entries = self._index.get(user_id, [])
+            start = bisect.bisect_left(entries, self._cutoff())
+            end = len(entries) if before is None else bisect.bisect_left(entries, before)
+            return entries[max(start, end - limit):end][::-1]
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            entries = self._index.get(user_id, [])
+            return len(entries) - bisect.bisect_left(entries, self._cutoff())
+
+class SQLHistoryStore:
+    """
+    History index in a SQL table with a (user_id, created_at, request_id) index
+
+    The queries are plain SQL (row-value comparison), so the same schema
+    works on SQLite and Postgres; this implementation uses sqlite3 in WAL
+    mode with one connection per thread. Rows expire with the results
+    they point to (result_store_ttl) and are deleted every 1000 adds.
+    """
+
+    name = "sqlite"
+    blocking = True
+
+    def __init__(self, db_path: Optional[str] = None, ttl: Optional[float] = None):
+        self.db_path = Path(db_path or settings.history_db_path)
+        self.ttl = ttl or settings.result_store_ttl
+        self._adds = 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS processing_history (
+                    user_id TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    request_id TEXT NOT NULL,
+                    PRIMARY KEY (user_id, created_at, request_id)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            self._local.conn = conn
+        return conn
+
+    def _cutoff(self) -> float:
+        return (datetime.now() - timedelta(seconds=self.ttl)).timestamp()
+
+    def add(self, user_id: str, request_id: str, created_at: datetime):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO processing_history (user_id, created_at, request_id) VALUES (?, ?, ?)",
+                (user_id, created_at.timestamp(), request_id)
+            )
+            self._adds += 1
+            if self._adds % 1000 == 0:
+                conn.execute("DELETE FROM processing_history WHERE created_at < ?", (self._cutoff(),))
+
+    def remove(self, user_id: str, request_id: str, created_at: datetime):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM processing_history WHERE user_id = ? AND created_at = ? AND request_id = ?",
+                (user_id, created_at.timestamp(), request_id)
+            )
+
+    def latest(self, user_id: str, limit: int, before: Optional[HistoryCursor] = None) -> List[HistoryCursor]:
+        """(created_at, request_id) entries, newest first, strictly older than the cursor (index range scan)"""
+        if before is None:
+            rows = self._connect().execute(
+                """SELECT created_at, request_id FROM processing_history WHERE user_id = ? AND created_at >= ?
+                   ORDER BY created_at DESC, request_id DESC LIMIT ?""",
+                (user_id, self._cutoff(), limit)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                """SELECT created_at, request_id FROM processing_history
+                   WHERE user_id = ? AND created_at >= ? AND (created_at, request_id) < (?, ?)
+                   ORDER BY created_at DESC, request_id DESC LIMIT ?""",
+                (user_id, self._cutoff(), before[0].timestamp(), before[1], limit)
+            ).fetchall()
+        return [(datetime.fromtimestamp(created_at), request_id) for created_at, request_id in rows]
+
+    def count(self, user_id: str) -> int:
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM processing_history WHERE user_id = ? AND created_at >= ?", (user_id, self._cutoff())
+        ).fetchone()
+        return row[0]
+
+class RedisHistoryStore:
+    """
+    History index as one Redis sorted set per user on the state backend
+
+    Members are request IDs scored by created_at, so every node that
+    shares STATE_BACKEND=redis sees the same /history. Ties on the score
+    are ordered by request ID, like the other stores. Expired members are
+    trimmed on add and the whole set expires result_store_ttl after the
+    user's last request.
+    """
+
+    name = "redis"
+    blocking = True
+
+    def __init__(self, backend: StateBackend, ttl: Optional[float] = None):
+        self.client = backend.client
+        self.prefix = backend.prefix
+        self.ttl = ttl or settings.result_store_ttl
+
+    def _key(self, user_id: str) -> str:
+        return f"{self.prefix}history:{user_id}"
+
+    def _cutoff(self) -> float:
+        return (datetime.now() - timedelta(seconds=self.ttl)).timestamp()
+
+    def add(self, user_id: str, request_id: str, created_at: datetime):
+        key = self._key(user_id)
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.zadd(key, {request_id: created_at.timestamp()})
+        pipeline.zremrangebyscore(key, "-inf", f"({self._cutoff()}")
+        pipeline.pexpire(key, int(self.ttl * 1000))
+        pipeline.execute()
+
+    def remove(self, user_id: str, request_id: str, created_at: datetime):
+        self.client.zrem(self._key(user_id), request_id)
+
+    @staticmethod
+    def _entries(rows) -> List[HistoryCursor]:
+        return [
+            (datetime.fromtimestamp(score), member.decode() if isinstance(member, bytes) else member)
+            for member, score in rows
+        ]
+
+    def latest(self, user_id: str, limit: int, before: Optional[HistoryCursor] = None) -> List[HistoryCursor]:
+        """(created_at, request_id) entries, newest first, strictly older than the cursor"""
+        key = self._key(user_id)
+        cutoff = self._cutoff()
+        if before is None:
+            return self._entries(
+                self.client.zrevrangebyscore(key, "+inf", cutoff, start=0, num=limit, withscores=True)
+            )
+        score = before[0].timestamp()
+        ties = []
+        if score >= cutoff:
+            # Same created_at as the cursor: only the smaller request IDs come after it
+            ties = [
+                entry for entry in self._entries(self.client.zrevrangebyscore(key, score, score, withscores=True))
+                if entry[1] < before[1]
+            ]
+        older = self._entries(
+            self.client.zrevrangebyscore(key, f"({score}", cutoff, start=0, num=limit, withscores=True)
+        )
+        return (ties + older)[:limit]
+
+    def count(self, user_id: str) -> int:
+        return int(self.client.zcount(self._key(user_id), self._cutoff(), "+inf"))
+
+def create_history_store(backend: Optional[str] = None, state: Optional[StateBackend] = None):
+    """
+    Build the history index
+
+    A shared state backend keeps the index next to the results it points
+    to (Redis sorted sets, or a table in the SQLite state file), so every
+    worker sees the same /history. Otherwise HISTORY_BACKEND decides.
+    """
+    state = state or state_backend
+    if state.shared:
+        if state.name == "redis":
+            return RedisHistoryStore(state)
+        if state.name == "sqlite":
+            return SQLHistoryStore(str(state.db_path))
+    backend = backend or settings.history_backend
+    if backend == "sqlite":
+        return SQLHistoryStore()
+    return MemoryHistoryStore()
+
+# Global instance
+history_store = create_history_store()
@@ -0,0 +1,238 @@
+"""
+Background job runner for asynchronous /process requests
+Caps concurrent jobs and delivers signed completion callbacks
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import math
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from pydantic import BaseModel
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+class JobQueueFullError(Exception):
+    """Raised when too many async jobs are already waiting for a slot"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class CallbackURLError(ValueError):
+    """callback_url is malformed, not allowed or points into a private network"""
+
+def is_public_address(address: str) -> bool:
+    """Globally routable unicast address (no loopback, RFC 1918, link-local/metadata, reserved)"""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def _lookup(host: str, port: int) -> List[str]:
+    """Addresses of host, resolved without blocking the event loop"""
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return sorted({info[4][0] for info in infos})
+
+async def resolve_callback_url(url: str) -> Tuple[httpx.URL, str]:
+    """
+    Validate a client callback URL and pick the address to deliver to
+
+    Only http(s) URLs whose host is on job_callback_allowed_hosts (when
+    set) and resolves exclusively to public addresses are accepted, so a
+    callback cannot reach loopback, the private network or the cloud
+    metadata endpoint. Delivery connects to the returned address, not to
+    a fresh lookup, so DNS rebinding cannot swap in a private one.
+    """
+    try:
+        parsed = httpx.URL(url)
+    except (httpx.InvalidURL, TypeError) as e:
+        raise CallbackURLError(f"Invalid URL: {str(e)}")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise CallbackURLError("Only absolute http(s) URLs are accepted")
+
+    host = parsed.host.lower()
+    allowed = [entry.lower() for entry in settings.job_callback_allowed_hosts]
+    if allowed and not any(host == entry or host.endswith("." + entry) for entry in allowed):
+        raise CallbackURLError(f"Host {host} is not allowed")
+
+    try:
+        addresses = await _lookup(host, parsed.port or (443 if parsed.scheme == "https" else 80))
+    except (socket.gaierror, UnicodeError):
+        raise CallbackURLError(f"Host {host} does not resolve")
+    if not addresses or not all(is_public_address(address) for address in addresses):
+        raise CallbackURLError(f"Host {host} resolves to a private or reserved address")
+    return parsed, addresses[0]
+
+def sign_callback(body: bytes, timestamp: int, secret: Optional[str] = None) -> str:
+    """HMAC-SHA256 of "{timestamp}.{body}" (hex), sent as X-Callback-Signature: sha256=<hex>"""
+    key = (secret or settings.job_callback_secret or settings.secret_key).encode()
+    return hmac.new(key, str(timestamp).encode() + b"." + body, hashlib.sha256).hexdigest()
+
+class JobRunner:
+    """
+    Runs processing jobs after the HTTP response has been sent
+
+    Job state itself lives in the result store; the runner only limits how
+    many jobs run at once and notifies the client's callback URL when a job
+    finishes. Every waiting job holds its upload in memory, so at most
+    max_waiting_jobs may queue for a slot; admit() refuses the rest with
+    JobQueueFullError.
+    """
+
+    def __init__(self, max_concurrent_jobs: Optional[int] = None, callback_timeout: Optional[float] = None,
+                 max_waiting_jobs: Optional[int] = None):
+        self.max_concurrent_jobs = max_concurrent_jobs or settings.job_max_concurrent
+        self.callback_timeout = callback_timeout or settings.job_callback_timeout
+        self.max_waiting_jobs = max_waiting_jobs if max_waiting_jobs is not None else settings.job_max_waiting
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._avg_job_time = 5.0  # EWMA in seconds, seeds the Retry-After estimate
+
+        # Statistics
+        self._active = 0
+        self._waiting = 0
+        self._completed = 0
+        self._rejected = 0
+        self._callbacks_failed = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Create the semaphore lazily inside the running event loop"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_jobs)
+        return self._semaphore
+
+    def admit(self):
+        """
+        Reserve a waiting slot for a job about to be scheduled
+
+        Call before accepting the request; the slot is handed over to
+        run(..., admitted=True).
+
+        Raises:
+            JobQueueFullError: max_waiting_jobs jobs are already waiting
+        """
+        if self._waiting >= self.max_waiting_jobs:
+            self._rejected += 1
+            raise JobQueueFullError(self._estimate_retry_after())
+        self._waiting += 1
+
+    def cancel_admission(self):
+        """Give back a slot taken with admit() when the job will not be scheduled after all"""
+        self._waiting = max(0, self._waiting - 1)
+
+    def _estimate_retry_after(self) -> int:
+        """Seconds until the waiting jobs should have started"""
+        waves = self._waiting / self.max_concurrent_jobs + 1
+        return max(1, math.ceil(waves * self._avg_job_time))
+
+    async def run(self, job_id: str, job: Callable[[], Awaitable[BaseModel]],
+                  callback_url: Optional[str] = None, admitted: bool = False,
+                  on_error: Optional[Callable[[Exception], Awaitable[BaseModel]]] = None) -> Optional[BaseModel]:
+        """
+        Run a job and deliver its result to callback_url, if given
+
+        When the job raises, on_error records the failure and builds the
+        result delivered in its place, so the client is not left polling
+        a job that will never finish.
+
+        Args:
+            job_id: Request ID the job belongs to
+            job: Zero-argument coroutine function producing the final response
+            callback_url: Optional URL that receives the response as JSON
+            admitted: The waiting slot was already taken with admit()
+            on_error: Coroutine function turning the job's exception into a failed result
+        """
+        if not admitted:
+            self._waiting += 1
+        try:
+            async with self._get_semaphore():
+                self._waiting -= 1
+                self._active += 1
+                start = time.monotonic()
+                try:
+                    result = await job()
+                finally:
+                    self._active -= 1
+                    self._completed += 1
+                    self._avg_job_time = 0.8 * self._avg_job_time + 0.2 * (time.monotonic() - start)
+        except Exception as e:
+            logger.exception("Background job %s crashed", job_id)
+            if on_error is None:
+                return None
+            try:
+                result = await on_error(e)
+            except Exception:
+                logger.exception("Could not record the failure of job %s", job_id)
+                return None
+
+        if callback_url:
+            await self.deliver_callback(job_id, callback_url, result)
+        return result
+
+    async def deliver_callback(self, job_id: str, callback_url: str, payload: BaseModel) -> bool:
+        """
+        POST the job result to the client callback URL with a few retries
+
+        The URL is re-checked and pinned to a public address before every
+        attempt, redirects are not followed and the body is signed (see
+        sign_callback) so receivers can verify it came from us.
+        """
+        body = json.dumps(payload.model_dump(mode="json"), separators=(",", ":")).encode()
+
+        for attempt in range(settings.job_callback_retries + 1):
+            try:
+                url, address = await resolve_callback_url(callback_url)
+            except CallbackURLError as e:
+                print(f"⚠️ Callback for job {job_id} refused: {str(e)}")
+                break
+
+            timestamp = int(time.time())
+            headers = {
+                "Host": url.netloc.decode("ascii"),
+                "Content-Type": "application/json",
+                "X-Callback-Timestamp": str(timestamp),
+                "X-Callback-Signature": f"sha256={sign_callback(body, timestamp)}",
+                "X-Request-Id": job_id
+            }
+            extensions = {"sni_hostname": url.host} if url.scheme == "https" else {}
+            try:
+                async with httpx.AsyncClient(timeout=self.callback_timeout, follow_redirects=False) as http_client:
+                    request = http_client.build_request(
+                        "POST", url.copy_with(host=address), content=body, headers=headers, extensions=extensions
+                    )
+                    response = await http_client.send(request)
+                if response.status_code < 500:
+                    return True
+            except httpx.HTTPError as e:
+                print(f"⚠️ Callback for job {job_id} failed (attempt {attempt + 1}): {str(e)}")
+
+            if attempt < settings.job_callback_retries:
+                await asyncio.sleep(2 ** attempt * 0.5)
+
+        self._callbacks_failed += 1
+        return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return runner statistics"""
+        return {
+            'max_concurrent_jobs': self.max_concurrent_jobs,
+            'max_waiting_jobs': self.max_waiting_jobs,
+            'active': self._active,
+            'waiting': self._waiting,
+            'completed': self._completed,
+            'rejected': self._rejected,
+            'avg_job_time': self._avg_job_time,
+            'callbacks_failed': self._callbacks_failed
+        }
+
+# Global instance
+job_runner = JobRunner()
@@ -0,0 +1,210 @@
+"""
+Latency-aware LLM routing
+Rolling latency/error windows + per-target circuit breakers
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import settings
+
+Target = Tuple[str, str]  # (provider, model)
+
+class CircuitBreaker:
+    """
+    Closed → open after consecutive failures → half-open probe
+
+    The open period grows exponentially with each failure past the
+    threshold (same formula as the legacy RateLimiter._calculate_backoff),
+    so a provider that keeps failing is probed less and less often.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: Optional[int] = None, backoff_base: Optional[float] = None,
+                 backoff_factor: Optional[float] = None, max_backoff: Optional[float] = None):
+        self.failure_threshold = failure_threshold or settings.llm_circuit_failure_threshold
+        self.backoff_base = backoff_base or settings.llm_circuit_backoff_base
+        self.backoff_factor = backoff_factor or settings.llm_circuit_backoff_factor
+        self.max_backoff = max_backoff or settings.llm_circuit_max_backoff
+
+        self._consecutive_failures = 0
+        self._last_failure_time = 0.0
+        self._probe_started: Optional[float] = None
+
+    def _calculate_backoff(self) -> float:
+        """Exponential open period, capped at max_backoff"""
+        return min(
+            self.max_backoff,
+            self.backoff_base * self.backoff_factor ** (self._consecutive_failures - self.failure_threshold)
+        )
+
+    @property
+    def state(self) -> str:
+        if self._consecutive_failures < self.failure_threshold:
+            return self.CLOSED
+        if time.time() - self._last_failure_time < self._calculate_backoff():
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe is allowed (0 when not open)"""
+        if self.state != self.OPEN:
+            return 0.0
+        return self._calculate_backoff() - (time.time() - self._last_failure_time)
+
+    def allow(self) -> bool:
+        """
+        Closed: always. Half-open: a single probe at a time. Open: never
+
+        A probe that never reports back (cancelled request) is forgotten
+        after llm_circuit_probe_timeout seconds.
+        """
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        now = time.time()
+        if state == self.HALF_OPEN and (
+            self._probe_started is None or now - self._probe_started > settings.llm_circuit_probe_timeout
+        ):
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self._consecutive_failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        self._last_failure_time = time.time()
+        self._probe_started = None
+
+class RollingWindow:
+    """Latency and outcome samples from the last window seconds"""
+
+    def __init__(self, window: Optional[float] = None, max_samples: Optional[int] = None):
+        self.window = window or settings.llm_router_window
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=max_samples or settings.llm_router_max_samples)
+
+    def add(self, latency: float, success: bool):
+        self._samples.append((time.time(), latency, success))
+
+    def _live(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.time() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    def stats(self) -> Dict[str, Any]:
+        """Sample counts, error rate and p50/p95 of successful calls"""
+        samples = self._live()
+        latencies = sorted(latency for _, latency, success in samples if success)
+        errors = sum(1 for _, _, success in samples if not success)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            'samples': len(samples),
+            'successes': len(latencies),
+            'error_rate': errors / len(samples) if samples else 0.0,
+            'p50': percentile(0.50),
+            'p95': percentile(0.95)
+        }
+
+class LLMRouter:
+    """
+    Orders (provider, model) targets by health and observed latency
+
+    Targets with an open circuit are skipped. Targets with fewer than
+    llm_router_min_samples calls in the window keep their configured
+    position ahead of measured ones, so new or recovered targets get
+    explored. Measured targets are sorted by expected time to a success,
+    p50 / (1 - error_rate), and targets failing more often than
+    llm_router_max_error_rate go last (least failing first), so a fast
+    but mostly failing target is demoted before its breaker opens.
+    """
+
+    def __init__(self):
+        self._breakers: Dict[Target, CircuitBreaker] = {}
+        self._windows: Dict[Target, RollingWindow] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, target: Target) -> Tuple[CircuitBreaker, RollingWindow]:
+        breaker = self._breakers.get(target)
+        if breaker is None:
+            breaker = self._breakers.setdefault(target, CircuitBreaker())
+            self._windows.setdefault(target, RollingWindow())
+        return breaker, self._windows[target]
+
+    def order(self, targets: List[Target]) -> List[Target]:
+        """Healthy targets, fastest first, failing ones last"""
+        with self._lock:
+            ranked = []
+            for position, target in enumerate(targets):
+                breaker, window = self._get(target)
+                if breaker.state == CircuitBreaker.OPEN:
+                    continue
+                stats = window.stats()
+                if stats['samples'] < settings.llm_router_min_samples:
+                    rank = (0, position)
+                elif stats['error_rate'] > settings.llm_router_max_error_rate or stats['p50'] is None:
+                    rank = (2, stats['error_rate'])
+                else:
+                    rank = (1, stats['p50'] / (1.0 - stats['error_rate']))
+                ranked.append((rank, target))
+            ranked.sort(key=lambda item: item[0])
+            return [target for _, target in ranked]
+
+    def allow(self, target: Target) -> bool:
+        """Claim a call slot (consumes the half-open probe)"""
+        with self._lock:
+            return self._get(target)[0].allow()
+
+    def record(self, target: Target, latency: float, success: bool):
+        """Feed one call outcome into the window and breaker"""
+        with self._lock:
+            breaker, window = self._get(target)
+            window.add(latency, success)
+            was_open = breaker.state != CircuitBreaker.CLOSED
+            if success:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            state = breaker.state
+
+        if success and was_open:
+            print(f"✅ LLM circuit closed for {target[0]}/{target[1]}")
+        elif not success and state == CircuitBreaker.OPEN:
+            print(f"🔌 LLM circuit open for {target[0]}/{target[1]} ({breaker.retry_in():.1f}s)")
+
+    def provider_health(self, providers: List[str]) -> Dict[str, bool]:
+        """A provider is healthy unless every model tracked for it has an open circuit"""
+        with self._lock:
+            health = {}
+            for provider in providers:
+                states = [breaker.state for (name, _), breaker in self._breakers.items() if name == provider]
+                health[provider] = not states or any(state != CircuitBreaker.OPEN for state in states)
+            return health
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-target circuit state and latency window"""
+        with self._lock:
+            return {
+                f"{provider}/{model}": {
+                    'state': breaker.state,
+                    'retry_in': breaker.retry_in(),
+                    **self._windows[(provider, model)].stats()
+                }
+                for (provider, model), breaker in self._breakers.items()
+            }
+
+# Global instance
+llm_router = LLMRouter()
@@ -3,18 +3,374 @@ LLM Service with multiple providers
 Groq → Anthropic → OpenAI → OpenRouter
 """
 
+import json
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Union
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
 from models import LLMResponse, LLMProvider
-from config import settings
+from config import settings, LLM_ROUTING, LLM_PROVIDERS
+from services.semantic_cache import SemanticResponseCache, semantic_cache
+from services.llm_router import LLMRouter, llm_router
+from services.metrics import metrics
+
+SYSTEM_PROMPT = (
+    "Você é um assistente acadêmico. Explique o conteúdo enviado pelo estudante "
+    "de forma clara e didática, em português do Brasil, resolvendo passo a passo "
+    "quando houver exercícios."
+)
 
 class LLMService:
     """
     Multi-provider LLM service with intelligent routing
+    
+    Each provider gets one long-lived httpx.AsyncClient, so TLS sessions and
+    keep-alive connections are reused across requests instead of being set
+    up per call. Clients are created on first use and closed by aclose().
     """
     
-    def __init__(self):
-        pass
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None,
+                 response_cache: Optional[SemanticResponseCache] = None,
+                 router: Optional[LLMRouter] = None):
+        self._transport = transport
+        self.router = router or llm_router
+        self.response_cache = response_cache or (semantic_cache if settings.llm_cache_enabled else None)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+    
+    @staticmethod
+    def _api_key(provider: str) -> Optional[str]:
+        return getattr(settings, f"{provider}_api_key", None)
+    
+    @staticmethod
+    def _base_url(provider: str) -> str:
+        return getattr(settings, f"{provider}_base_url")
+    
+    def is_configured(self, provider: str) -> bool:
+        """Provider is known and has an API key"""
+        return provider in LLM_PROVIDERS and bool(self._api_key(provider))
+    
+    def _get_client(self, provider: str) -> httpx.AsyncClient:
+        """Initialize the provider's pooled client lazily"""
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            provider_config = LLM_PROVIDERS[provider]
+            api_key = self._api_key(provider) or ""
+            
+            if provider_config['api'] == 'anthropic':
+                headers = {"x-api-key": api_key, "anthropic-version": "2023-06-01"}
+            else:
+                headers = {"Authorization": f"Bearer {api_key}"}
+            
+            client = httpx.AsyncClient(
+                base_url=self._base_url(provider),
+                headers=headers,
+                http2=settings.llm_http2 and H2_AVAILABLE and self._transport is None,
+                limits=httpx.Limits(
+                    max_connections=provider_config['max_connections'],
+                    max_keepalive_connections=provider_config['max_keepalive']
+                ),
+                timeout=httpx.Timeout(provider_config['timeout'], connect=settings.llm_connect_timeout),
+                transport=self._transport
+            )
+            self._clients[provider] = client
+        return client
+    
+    def _build_request(self, provider: str, model: str, messages: List[Dict[str, str]],
+                       system: Optional[str], max_tokens: int, stream: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Return (path, JSON payload) in the provider's API format"""
+        if LLM_PROVIDERS[provider]['api'] == 'anthropic':
+            payload = {"model": model, "max_tokens": max_tokens, "messages": messages}
+            if system:
+                payload["system"] = system
+            path = "/messages"
+        else:
+            chat = ([{"role": "system", "content": system}] if system else []) + messages
+            payload = {"model": model, "max_tokens": max_tokens, "messages": chat}
+            path = "/chat/completions"
+        
+        if stream:
+            payload["stream"] = True
+        return path, payload
+    
+    @staticmethod
+    def _parse_response(provider: str, body: Dict[str, Any]) -> Tuple[str, Optional[int]]:
+        """Return (text, total tokens) from a provider response body"""
+        if LLM_PROVIDERS[provider]['api'] == 'anthropic':
+            text = "".join(block.get("text", "") for block in body.get("content", []) if block.get("type") == "text")
+            usage = body.get("usage") or {}
+            tokens = (usage.get("input_tokens") or 0) + (usage.get("output_tokens") or 0)
+        else:
+            choices = body.get("choices") or [{}]
+            text = (choices[0].get("message") or {}).get("content") or ""
+            tokens = (body.get("usage") or {}).get("total_tokens")
+        return text, tokens or None
+    
+    async def complete(self, provider: str, model: str, prompt: str, system: Optional[str] = None,
+                       max_tokens: Optional[int] = None, timeout: Optional[float] = None) -> LLMResponse:
+        """
+        Single chat completion against one provider
+        
+        Never raises for provider errors; failures come back as
+        LLMResponse(success=False) so callers can fall back. Every outcome
+        is reported to the router.
+        """
+        result = await self._complete(provider, model, prompt, system, max_tokens, timeout)
+        self._record(provider, model, result.processing_time, result.success)
+        return result
+    
+    def _record(self, provider: str, model: str, latency: float, success: bool):
+        """Feed one call outcome to the router and the llm_request_seconds histogram"""
+        self.router.record((provider, model), latency, success)
+        metrics.histogram(
+            "llm_request_seconds", provider=provider, model=model, outcome="success" if success else "error"
+        ).observe(latency)
+    
+    async def _complete(self, provider: str, model: str, prompt: str, system: Optional[str],
+                        max_tokens: Optional[int], timeout: Optional[float]) -> LLMResponse:
+        start_time = time.time()
+        
+        try:
+            path, payload = self._build_request(
+                provider, model, [{"role": "user", "content": prompt}],
+                system, max_tokens or settings.llm_max_tokens
+            )
+            client = self._get_client(provider)
+            response = await client.post(
+                path, json=payload,
+                timeout=httpx.Timeout(timeout, connect=settings.llm_connect_timeout) if timeout else httpx.USE_CLIENT_DEFAULT
+            )
+            response.raise_for_status()
+            text, tokens = self._parse_response(provider, response.json())
+            
+            return LLMResponse(
+                provider=LLMProvider(provider),
+                model=model,
+                response=text.strip(),
+                tokens_used=tokens,
+                processing_time=time.time() - start_time,
+                success=bool(text.strip()),
+                error=None if text.strip() else "Empty response"
+            )
+        
+        except Exception as e:
+            return LLMResponse(
+                provider=LLMProvider(provider),
+                model=model,
+                response="",
+                processing_time=time.time() - start_time,
+                success=False,
+                error=f"{type(e).__name__}: {str(e)}"
+            )
+    
+    def route(self, plan: str) -> List[Tuple[str, str]]:
+        """
+        (provider, model) attempts for a plan, from LLM_ROUTING
+        
+        The primary model and its same-tier alternates are ordered by the
+        router (open circuits dropped, fastest healthy first). The fallback
+        comes last; it may name a provider (its default model is used) or a
+        model (run on the primary provider). Providers without an API key
+        are skipped.
+        """
+        routing = LLM_ROUTING.get(plan, LLM_ROUTING['free'])
+        tier = [(routing['primary'], routing['model'])] + list(routing.get('alternates', []))
+        
+        fallbacks = []
+        fallback = routing.get('fallback')
+        if fallback in LLM_PROVIDERS:
+            fallbacks.append((fallback, LLM_PROVIDERS[fallback]['default_model']))
+        elif fallback:
+            fallbacks.append((routing['primary'], fallback))
+        
+        def configured(targets):
+            return [(provider, model) for provider, model in targets if self.is_configured(provider)]
+        
+        return self.router.order(configured(tier)) + self.router.order(configured(fallbacks))
+    
+    def _cache_scope(self, plan: str, subject: Optional[str], question: Optional[str]) -> str:
+        routing = LLM_ROUTING.get(plan, LLM_ROUTING['free'])
+        return SemanticResponseCache.make_scope(plan, routing['model'], subject, question)
+    
+    def _cache_lookup(self, text: str, plan: str, subject: Optional[str],
+                      question: Optional[str]) -> Optional[LLMResponse]:
+        """
+        Cached response for near-duplicate OCR text with the same question
+        
+        Only the OCR text is compared fuzzily; the question is part of the
+        scope and must match exactly. The lookup time is the processing_time.
+        """
+        if not self.response_cache:
+            return None
+        
+        start_time = time.time()
+        hit = self.response_cache.get(text, self._cache_scope(plan, subject, question))
+        if not hit:
+            return None
+        
+        similarity, response = hit
+        print(f"♻️ LLM semantic cache hit (similarity {similarity:.2f})")
+        return response.model_copy(update={'processing_time': time.time() - start_time})
+    
+    def _cache_store(self, text: str, plan: str, subject: Optional[str], question: Optional[str],
+                     response: LLMResponse):
+        if self.response_cache:
+            self.response_cache.set(text, self._cache_scope(plan, subject, question), response)
+    
+    @staticmethod
+    def build_prompt(text: str, question: Optional[str] = None, subject: Optional[str] = None) -> str:
+        """User prompt for explaining OCR text"""
+        prompt = f"Texto extraído da imagem:\n\n{text}"
+        if subject:
+            prompt += f"\n\nMatéria: {subject}"
+        if question:
+            prompt += f"\n\nPergunta do estudante: {question}"
+        return prompt
+    
+    async def explain(self, text: str, plan: str = "free", question: Optional[str] = None,
+                      subject: Optional[str] = None) -> Optional[LLMResponse]:
+        """
+        Explain OCR text with the plan's provider chain
+        
+        Returns the first successful response, the last failure, or None
+        when no provider in the chain is configured. Near-duplicate texts
+        (same question, different OCR noise) are answered from the
+        semantic cache.
+        """
+        prompt = self.build_prompt(text, question, subject)
+        
+        cached = self._cache_lookup(text, plan, subject, question)
+        if cached:
+            return cached
+        
+        result = None
+        for provider, model in self.route(plan):
+            if not self.router.allow((provider, model)):
+                continue
+            result = await self.complete(provider, model, prompt, system=SYSTEM_PROMPT)
+            if result.success:
+                self._cache_store(text, plan, subject, question, result)
+                return result
+            print(f"⚠️ LLM {provider}/{model} failed: {result.error}")
+        return result
+    
+    @staticmethod
+    def _parse_stream_event(provider: str, data: Dict[str, Any]) -> str:
+        """Return the text delta carried by one streamed event"""
+        if LLM_PROVIDERS[provider]['api'] == 'anthropic':
+            if data.get("type") == "content_block_delta":
+                return (data.get("delta") or {}).get("text", "")
+            return ""
+        
+        choices = data.get("choices") or [{}]
+        return (choices[0].get("delta") or {}).get("content") or ""
+    
+    async def stream(self, provider: str, model: str, prompt: str, system: Optional[str] = None,
+                     max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """
+        Stream text deltas from one provider (SSE on both API styles)
+        
+        Raises on transport or HTTP errors.
+        """
+        path, payload = self._build_request(
+            provider, model, [{"role": "user", "content": prompt}],
+            system, max_tokens or settings.llm_max_tokens, stream=True
+        )
+        client = self._get_client(provider)
+        
+        async with client.stream("POST", path, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    delta = self._parse_stream_event(provider, json.loads(data))
+                except ValueError:
+                    continue
+                if delta:
+                    yield delta
+    
+    async def explain_stream(self, text: str, plan: str = "free", question: Optional[str] = None,
+                             subject: Optional[str] = None) -> AsyncIterator[Union[str, LLMResponse]]:
+        """
+        Streaming variant of explain()
+        
+        Yields text deltas as they arrive and finally one LLMResponse with
+        the full text. A provider that fails before its first token is
+        skipped for the next one in the chain; a failure mid-stream ends
+        the stream with success=False and the partial text.
+        """
+        prompt = self.build_prompt(text, question, subject)
+        
+        cached = self._cache_lookup(text, plan, subject, question)
+        if cached:
+            yield cached.response
+            yield cached
+            return
+        
+        for provider, model in self.route(plan):
+            if not self.router.allow((provider, model)):
+                continue
+            start_time = time.time()
+            parts: List[str] = []
+            try:
+                async for delta in self.stream(provider, model, prompt, system=SYSTEM_PROMPT):
+                    if not parts:
+                        metrics.histogram("llm_first_token_seconds", provider=provider).observe(time.time() - start_time)
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                print(f"⚠️ LLM stream {provider}/{model} failed: {str(e)}")
+                self._record(provider, model, time.time() - start_time, False)
+                if not parts:
+                    continue
+                yield LLMResponse(
+                    provider=LLMProvider(provider),
+                    model=model,
+                    response="".join(parts).strip(),
+                    processing_time=time.time() - start_time,
+                    success=False,
+                    error=f"{type(e).__name__}: {str(e)}"
+                )
+                return
+            
+            full_text = "".join(parts).strip()
+            self._record(provider, model, time.time() - start_time, bool(full_text))
+            if not full_text:
+                continue
+            result = LLMResponse(
+                provider=LLMProvider(provider),
+                model=model,
+                response=full_text,
+                processing_time=time.time() - start_time,
+                success=True
+            )
+            self._cache_store(text, plan, subject, question, result)
+            yield result
+            return
+    
+    async def aclose(self):
+        """Close every pooled client"""
+        clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            await client.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Return client pool information"""
+        return {
+            'live_calls': settings.llm_live_calls,
+            'http2': settings.llm_http2 and H2_AVAILABLE,
+            'clients': sorted(provider for provider, client in self._clients.items() if not client.is_closed)
+        }
     
     def get_explanation(self, text: str, context: str = "educacional", language: str = "pt-br") -> Dict[str, Any]:
         """
@@ -58,4 +414,4 @@ class LLMService:
             }
 
 # Global instance
-llm_service = LLMService() 
\ No newline at end of file
+llm_service = LLMService() 
@@ -0,0 +1,279 @@
+"""
+Lightweight in-process metrics
+Bucketed latency histograms, counters and Prometheus text exposition
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# Upper bounds in seconds, tuned for OCR/LLM latencies (5ms .. 60s)
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+    1.0, 1.5, 2.0, 2.5, 3.0, 4.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0
+)
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram
+
+    observe() is a bisect plus an increment under a lock, cheap enough for
+    every request. Quantiles are interpolated inside the matching bucket.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Last slot = +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Record one sample (seconds)"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate the q-quantile (0..1); None when empty"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if bucket_count and cumulative + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, object]:
+        """Return cumulative bucket counts, sum and count"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(list(self.buckets) + [float('inf')], counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': total_sum, 'count': total}
+
+class Counter:
+    """Monotonic counter"""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = sorted(labels.items()) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(str(value))}"' for key, value in items) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class MetricsRegistry:
+    """Registry of histograms and counters keyed by name and label set"""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], LatencyHistogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Counter] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        """HELP line shown in the Prometheus exposition"""
+        self._help[name] = help_text
+
+    def histogram(self, name: str, **labels: str) -> LatencyHistogram:
+        """Get or create the histogram for name + labels"""
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def histograms(self) -> List[Tuple[str, Dict[str, str], LatencyHistogram]]:
+        """List (name, labels, histogram) for every registered histogram"""
+        with self._lock:
+            items = list(self._histograms.items())
+        return [(name, dict(labels), histogram) for (name, labels), histogram in items]
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        """Get or create the counter for name + labels (name ends in _total)"""
+        key = (name, tuple(sorted(labels.items())))
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter())
+        return counter
+
+    def reset(self):
+        """Drop every histogram and counter (benchmarks, between runs)"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    @contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """Observe the duration of the with-block (also when it raises)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram(name, **labels).observe(time.perf_counter() - start)
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines: List[str] = []
+        seen: Set[str] = set()
+
+        def header(name: str, kind: str):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), counter in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(dict(labels))} {_format_value(counter.value)}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            labels = dict(labels)
+            snapshot = histogram.snapshot()
+            for bound, cumulative in snapshot['buckets']:
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(snapshot['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+
+        return "\n".join(lines) + "\n"
+
+class DailyActivity:
+    """Distinct users and requests per plan for the current day"""
+
+    def __init__(self):
+        self._day = date.today()
+        self._users: Set[str] = set()
+        self._plans: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self._users = set()
+            self._plans = {}
+
+    def record(self, user_id: str, plan: str):
+        with self._lock:
+            self._roll()
+            self._users.add(user_id)
+            self._plans[plan] = self._plans.get(plan, 0) + 1
+
+    def snapshot(self) -> Tuple[int, int, Dict[str, int]]:
+        """(active users, requests, requests per plan) today"""
+        with self._lock:
+            self._roll()
+            return len(self._users), sum(self._plans.values()), dict(self._plans)
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording latency and count of every HTTP request
+
+    Pure ASGI (no BaseHTTPMiddleware body wrapping). Requests are labelled
+    with the matched route template, so request IDs never become label
+    values. Requests are timed until the last body chunk is sent, so
+    streaming responses count in full while background tasks that run
+    after the response (async /process jobs) do not.
+    """
+
+    def __init__(self, app, registry: Optional[MetricsRegistry] = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+        recorded = False
+
+        def record():
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            self.registry.histogram(
+                "http_request_duration_seconds", method=scope["method"], route=path
+            ).observe(time.perf_counter() - start)
+            self.registry.counter(
+                "http_requests_total", method=scope["method"], route=path, status=str(status_code)
+            ).inc()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # No final body chunk: the app failed or the client went away
+            record()
+
+# Global instances
+metrics = MetricsRegistry()
+daily_activity = DailyActivity()
@@ -0,0 +1,176 @@
+"""
+Content-addressed OCR result cache
+Memory LRU → SQLite (zlib-compressed) persistent tier
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from models import OCRResult
+from config import settings
+
+class OCRResultCache:
+    """
+    Two-tier cache of OCR results keyed by image content
+
+    Keys hash the decoded image bytes together with the provider chain and
+    the OCR configuration, so changing either never serves a stale result.
+    The persistent tier is only enabled when a cache directory is given.
+    """
+
+    def __init__(self, max_memory_items: Optional[int] = None, ttl: Optional[int] = None,
+                 cache_dir: Optional[str] = None, max_disk_items: Optional[int] = None):
+        self.max_memory_items = max_memory_items or settings.ocr_cache_memory_items
+        self.ttl = ttl or settings.ocr_cache_ttl
+        self.max_disk_items = max_disk_items or settings.ocr_cache_max_disk_items
+        self._memory: "OrderedDict[str, Tuple[float, OCRResult]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.db_path: Optional[Path] = None
+        if cache_dir:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            self.db_path = Path(cache_dir) / "ocr_cache.db"
+            self._init_database()
+
+        # Statistics
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._writes = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, providers: Iterable[str], ocr_config: str = "") -> str:
+        """Build the cache key for an image, provider chain and OCR config"""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(b"\0" + ",".join(providers).encode())
+        digest.update(b"\0" + ocr_config.encode())
+        return digest.hexdigest()
+
+    def _init_database(self):
+        """Create the persistent table"""
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ocr_results (
+                    key TEXT PRIMARY KEY,
+                    value BLOB,
+                    expires_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_expires_at ON ocr_results(expires_at)")
+
+    def get(self, key: str) -> Optional[OCRResult]:
+        """Look up a result (memory first, then disk)"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+
+        result = self._disk_get(key, now)
+        with self._lock:
+            if result is None:
+                self._misses += 1
+                return None
+            self._disk_hits += 1
+
+        # Promote to memory
+        self._memory_set(key, result, now + self.ttl)
+        return result
+
+    def set(self, key: str, result: OCRResult):
+        """Store a result in both tiers"""
+        expires_at = time.time() + self.ttl
+        self._memory_set(key, result, expires_at)
+        self._disk_set(key, result, expires_at)
+
+    def clear(self):
+        """Drop the memory tier (the persistent tier is kept between runs)"""
+        with self._lock:
+            self._memory.clear()
+
+    def _memory_set(self, key: str, result: OCRResult, expires_at: float):
+        with self._lock:
+            self._memory[key] = (expires_at, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+                self._evictions += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[OCRResult]:
+        if not self.db_path:
+            return None
+
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT value FROM ocr_results WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+            if not row:
+                return None
+            return OCRResult.model_validate_json(zlib.decompress(row[0]))
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            print(f"⚠️ OCR cache read failed: {str(e)}")
+            return None
+
+    def _disk_set(self, key: str, result: OCRResult, expires_at: float):
+        if not self.db_path:
+            return
+
+        try:
+            value = zlib.compress(result.model_dump_json().encode())
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO ocr_results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at)
+                )
+                with self._lock:
+                    self._writes += 1
+                    cleanup_due = self._writes % 500 == 0
+                if cleanup_due:
+                    self._disk_cleanup(conn)
+        except sqlite3.Error as e:
+            print(f"⚠️ OCR cache write failed: {str(e)}")
+
+    def _disk_cleanup(self, conn: sqlite3.Connection):
+        """Remove expired rows and trim the table to max_disk_items"""
+        conn.execute("DELETE FROM ocr_results WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            """DELETE FROM ocr_results WHERE key IN (
+                   SELECT key FROM ocr_results ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+               )""",
+            (self.max_disk_items,)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return cache statistics"""
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            total = hits + self._misses
+            return {
+                'items': len(self._memory),
+                'max_items': self.max_memory_items,
+                'hits': hits,
+                'memory_hits': self._memory_hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_rate': hits / total if total else 0.0,
+                'evictions': self._evictions,
+                'persistent': self.db_path is not None
+            }
+
+# Global instance
+ocr_result_cache = OCRResultCache(cache_dir=settings.ocr_cache_dir)
@@ -0,0 +1,199 @@
+"""
+OCR Executor with bounded queue and plan priority
+Keeps blocking OCR work (OpenCV + Tesseract) off the event loop
+"""
+
+import asyncio
+import itertools
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import settings
+
+# Lower value = served first
+PLAN_PRIORITY = {
+    'max': 0,
+    'pro': 1,
+    'free': 2
+}
+
+class OCRQueueFullError(Exception):
+    """Raised when the OCR queue cannot accept more work"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"OCR queue is saturated, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class OCRExecutor:
+    """
+    Fixed pool of OCR workers fed by a bounded priority queue
+
+    Jobs are ordered by plan priority (max > pro > free) and then by arrival.
+    In "thread" mode the callable runs directly on the worker thread; in
+    "process" mode each worker thread dispatches to a process pool, so the
+    callable and its arguments must be picklable.
+
+    A job may fan out (layout tiles, hedged providers), so every Tesseract
+    run also holds one of max_workers tesseract_slots; each worker
+    process of "process" mode gets one slot.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue_size: Optional[int] = None,
+                 mode: Optional[str] = None):
+        self.max_workers = max_workers or settings.ocr_max_workers or os.cpu_count() or 1
+        self.max_queue_size = max_queue_size if max_queue_size is not None else settings.ocr_max_queue_size
+        self.mode = mode or settings.ocr_executor_mode
+
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self.tesseract_slots = threading.BoundedSemaphore(self.max_workers)
+
+        # Statistics
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._avg_job_time = 1.0  # EWMA in seconds, seeds the Retry-After estimate
+
+    def start(self):
+        """Start worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+
+            if self.mode == "process":
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=_init_worker_process
+                )
+
+            for index in range(self.max_workers):
+                thread = threading.Thread(target=self._worker, name=f"ocr-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self):
+        """Stop worker threads after the queued jobs drain"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        for _ in threads:
+            self._queue.put((math.inf, next(self._sequence), None, None, None, None))
+        for thread in threads:
+            thread.join(timeout=5)
+
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    async def run(self, fn: Callable, *args, plan: str = "free") -> Any:
+        """
+        Queue fn(*args) and wait for its result
+
+        Raises:
+            OCRQueueFullError: when max_queue_size jobs are already waiting
+        """
+        self.start()
+
+        with self._lock:
+            if self._queued >= self.max_queue_size:
+                self._rejected += 1
+                raise OCRQueueFullError(self._estimate_retry_after())
+            self._queued += 1
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        priority = PLAN_PRIORITY.get(plan, PLAN_PRIORITY['free'])
+        self._queue.put((priority, next(self._sequence), loop, future, fn, args))
+
+        return await future
+
+    def has_capacity(self) -> bool:
+        """Whether a new job would currently be accepted"""
+        with self._lock:
+            return self._queued < self.max_queue_size
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return executor statistics"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'workers': self.max_workers,
+                'queued': self._queued,
+                'running': self._running,
+                'max_queue_size': self.max_queue_size,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'cancelled': self._cancelled,
+                'avg_job_time': self._avg_job_time
+            }
+
+    def _estimate_retry_after(self) -> int:
+        """Seconds until the current backlog should have drained (caller holds the lock)"""
+        waves = self._queued / self.max_workers + 1
+        return max(1, math.ceil(waves * self._avg_job_time))
+
+    def _worker(self):
+        """Worker loop: pull the highest priority job and run it"""
+        while True:
+            _, _, loop, future, fn, args = self._queue.get()
+            if fn is None:
+                return
+
+            with self._lock:
+                self._queued -= 1
+                # Skip jobs whose caller went away while queued; they must not
+                # count as completed or pull down the job time average
+                if future.cancelled():
+                    self._cancelled += 1
+                    continue
+                self._running += 1
+
+            start_time = time.time()
+            try:
+                if self._process_pool:
+                    result = self._process_pool.submit(fn, *args).result()
+                else:
+                    result = fn(*args)
+                self._resolve(loop, future, result=result)
+            except BaseException as e:
+                self._resolve(loop, future, error=e)
+            finally:
+                elapsed = time.time() - start_time
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+                    self._avg_job_time = 0.8 * self._avg_job_time + 0.2 * elapsed
+
+    @staticmethod
+    def _resolve(loop: asyncio.AbstractEventLoop, future: asyncio.Future,
+                 result: Any = None, error: Optional[BaseException] = None):
+        """Hand the outcome back to the event loop that queued the job"""
+        def _set():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        try:
+            loop.call_soon_threadsafe(_set)
+        except RuntimeError:
+            # Event loop already closed, nobody is waiting anymore
+            pass
+
+def _init_worker_process():
+    """Process mode: one Tesseract slot per worker process (there are max_workers of them)"""
+    ocr_executor.tesseract_slots = threading.BoundedSemaphore(1)
+
+# Global instance
+ocr_executor = OCRExecutor()
@@ -4,11 +4,13 @@ Tesseract (Free) → Google Vision → Azure CV
 """
 
 import io
+import os
 import base64
+import math
 import time
-from typing import Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, List, Tuple, Union
 from PIL import Image
-import pytesseract
 import cv2
 import numpy as np
 
@@ -26,24 +28,57 @@ try:
 except ImportError:
     AZURE_CV_AVAILABLE = False
 
-from models import OCRResult, OCRProvider
-from config import settings
+from models import OCRResult, OCRProvider, OCRWord
+from config import settings, OCR_ROUTING
+from services.ocr_cache import OCRResultCache, ocr_result_cache
+from services.phash_index import PerceptualHashIndex, phash_index, phash, content_signature
+from services.metrics import metrics
+from services.tesseract_engine import create_tesseract_engine
+from services.ocr_executor import OCRExecutor, ocr_executor
+
+# Denoising profiles, cheapest first
+PREPROCESS_PROFILES = ('none', 'median', 'nlmeans')
+
+# Immerkær fast noise estimation kernel
+NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+# Pixels of white margin kept around each layout block
+TILE_PADDING = 8
 
 class OCRService:
     """
     Multi-provider OCR service with intelligent fallback
     """
     
-    def __init__(self):
+    def __init__(self, result_cache: Optional[OCRResultCache] = None,
+                 near_duplicates: Optional[PerceptualHashIndex] = None,
+                 executor: Optional[OCRExecutor] = None):
+        self.result_cache = result_cache or (ocr_result_cache if settings.ocr_cache_enabled else None)
+        self.near_duplicates = near_duplicates or (phash_index if settings.ocr_phash_enabled else None)
+        # Tile and hedge threads run Tesseract outside the executor's workers,
+        # so every run takes one of the executor's slots
+        self.executor = executor or ocr_executor
         self.tesseract_config = '--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ+-*/=()[]{}.,;:!?ÀÁÂÃÄÅÇÈÉÊËÌÍÎÏÑÒÓÔÕÖÙÚÛÜÝàáâãäåçèéêëìíîïñòóôõöùúûüý'
+        self.tesseract_engine = create_tesseract_engine(self.tesseract_config)
         self._google_client = None
         self._azure_client = None
+        self._hedge_pool = None
+        self._tile_pool = None
         
     def _get_google_client(self):
         """Initialize Google Vision client lazily"""
         if not GOOGLE_VISION_AVAILABLE or not settings.google_vision_api_key:
             return None
             
+        if not self._google_client and settings.google_vision_endpoint:
+            # Stand-in endpoint (load tests): REST transport, no Google credentials
+            from google.auth.credentials import AnonymousCredentials
+            self._google_client = vision.ImageAnnotatorClient(
+                credentials=AnonymousCredentials(),
+                transport="rest",
+                client_options={"api_endpoint": settings.google_vision_endpoint}
+            )
+            
         if not self._google_client:
             # Set the API key as environment variable for Google client
             import os
@@ -63,27 +98,127 @@ class OCRService:
             )
         return self._azure_client
     
+    @staticmethod
+    def _estimate_noise(gray: np.ndarray) -> Tuple[float, float]:
+        """
+        Cheap image quality estimate: (noise sigma, histogram spread)
+        
+        Noise uses Immerkær's Laplacian-difference operator on non-edge
+        pixels only, so sharp text strokes on clean screenshots do not read
+        as noise. Spread is the distance between the mean gray levels of the
+        two Otsu histogram classes (ink vs paper), which stays meaningful on
+        sparse pages where percentile ranges collapse to zero.
+        """
+        response = cv2.filter2D(gray.astype(np.float32), -1, NOISE_KERNEL)[1:-1, 1:-1]
+        edges = cv2.dilate(cv2.Canny(gray, 100, 200), np.ones((3, 3), np.uint8))[1:-1, 1:-1]
+        flat = np.abs(response[edges == 0])
+        sigma = float(flat.mean()) * math.sqrt(math.pi / 2) / 6 if flat.size else 0.0
+        
+        histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+        threshold = int(cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[0])
+        levels = np.arange(256)
+        dark, light = histogram[:threshold + 1], histogram[threshold + 1:]
+        if not dark.sum() or not light.sum():
+            return sigma, 0.0
+        spread = (levels[threshold + 1:] @ light) / light.sum() - (levels[:threshold + 1] @ dark) / dark.sum()
+        return sigma, float(spread)
+    
+    def _choose_preprocess_profile(self, gray: np.ndarray) -> str:
+        """
+        Pick the cheapest denoising profile the image needs
+        
+        none → median (3x3) → nlmeans; low-contrast images move up one level
+        """
+        sigma, spread = self._estimate_noise(gray)
+        
+        if sigma < settings.ocr_denoise_none_max_sigma:
+            level = 0
+        elif sigma < settings.ocr_denoise_median_max_sigma:
+            level = 1
+        else:
+            level = 2
+        
+        if spread < settings.ocr_low_contrast_spread:
+            level = min(level + 1, 2)
+        
+        return PREPROCESS_PROFILES[level]
+    
     def _preprocess_image(self, image: Image.Image) -> Image.Image:
         """
         Preprocess image for better OCR results
         """
-        # Convert to OpenCV format
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        start_time = time.time()
         
         # Convert to grayscale
-        gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
         
-        # Apply denoising
-        denoised = cv2.fastNlMeansDenoising(gray)
+        # Apply denoising only as strong as the image needs
+        profile = self._choose_preprocess_profile(gray)
+        if profile == 'nlmeans':
+            denoised = cv2.fastNlMeansDenoising(gray)
+        elif profile == 'median':
+            denoised = cv2.medianBlur(gray, 3)
+        else:
+            denoised = gray
         
         # Apply adaptive thresholding
         thresh = cv2.adaptiveThreshold(
             denoised, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2
         )
         
+        metrics.histogram("ocr_preprocess_seconds", profile=profile).observe(time.time() - start_time)
+        
         # Convert back to PIL Image
         return Image.fromarray(thresh)
     
+    @staticmethod
+    def _parse_tesseract_data(data: dict) -> Tuple[str, List[OCRWord]]:
+        """
+        Rebuild the page text from image_to_data output
+        
+        Words are joined with spaces per line, lines with newlines and
+        paragraphs/blocks with a blank line, matching image_to_string.
+        """
+        words = []
+        paragraphs = []
+        lines = []
+        current_line = []
+        line_key = None
+        paragraph_key = None
+        
+        for index, raw_text in enumerate(data['text']):
+            word_text = (raw_text or "").strip()
+            if not word_text:
+                continue
+            
+            key = (data['page_num'][index], data['block_num'][index], data['par_num'][index])
+            if (key, data['line_num'][index]) != line_key:
+                if current_line:
+                    lines.append(" ".join(current_line))
+                    current_line = []
+                if key != paragraph_key and lines:
+                    paragraphs.append("\n".join(lines))
+                    lines = []
+                line_key = (key, data['line_num'][index])
+                paragraph_key = key
+            
+            current_line.append(word_text)
+            words.append(OCRWord(
+                text=word_text,
+                confidence=float(data['conf'][index]),
+                left=int(data['left'][index]),
+                top=int(data['top'][index]),
+                width=int(data['width'][index]),
+                height=int(data['height'][index])
+            ))
+        
+        if current_line:
+            lines.append(" ".join(current_line))
+        if lines:
+            paragraphs.append("\n".join(lines))
+        
+        return "\n\n".join(paragraphs), words
+    
     def _extract_with_tesseract(self, image: Image.Image) -> OCRResult:
         """
         Extract text using Tesseract OCR
@@ -94,22 +229,28 @@ class OCRService:
             # Preprocess image
             processed_image = self._preprocess_image(image)
             
-            # Extract text
-            text = pytesseract.image_to_string(processed_image, config=self.tesseract_config)
+            # Large pages are split into layout blocks recognized in parallel
+            blocks = self._find_text_blocks(processed_image) if self._should_tile(processed_image) else []
+            if len(blocks) > 1:
+                text, words = self._recognize_blocks(processed_image, blocks)
+            else:
+                # Single Tesseract run: text, word boxes and confidences from the TSV output
+                with self.executor.tesseract_slots:
+                    data = self.tesseract_engine.image_to_data(processed_image)
+                text, words = self._parse_tesseract_data(data)
             
-            # Get confidence scores
-            data = pytesseract.image_to_data(processed_image, output_type=pytesseract.Output.DICT)
-            confidences = [int(conf) for conf in data['conf'] if int(conf) > 0]
+            confidences = [word.confidence for word in words if word.confidence > 0]
             avg_confidence = sum(confidences) / len(confidences) if confidences else 0
             
             processing_time = time.time() - start_time
             
             return OCRResult(
                 provider=OCRProvider.TESSERACT,
-                text=text.strip(),
+                text=text,
                 confidence=avg_confidence / 100.0,  # Convert to 0-1 scale
                 processing_time=processing_time,
-                success=True
+                success=True,
+                words=words
             )
             
         except Exception as e:
@@ -123,6 +264,85 @@ class OCRService:
                 error=str(e)
             )
     
+    @staticmethod
+    def _should_tile(image: Image.Image) -> bool:
+        """Whether a preprocessed page is big enough to be worth splitting"""
+        width, height = image.size
+        return settings.ocr_tiling_enabled and width * height >= settings.ocr_tiling_min_pixels
+    
+    @staticmethod
+    def _find_text_blocks(image: Image.Image) -> List[Tuple[int, int, int, int]]:
+        """
+        Split a thresholded page into text blocks, in reading order
+        
+        Ink is dilated with a wide kernel sized from ocr_target_text_height so
+        the words and lines of a paragraph fuse while the blank gaps between
+        questions, columns and figures stay open; each connected component
+        becomes one (x, y, w, h) block. Blocks are grouped into rows of
+        vertically overlapping boxes and ordered left to right within a row.
+        """
+        binary = np.asarray(image.convert('L')) < 128
+        text_height = settings.ocr_target_text_height
+        kernel = cv2.getStructuringElement(
+            cv2.MORPH_RECT, (max(3, int(text_height * 1.5)), max(3, int(text_height * 0.8)))
+        )
+        dilated = cv2.dilate(binary.astype(np.uint8), kernel)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(dilated, connectivity=8)
+        
+        page_height, page_width = binary.shape
+        boxes = []
+        for x, y, w, h, _ in stats[1:count]:
+            if h < text_height / 3:
+                continue
+            x0, y0 = max(0, x - TILE_PADDING), max(0, y - TILE_PADDING)
+            x1, y1 = min(page_width, x + w + TILE_PADDING), min(page_height, y + h + TILE_PADDING)
+            boxes.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+        
+        if len(boxes) > settings.ocr_tiling_max_blocks:
+            return []
+        
+        rows: List[List[Tuple[int, int, int, int]]] = []
+        for box in sorted(boxes, key=lambda b: b[1]):
+            if rows and box[1] < max(b[1] + b[3] for b in rows[-1]):
+                rows[-1].append(box)
+            else:
+                rows.append([box])
+        return [box for row in rows for box in sorted(row, key=lambda b: b[0])]
+    
+    def _get_tile_pool(self) -> ThreadPoolExecutor:
+        """Initialize the block recognition thread pool lazily"""
+        if not self._tile_pool:
+            self._tile_pool = ThreadPoolExecutor(
+                max_workers=min(settings.ocr_tiling_workers or os.cpu_count() or 1, self.executor.max_workers),
+                thread_name_prefix="ocr-tile"
+            )
+        return self._tile_pool
+    
+    def _recognize_blocks(self, image: Image.Image,
+                          blocks: List[Tuple[int, int, int, int]]) -> Tuple[str, List[OCRWord]]:
+        """
+        OCR each block in parallel and merge text and words in block order
+        
+        Both Tesseract backends release the GIL (separate process or C
+        call), so blocks run on separate cores, within the OCR executor's
+        Tesseract slots. Word boxes are shifted back to page coordinates.
+        """
+        def recognize(box):
+            x, y, w, h = box
+            with self.executor.tesseract_slots:
+                data = self.tesseract_engine.image_to_data(image.crop((x, y, x + w, y + h)))
+            return self._parse_tesseract_data(data)
+        
+        texts = []
+        words: List[OCRWord] = []
+        for (x, y, _, _), (block_text, block_words) in zip(blocks, self._get_tile_pool().map(recognize, blocks)):
+            if block_text:
+                texts.append(block_text)
+            for word in block_words:
+                words.append(word.model_copy(update={'left': word.left + x, 'top': word.top + y}))
+        
+        return "\n\n".join(texts), words
+    
     def _extract_with_google_vision(self, image: Image.Image) -> Optional[OCRResult]:
         """
         Extract text using Google Vision API
@@ -243,61 +463,272 @@ class OCRService:
                 error=str(e)
             )
     
-    def extract_text(self, image_data: str, plan: str = "free") -> OCRResult:
+    def _open_image(self, image_bytes: Union[bytes, memoryview]) -> Image.Image:
+        """
+        Decode an upload within the ocr_max_megapixels budget
+        
+        JPEGs larger than the budget are decoded directly at 1/2, 1/4 or 1/8
+        scale (Image.draft uses libjpeg's DCT scaling), so a 12MP phone photo
+        never exists at full resolution. Other formats are reduced right
+        after decoding.
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        max_pixels = settings.ocr_max_megapixels * 1_000_000
+        width, height = image.size
+        
+        if width * height <= max_pixels:
+            return image
+        
+        scale = math.sqrt(max_pixels / (width * height))
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image.draft(image.mode, target)
+        
+        if image.size[0] * image.size[1] > max_pixels:
+            image = image.resize(target, Image.BILINEAR, reducing_gap=3.0)
+        return image
+    
+    @staticmethod
+    def _estimate_text_height(gray: np.ndarray) -> Optional[float]:
+        """
+        Median glyph height in pixels, or None when no text-like blobs exist
+        
+        Works on an Otsu-binarized copy capped at ~1MP; connected components
+        that are too small (specks) or too large (lines, pictures) are ignored.
+        """
+        factor = max(1, int(math.sqrt(gray.size / 1_000_000)))
+        sample = gray[::factor, ::factor] if factor > 1 else gray
+        
+        _, binary = cv2.threshold(sample, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        if count <= 1:
+            return None
+        
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        widths = stats[1:, cv2.CC_STAT_WIDTH]
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        glyphs = (heights >= 3) & (heights < sample.shape[0] / 4) & (widths < sample.shape[1] / 2) & (areas >= 4)
+        if glyphs.sum() < 5:
+            return None
+        
+        return float(np.median(heights[glyphs])) * factor
+    
+    def _normalize_resolution(self, image: Image.Image) -> Image.Image:
+        """
+        Rescale so the median glyph height lands near ocr_target_text_height
+        
+        OCR accuracy stops improving past ~30px glyphs while preprocessing
+        and recognition cost keep growing with pixel count. Images within
+        ±30% of the target are left alone; upscaling is capped by
+        ocr_max_upscale and the megapixel budget.
+        """
+        start_time = time.time()
+        text_height = self._estimate_text_height(cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY))
+        if not text_height:
+            return image
+        
+        scale = settings.ocr_target_text_height / text_height
+        if 1 / 1.3 <= scale <= 1.3:
+            return image
+        
+        width, height = image.size
+        max_scale = math.sqrt(settings.ocr_max_megapixels * 1_000_000 / (width * height))
+        scale = min(scale, settings.ocr_max_upscale, max_scale)
+        
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        resample = Image.LANCZOS if scale > 1 else Image.BILINEAR
+        normalized = image.resize(size, resample, reducing_gap=3.0 if scale < 1 else None)
+        
+        metrics.histogram("ocr_normalize_seconds").observe(time.time() - start_time)
+        return normalized
+    
+    def _active_providers(self, plan: str) -> List[str]:
+        """Providers from the plan routing that can actually run in this process"""
+        available = {
+            'tesseract': True,
+            'google_vision': GOOGLE_VISION_AVAILABLE,
+            'azure_cv': AZURE_CV_AVAILABLE
+        }
+        return [p for p in OCR_ROUTING.get(plan, ['tesseract']) if available.get(p)]
+    
+    def _call_provider(self, provider: str, image: Image.Image) -> Optional[OCRResult]:
+        """
+        Run a single provider and record its latency
+        """
+        if provider == 'google_vision':
+            result = self._extract_with_google_vision(image)
+        elif provider == 'azure_cv':
+            result = self._extract_with_azure_cv(image)
+        elif provider == 'tesseract':
+            result = self._extract_with_tesseract(image)
+        else:
+            return None
+        
+        if result is not None:
+            metrics.histogram("ocr_provider_seconds", provider=provider).observe(result.processing_time)
+        return result
+    
+    def _hedge_delay(self, provider: str) -> float:
+        """
+        How long to wait on a provider before starting the next one
+        
+        Uses the provider's observed latency quantile once enough samples
+        exist, otherwise the configured default.
+        """
+        histogram = metrics.histogram("ocr_provider_seconds", provider=provider)
+        if histogram.count >= settings.ocr_hedge_min_samples:
+            delay = histogram.quantile(settings.ocr_hedge_quantile)
+            if delay is not None:
+                return max(settings.ocr_hedge_min_delay, delay)
+        return settings.ocr_hedge_delay
+    
+    def _get_hedge_pool(self) -> ThreadPoolExecutor:
+        """Initialize the hedging thread pool lazily"""
+        if not self._hedge_pool:
+            self._hedge_pool = ThreadPoolExecutor(
+                max_workers=settings.ocr_hedge_workers,
+                thread_name_prefix="ocr-hedge"
+            )
+        return self._hedge_pool
+    
+    def _run_providers(self, image: Image.Image, providers: List[str]) -> OCRResult:
+        """
+        Try providers in order of preference and return the best result
+        """
+        best_result = None
+        
+        for provider in providers:
+            result = self._call_provider(provider, image)
+            
+            if provider == 'tesseract':
+                if not best_result or (result.success and result.confidence > best_result.confidence):
+                    best_result = result
+            else:
+                if result and result.success and result.confidence > 0.8:
+                    return result
+                if result and result.success:
+                    best_result = result
+        
+        return best_result or self._no_provider_result()
+    
+    def _run_providers_hedged(self, image: Image.Image, providers: List[str]) -> OCRResult:
+        """
+        Race providers instead of walking them one by one
+        
+        The first provider starts immediately. Whenever the newest running
+        provider outlives its hedge delay (or every running provider has
+        answered without a confident result) the next provider is started.
+        The first result above 0.8 confidence wins; otherwise the most
+        confident successful result is returned once all have answered.
+        """
+        pool = self._get_hedge_pool()
+        remaining = list(providers)
+        running = {}
+        best_result = None
+        fallback = None
+        
+        def launch():
+            provider = remaining.pop(0)
+            running[pool.submit(self._call_provider, provider, image)] = provider
+            return provider
+        
+        newest = launch()
+        while running:
+            timeout = self._hedge_delay(newest) if remaining else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                newest = launch()
+                continue
+            
+            for future in done:
+                running.pop(future)
+                result = future.result()
+                if result is None:
+                    continue
+                if result.success and result.confidence > 0.8:
+                    return result
+                if result.success and (not best_result or result.confidence > best_result.confidence):
+                    best_result = result
+                elif not result.success:
+                    fallback = result
+            
+            if not running and remaining:
+                newest = launch()
+        
+        return best_result or fallback or self._no_provider_result()
+    
+    @staticmethod
+    def _no_provider_result() -> OCRResult:
+        return OCRResult(
+            provider=OCRProvider.TESSERACT,
+            text="",
+            confidence=0.0,
+            processing_time=0.0,
+            success=False,
+            error="No OCR providers available"
+        )
+    
+    def extract_text(self, image_data: Union[str, bytes, memoryview], plan: str = "free") -> OCRResult:
         """
         Extract text from image using the best available provider for the user's plan
         
         Args:
-            image_data: Base64 encoded image
+            image_data: Base64 encoded image, or the raw image bytes
             plan: User's subscription plan (free, pro, max)
             
         Returns:
             OCRResult with extracted text and metadata
         """
+        start_time = time.time()
+        
         try:
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Get available providers based on plan
-            from config import OCR_ROUTING
-            available_providers = OCR_ROUTING.get(plan, ['tesseract'])
-            
-            # Try providers in order of preference
-            best_result = None
-            
-            for provider in available_providers:
-                if provider == 'google_vision' and GOOGLE_VISION_AVAILABLE:
-                    result = self._extract_with_google_vision(image)
-                    if result and result.success and result.confidence > 0.8:
-                        return result
-                    if result and result.success:
-                        best_result = result
-                        
-                elif provider == 'azure_cv' and AZURE_CV_AVAILABLE:
-                    result = self._extract_with_azure_cv(image)
-                    if result and result.success and result.confidence > 0.8:
-                        return result
-                    if result and result.success:
-                        best_result = result
-                        
-                elif provider == 'tesseract':
-                    result = self._extract_with_tesseract(image)
-                    if not best_result or (result.success and result.confidence > best_result.confidence):
-                        best_result = result
-            
-            return best_result or OCRResult(
-                provider=OCRProvider.TESSERACT,
-                text="",
-                confidence=0.0,
-                processing_time=0.0,
-                success=False,
-                error="No OCR providers available"
-            )
+            # Decode base64 image (multipart uploads arrive as raw bytes)
+            if isinstance(image_data, str):
+                image_bytes = base64.b64decode(image_data)
+            else:
+                image_bytes = image_data
+            providers = self._active_providers(plan)
+            
+            # Identical uploads skip decoding and OCR entirely
+            cache_key = None
+            if self.result_cache:
+                cache_key = self.result_cache.make_key(image_bytes, providers, self.tesseract_config)
+                cached = self.result_cache.get(cache_key)
+                if cached:
+                    return cached.model_copy(update={'processing_time': time.time() - start_time})
+            
+            with metrics.time("ocr_decode_seconds"):
+                image = self._open_image(image_bytes)
+                
+                # Convert to RGB if necessary
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+            
+            # Re-encoded or resized copies of a known upload (pHash candidates, confirmed by content)
+            scope = ",".join(providers)
+            image_hash = None
+            if self.near_duplicates:
+                image_hash = phash(image)
+                signature = content_signature(image)
+                match = self.near_duplicates.find(scope, image_hash, signature)
+                if match:
+                    return match[1].model_copy(update={'processing_time': time.time() - start_time})
+            
+            image = self._normalize_resolution(image)
+            
+            if (settings.ocr_hedging_enabled and plan in settings.ocr_hedge_plans
+                    and len(providers) > 1):
+                result = self._run_providers_hedged(image, providers)
+            else:
+                result = self._run_providers(image, providers)
+            
+            if result.success and result.text:
+                if cache_key:
+                    self.result_cache.set(cache_key, result)
+                if image_hash is not None:
+                    self.near_duplicates.add(scope, image_hash, signature, result)
+            
+            return result
             
         except Exception as e:
             return OCRResult(
@@ -310,4 +741,13 @@ class OCRService:
             )
 
 # Global instance
-ocr_service = OCRService() 
\ No newline at end of file
+ocr_service = OCRService()
+
+def run_extraction(image_data: Union[str, bytes], plan: str = "free") -> OCRResult:
+    """
+    Module-level entry point for the OCR executor
+
+    Process pools pickle this function by reference, so each worker process
+    uses its own global OCRService instead of a copy sent with every job.
+    """
+    return ocr_service.extract_text(image_data, plan) 
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""
+Perceptual hash index for near-duplicate uploads
+DCT pHash + banded Hamming-distance lookup, confirmed on a binarized thumbnail
+"""
+
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from models import OCRResult
+from config import settings
+
+def phash(image: Image.Image, hash_size: int = 16) -> int:
+    """
+    Perceptual (DCT) hash of an image
+
+    The image is reduced to a 4*hash_size square grayscale grid and each bit
+    records whether a low-frequency DCT coefficient is above the median.
+    Low frequencies describe page layout, so the hash survives re-encoding,
+    resizing and brightness shifts while different pages land far apart.
+    """
+    side = hash_size * 4
+    small = image.convert('L').resize((side, side), Image.BILINEAR, reducing_gap=2.0)
+    coefficients = cv2.dct(np.asarray(small, dtype=np.float32))[:hash_size, :hash_size].flatten()
+    bits = coefficients > np.median(coefficients[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits between two hashes"""
+    return (a ^ b).bit_count()
+
+@dataclass(frozen=True)
+class ContentSignature:
+    """Binarized thumbnail of a page (ink = 1), stored as zlib-compressed packed bits"""
+    shape: Tuple[int, int]
+    bits: bytes
+
+    def unpack(self) -> np.ndarray:
+        count = self.shape[0] * self.shape[1]
+        flat = np.unpackbits(np.frombuffer(zlib.decompress(self.bits), dtype=np.uint8), count=count)
+        return flat.reshape(self.shape)
+
+def content_signature(image: Image.Image, side: Optional[int] = None) -> ContentSignature:
+    """
+    Otsu-binarized thumbnail, longest side `side` pixels (aspect kept)
+
+    The pHash only sees page layout, so two exercises with the same layout
+    and different numbers hash alike. At ~1000 pixels a digit is still a
+    few dozen ink pixels, enough to tell such pages apart. A text page
+    compresses to a few KB.
+    """
+    side = side or settings.ocr_phash_verify_side
+    gray = np.asarray(image.convert('L'))
+    scale = side / max(gray.shape)
+    size = (max(1, round(gray.shape[1] * scale)), max(1, round(gray.shape[0] * scale)))
+    small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    _, ink = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ContentSignature(ink.shape, zlib.compress(np.packbits(ink).tobytes(), 6))
+
+_NEIGHBOURHOOD = np.ones((3, 3), np.uint8)
+
+def signature_distance(a: ContentSignature, b: ContentSignature) -> int:
+    """
+    Ink pixels of either thumbnail with no ink within one pixel in the other
+
+    The one-pixel tolerance absorbs the edge jitter of resizing and JPEG
+    re-encoding (copies measure 0), while a changed digit or sign leaves
+    strokes where the other page has none. Thumbnails of different aspect
+    ratio are different pages.
+    """
+    if a.shape != b.shape:
+        if abs(a.shape[0] / a.shape[1] - b.shape[0] / b.shape[1]) > 0.02:
+            return a.shape[0] * a.shape[1]
+    ink_a = a.unpack()
+    ink_b = b.unpack()
+    if ink_b.shape != ink_a.shape:
+        ink_b = cv2.resize(ink_b, (ink_a.shape[1], ink_a.shape[0]), interpolation=cv2.INTER_NEAREST)
+    missing_in_b = ink_a & (1 - cv2.dilate(ink_b, _NEIGHBOURHOOD))
+    missing_in_a = ink_b & (1 - cv2.dilate(ink_a, _NEIGHBOURHOOD))
+    return int(missing_in_b.sum()) + int(missing_in_a.sum())
+
+class PerceptualHashIndex:
+    """
+    Bounded index of OCR results by perceptual hash
+
+    Hashes are split into equal bands and bucketed by band value. Two hashes
+    within distance d < bands must share at least one band exactly
+    (pigeonhole), so lookups only compare against bucket candidates instead
+    of scanning every entry. Entries are grouped by scope (the provider
+    chain) so a free-tier result is never served to a paid plan.
+
+    The hash only nominates candidates: a result is reused when the
+    candidate's content signature is also within max_diff_pixels of the
+    upload, so same-layout pages with different numbers never match.
+    """
+
+    def __init__(self, threshold: Optional[int] = None, max_entries: Optional[int] = None,
+                 hash_bits: int = 256, bands: int = 16, max_diff_pixels: Optional[int] = None):
+        requested = settings.ocr_phash_threshold if threshold is None else threshold
+        self.bands = bands
+        self.band_bits = hash_bits // bands
+        self.threshold = min(requested, bands - 1)
+        self.max_entries = max_entries or settings.ocr_phash_max_entries
+        self.max_diff_pixels = settings.ocr_phash_max_diff_pixels if max_diff_pixels is None else max_diff_pixels
+        self._band_mask = (1 << self.band_bits) - 1
+
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[ContentSignature, OCRResult]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[int]] = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self._hits = 0
+        self._misses = 0
+        self._rejected = 0  # Hash candidates whose content differed
+
+    def _band_keys(self, scope: str, image_hash: int) -> List[Tuple[str, int, int]]:
+        return [
+            (scope, band, (image_hash >> (band * self.band_bits)) & self._band_mask)
+            for band in range(self.bands)
+        ]
+
+    def find(self, scope: str, image_hash: int, signature: ContentSignature) -> Optional[Tuple[int, OCRResult]]:
+        """Return (hash distance, result) of the closest entry within the threshold whose content matches"""
+        with self._lock:
+            candidates: Set[int] = set()
+            for key in self._band_keys(scope, image_hash):
+                candidates.update(self._buckets.get(key, ()))
+            nearby = sorted(
+                (distance, candidate) for candidate in candidates
+                if (distance := hamming_distance(candidate, image_hash)) <= self.threshold
+            )
+            entries = [(distance, candidate, self._entries[(scope, candidate)]) for distance, candidate in nearby]
+
+        # Signature checks run outside the lock (a few ms each)
+        for distance, candidate, (stored_signature, result) in entries:
+            if signature_distance(stored_signature, signature) <= self.max_diff_pixels:
+                with self._lock:
+                    self._hits += 1
+                    if (scope, candidate) in self._entries:
+                        self._entries.move_to_end((scope, candidate))
+                return distance, result
+            with self._lock:
+                self._rejected += 1
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def add(self, scope: str, image_hash: int, signature: ContentSignature, result: OCRResult):
+        """Index a result, evicting the least recently used entry when full"""
+        with self._lock:
+            if (scope, image_hash) not in self._entries:
+                for key in self._band_keys(scope, image_hash):
+                    self._buckets.setdefault(key, set()).add(image_hash)
+            self._entries[(scope, image_hash)] = (signature, result)
+            self._entries.move_to_end((scope, image_hash))
+
+            while len(self._entries) > self.max_entries:
+                (old_scope, old_hash), _ = self._entries.popitem(last=False)
+                for key in self._band_keys(old_scope, old_hash):
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(old_hash)
+                        if not bucket:
+                            del self._buckets[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return index statistics"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'items': len(self._entries),
+                'max_items': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self._hits,
+                'misses': self._misses,
+                'rejected': self._rejected,
+                'hit_rate': self._hits / total if total else 0.0
+            }
+
+# Global instance
+phash_index = PerceptualHashIndex()
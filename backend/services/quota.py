@@ -0,0 +1,110 @@
+"""
+Monthly plan quotas
+Atomic reserve → commit/release on a per-user monthly counter
+"""
+
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from services.state_backend import StateBackend, MemoryStateBackend, state_backend
+
+# Counters outlive the end of their month by this much (clock skew between workers)
+QUOTA_COUNTER_GRACE = 24 * 3600
+
+def counter_ttl(now: Optional[datetime] = None) -> float:
+    """Seconds until the end of the billing month of now, plus the grace period"""
+    now = now or datetime.now()
+    period_end = (now.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return (period_end - now).total_seconds() + QUOTA_COUNTER_GRACE
+
+def create_quota_backend(backend: Optional[StateBackend] = None) -> StateBackend:
+    """
+    Store of the monthly counters
+
+    Shared backends only expire keys by TTL, so counters live next to the
+    other state. The per-process memory backend is an LRU shared with
+    sessions and rate limit state, where churn would evict a counter and
+    silently reset the user's usage; counters get their own memory store
+    without a size bound instead.
+    """
+    backend = backend or state_backend
+    if backend.shared:
+        return backend
+    return MemoryStateBackend(max_items=sys.maxsize)
+
+@dataclass
+class QuotaReservation:
+    """One request held against a user's monthly quota"""
+    user_id: str
+    key: str
+    used: int  # Counter value after this reservation
+    settled: bool = False
+
+class QuotaService:
+    """
+    Per-user monthly request quota
+
+    The counter holds committed plus in-flight requests. reserve() is a
+    single bounded increment in the state backend (a Lua script on Redis,
+    BEGIN IMMEDIATE on SQLite), so concurrent requests can never push it
+    past the plan limit; release() refunds a request that failed. The
+    month is part of the key, so a new month starts from zero without a
+    reset step.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_quota_backend()
+
+        # Statistics
+        self._reserved = 0
+        self._rejected = 0
+        self._committed = 0
+        self._released = 0
+
+    @staticmethod
+    def counter_key(user_id: str, now: Optional[datetime] = None) -> str:
+        return f"usage:{user_id}:{(now or datetime.now()):%Y-%m}"
+
+    def usage(self, user_id: str) -> int:
+        """Requests counted this month (including in-flight reservations)"""
+        return self.backend.get_int(self.counter_key(user_id))
+
+    def reserve(self, user_id: str, monthly_limit: int) -> Optional[QuotaReservation]:
+        """Hold one request; None when the quota is used up (monthly_limit -1 = unlimited)"""
+        key = self.counter_key(user_id)
+        used = self.backend.incr_bounded(
+            key, 1, None if monthly_limit < 0 else monthly_limit, counter_ttl()
+        )
+        if used is None:
+            self._rejected += 1
+            return None
+        self._reserved += 1
+        return QuotaReservation(user_id, key, used)
+
+    def commit(self, reservation: QuotaReservation):
+        """Keep the request counted (it finished)"""
+        if not reservation.settled:
+            reservation.settled = True
+            self._committed += 1
+
+    def release(self, reservation: QuotaReservation):
+        """Refund a request that failed or was abandoned"""
+        if not reservation.settled:
+            reservation.settled = True
+            self.backend.incr_bounded(reservation.key, -1, None, counter_ttl())
+            self._released += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return quota statistics"""
+        return {
+            'reserved': self._reserved,
+            'rejected': self._rejected,
+            'committed': self._committed,
+            'released': self._released,
+            'in_flight': self._reserved - self._committed - self._released
+        }
+
+# Global instance
+quota_service = QuotaService()
@@ -0,0 +1,100 @@
+"""
+Per-user request rate limiting
+GCRA (generic cell rate algorithm) over the shared state backend
+"""
+
+import math
+import struct
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from services.state_backend import state_backend
+
+@dataclass
+class RateLimitDecision:
+    """Outcome of one rate limit check, ready for the X-RateLimit-* headers"""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float  # Seconds until the next request is allowed (0 when allowed)
+    reset_after: float  # Seconds until the full burst is available again
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after))
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+def gcra(tat: Optional[float], now: float, emission_interval: float, burst: int) -> Tuple[Optional[float], RateLimitDecision]:
+    """
+    One GCRA step
+
+    tat is the theoretical arrival time: when the user's bucket would be
+    empty again. A request is allowed while tat stays within burst
+    emission intervals of now. Returns (new tat or None when rejected,
+    decision); the limit reported is requests per minute.
+    """
+    limit = round(60.0 / emission_interval)
+    tat = max(tat or now, now)
+    new_tat = tat + emission_interval
+    allow_at = new_tat - burst * emission_interval
+
+    if now < allow_at:
+        return None, RateLimitDecision(False, limit, 0, allow_at - now, tat - now)
+
+    remaining = int((now - allow_at) / emission_interval + 1e-9)
+    return new_tat, RateLimitDecision(True, limit, remaining, 0.0, new_tat - now)
+
+class GCRARateLimiter:
+    """
+    Requests-per-minute limiter keyed by user
+
+    Keeps a single float (the theoretical arrival time) per user, so a
+    check is one atomic read-modify-write in the state backend: a dict
+    update under a short lock in memory, BEGIN IMMEDIATE on SQLite and
+    WATCH/MULTI on Redis, which makes the limit hold across workers.
+    Unlike the legacy RateLimiter there is no request history to trim and
+    the retry time is exact.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or state_backend
+
+        # Statistics
+        self._allowed = 0
+        self._rejected = 0
+
+    def check(self, key: str, requests_per_minute: int, burst: Optional[int] = None) -> RateLimitDecision:
+        """Count one request for key; requests_per_minute <= 0 means unlimited"""
+        if requests_per_minute <= 0:
+            return RateLimitDecision(True, 0, 0, 0.0, 0.0)
+
+        emission_interval = 60.0 / requests_per_minute
+        burst = burst or requests_per_minute
+
+        def step(value: Optional[bytes]):
+            now = time.time()
+            tat = struct.unpack("!d", value)[0] if value else None
+            new_tat, decision = gcra(tat, now, emission_interval, burst)
+            if new_tat is None:
+                return None, 0.0, decision
+            return struct.pack("!d", new_tat), new_tat - now, decision
+
+        decision = self.backend.update(f"ratelimit:{key}", step)
+        if decision.allowed:
+            self._allowed += 1
+        else:
+            self._rejected += 1
+        return decision
+
+    def get_stats(self) -> Dict[str, int]:
+        """Return limiter statistics"""
+        return {'allowed': self._allowed, 'rejected': self._rejected}
+
+# Global instance
+rate_limiter = GCRARateLimiter()
@@ -0,0 +1,309 @@
+"""
+Bounded stores for per-request and per-session state
+Size/age-evicting dicts + result store with SQLite (zlib) spill
+"""
+
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from models import ProcessingResult, ProcessingSummary
+from config import settings
+
+V = TypeVar("V")
+
+# Characters of extracted text kept in a summary
+SUMMARY_PREVIEW_CHARS = 200
+
+class BoundedTTLDict(Generic[V]):
+    """
+    Dict with LRU size bound and per-entry expiry
+
+    Drop-in for the plain module-level dicts: [], []=, in, get and del.
+    on_evict(key, value) is called for entries dropped by the size bound
+    or found expired while making room (not for del).
+    """
+
+    def __init__(self, max_items: int, ttl: float, on_evict: Optional[Callable[[Any, V], None]] = None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Any, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def __getitem__(self, key) -> V:
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key) -> bool:
+        """Membership check that does not count as a use"""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def __setitem__(self, key, value: V):
+        self.set(key, value)
+
+    def set(self, key, value: V, ttl: Optional[float] = None):
+        """Store a value, optionally with its own TTL instead of the dict's"""
+        now = time.time()
+        evicted: List[Tuple[Any, V]] = []
+        with self._lock:
+            self._data[key] = (now + (ttl or self.ttl), value)
+            self._data.move_to_end(key)
+            while self._data:
+                oldest_key, (expires_at, oldest_value) = next(iter(self._data.items()))
+                if len(self._data) <= self.max_items and expires_at > now:
+                    break
+                del self._data[oldest_key]
+                self._evictions += 1
+                evicted.append((oldest_key, oldest_value))
+        if self.on_evict:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'items': len(self._data), 'max_items': self.max_items, 'evictions': self._evictions}
+
+def summarize(result: ProcessingResult) -> ProcessingSummary:
+    """Small listing view of a result (no OCR words, no explanation)"""
+    text = result.extracted_text or ""
+    return ProcessingSummary(
+        request_id=result.request_id,
+        status=result.status,
+        created_at=result.created_at,
+        subject_detected=result.subject_detected,
+        confidence_score=result.confidence_score,
+        processing_time_total=result.processing_time_total,
+        error=result.error,
+        text_preview=text[:SUMMARY_PREVIEW_CHARS] or None,
+        user_id=result.user_id
+    )
+
+class ResultStore:
+    """
+    Bounded store of processing results
+
+    Every live request keeps a small summary in memory (size- and
+    age-bounded). Full payloads stay in memory only for the most recent
+    hot_items requests when a spill directory is configured; older ones
+    are zlib-compressed into SQLite and read back only by get(). Without
+    a spill directory, full payloads share the summary bound. on_evict
+    receives (request_id, summary) of results pushed out by the bound.
+    """
+
+    def __init__(self, max_items: Optional[int] = None, ttl: Optional[int] = None,
+                 spill_dir: Optional[str] = None, hot_items: Optional[int] = None,
+                 on_evict: Optional[Callable[[str, ProcessingSummary], None]] = None):
+        self.max_items = max_items or settings.result_store_max_items
+        self.ttl = ttl or settings.result_store_ttl
+        self._summaries: BoundedTTLDict[ProcessingSummary] = BoundedTTLDict(self.max_items, self.ttl, on_evict)
+        self._hot: "OrderedDict[str, ProcessingResult]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.db_path: Optional[Path] = None
+        self.hot_items = self.max_items
+        if spill_dir:
+            Path(spill_dir).mkdir(parents=True, exist_ok=True)
+            self.db_path = Path(spill_dir) / "results.db"
+            self.hot_items = hot_items or settings.result_store_hot_items
+            self._init_database()
+        # Spilled results are read and written on the calling thread
+        self.blocking = self.db_path is not None
+
+        # Statistics
+        self._spilled = 0
+        self._disk_reads = 0
+
+    def _init_database(self):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS processing_results (
+                    request_id TEXT PRIMARY KEY,
+                    value BLOB,
+                    expires_at REAL
+                )
+            """)
+            conn.execute("DELETE FROM processing_results WHERE expires_at < ?", (time.time(),))
+
+    def __setitem__(self, request_id: str, result: ProcessingResult):
+        with self._lock:
+            self._summaries[request_id] = summarize(result)
+            self._hot[request_id] = result
+            self._hot.move_to_end(request_id)
+
+            # Drop payloads whose summary was evicted (size or age)
+            while self._hot and next(iter(self._hot)) not in self._summaries:
+                self._discard(self._hot.popitem(last=False)[0])
+
+            while len(self._hot) > self.hot_items:
+                old_id, old_result = self._hot.popitem(last=False)
+                self._spill(old_id, old_result)
+
+    def get(self, request_id: str, default: Optional[ProcessingResult] = None) -> Optional[ProcessingResult]:
+        """Full result (memory, then spill file)"""
+        with self._lock:
+            if request_id not in self._summaries:
+                self._hot.pop(request_id, None)
+                return default
+            result = self._hot.get(request_id)
+        if result is not None:
+            return result
+        return self._load(request_id) or default
+
+    def __getitem__(self, request_id: str) -> ProcessingResult:
+        result = self.get(request_id)
+        if result is None:
+            raise KeyError(request_id)
+        return result
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._summaries
+
+    def get_summary(self, request_id: str) -> Optional[ProcessingSummary]:
+        return self._summaries.get(request_id)
+
+    def _spill(self, request_id: str, result: ProcessingResult):
+        if not self.db_path:
+            return
+        try:
+            value = zlib.compress(result.model_dump_json().encode())
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO processing_results (request_id, value, expires_at) VALUES (?, ?, ?)",
+                    (request_id, value, time.time() + self.ttl)
+                )
+                self._spilled += 1
+                if self._spilled % 500 == 0:
+                    conn.execute("DELETE FROM processing_results WHERE expires_at < ?", (time.time(),))
+        except sqlite3.Error as e:
+            print(f"⚠️ Result spill failed: {str(e)}")
+
+    def _discard(self, request_id: str):
+        if not self.db_path:
+            return
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("DELETE FROM processing_results WHERE request_id = ?", (request_id,))
+        except sqlite3.Error as e:
+            print(f"⚠️ Result discard failed: {str(e)}")
+
+    def _load(self, request_id: str) -> Optional[ProcessingResult]:
+        if not self.db_path:
+            return None
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT value FROM processing_results WHERE request_id = ? AND expires_at > ?",
+                    (request_id, time.time())
+                ).fetchone()
+            if not row:
+                return None
+            self._disk_reads += 1
+            return ProcessingResult.model_validate_json(zlib.decompress(row[0]))
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            print(f"⚠️ Result load failed: {str(e)}")
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return store statistics"""
+        with self._lock:
+            return {
+                'items': len(self._summaries),
+                'max_items': self.max_items,
+                'hot_items': len(self._hot),
+                'evictions': self._summaries.get_stats()['evictions'],
+                'spilled': self._spilled,
+                'disk_reads': self._disk_reads,
+                'persistent': self.db_path is not None
+            }
+
+class SharedResultStore:
+    """
+    Processing results in a shared StateBackend (SQLite file or Redis)
+
+    Same interface as ResultStore. Summary and zlib-compressed payload are
+    separate keys, so /history never transfers full results. Nothing is
+    cached in process: a job's status can change on another worker. Size
+    is bounded by the TTL (and by the server's eviction policy on Redis).
+    """
+
+    def __init__(self, backend, ttl: Optional[int] = None):
+        self.backend = backend
+        self.ttl = ttl or settings.result_store_ttl
+        self.blocking = backend.blocking
+
+        # Statistics
+        self._writes = 0
+        self._reads = 0
+
+    def __setitem__(self, request_id: str, result: ProcessingResult):
+        self.backend.set(f"result:{request_id}", zlib.compress(result.model_dump_json().encode()), self.ttl)
+        self.backend.set(f"result_summary:{request_id}", summarize(result).model_dump_json().encode(), self.ttl)
+        self._writes += 1
+
+    def get(self, request_id: str, default: Optional[ProcessingResult] = None) -> Optional[ProcessingResult]:
+        value = self.backend.get(f"result:{request_id}")
+        if value is None:
+            return default
+        self._reads += 1
+        return ProcessingResult.model_validate_json(zlib.decompress(value))
+
+    def __getitem__(self, request_id: str) -> ProcessingResult:
+        result = self.get(request_id)
+        if result is None:
+            raise KeyError(request_id)
+        return result
+
+    def __contains__(self, request_id: str) -> bool:
+        return self.backend.get(f"result_summary:{request_id}") is not None
+
+    def get_summary(self, request_id: str) -> Optional[ProcessingSummary]:
+        value = self.backend.get(f"result_summary:{request_id}")
+        return ProcessingSummary.model_validate_json(value) if value is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return store statistics (this worker's traffic)"""
+        return {
+            'backend': self.backend.name,
+            'writes': self._writes,
+            'reads': self._reads,
+            'persistent': True
+        }
+
+def create_result_store(backend=None, on_evict: Optional[Callable[[str, ProcessingSummary], None]] = None):
+    """
+    Shared store when the state backend is shared across workers, bounded local store otherwise
+
+    on_evict only fires for the local store; shared results expire by TTL.
+    """
+    if backend is not None and backend.shared:
+        return SharedResultStore(backend)
+    return ResultStore(spill_dir=settings.result_store_dir, on_evict=on_evict)
@@ -0,0 +1,192 @@
+"""
+Semantic response cache for LLM explanations
+Character shingles + MinHash + LSH banding, fully local
+"""
+
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from models import LLMResponse
+from config import settings
+
+# Mersenne prime for the universal hash family (a * x + b) mod p
+MINHASH_PRIME = (1 << 31) - 1
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip accents and collapse punctuation/whitespace runs"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+def shingles(text: str, size: int = 5) -> Set[int]:
+    """
+    Hashed character shingles of the normalized text
+
+    Character shingles degrade gracefully with OCR noise: one misread
+    letter only changes the `size` shingles that cover it.
+    """
+    normalized = normalize_text(text)
+    if len(normalized) <= size:
+        return {zlib.crc32(normalized.encode()) & MINHASH_PRIME} if normalized else set()
+    return {
+        zlib.crc32(normalized[index:index + size].encode()) & MINHASH_PRIME
+        for index in range(len(normalized) - size + 1)
+    }
+
+def number_tokens(text: str) -> Tuple[str, ...]:
+    """Numbers in the text, in order; two questions differing only in data are not duplicates"""
+    return tuple(re.findall(r'\d+', normalize_text(text)))
+
+class MinHasher:
+    """MinHash signatures with a fixed, seeded permutation family"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, MINHASH_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, values: Set[int]) -> np.ndarray:
+        """Minimum of each permutation over the shingle set"""
+        if not values:
+            return np.full(self.num_perm, MINHASH_PRIME, dtype=np.uint64)
+        x = np.fromiter(values, dtype=np.uint64, count=len(values))[:, None]
+        return ((x * self._a + self._b) % MINHASH_PRIME).min(axis=0)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return float(np.count_nonzero(a == b)) / len(a)
+
+class SemanticResponseCache:
+    """
+    Near-duplicate cache of LLM responses
+
+    Signatures are split into bands and bucketed by band value, so a lookup
+    only compares against entries that collide in at least one band; the
+    estimated Jaccard similarity must then reach the threshold and the
+    numbers in both texts must match exactly, so the same exercise with
+    different data is never answered from cache. Entries are scoped
+    (plan/model tier, subject and the student's question, matched exactly),
+    expire after the TTL and are evicted least recently used. Only the OCR
+    text is matched fuzzily: questions are short, so two different ones
+    over the same text would look near-identical as a whole prompt.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, ttl: Optional[int] = None,
+                 max_entries: Optional[int] = None, num_perm: int = 128, bands: int = 32,
+                 shingle_size: Optional[int] = None):
+        self.threshold = settings.llm_cache_threshold if threshold is None else threshold
+        self.ttl = ttl or settings.llm_cache_ttl
+        self.max_entries = max_entries or settings.llm_cache_max_entries
+        self.shingle_size = shingle_size or settings.llm_cache_shingle_size
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+
+        self._entries: "OrderedDict[int, Tuple[float, str, np.ndarray, Tuple[str, ...], LLMResponse]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], Set[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        # Statistics
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_scope(plan: str, model: str, subject: Optional[str] = None, question: Optional[str] = None) -> str:
+        """Cache scope: answers never cross plan/model tiers, subjects or (normalized) questions"""
+        return f"{plan}:{model}:{normalize_text(subject or '')}:{normalize_text(question or '')}"
+
+    def _band_keys(self, scope: str, signature: np.ndarray) -> List[Tuple[str, int, bytes]]:
+        return [
+            (scope, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def _remove(self, entry_id: int):
+        """Drop an entry and its bucket references (lock held)"""
+        _, scope, signature, _, _ = self._entries.pop(entry_id)
+        for key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def get(self, text: str, scope: str) -> Optional[Tuple[float, LLMResponse]]:
+        """Return (similarity, response) of the closest live entry above the threshold"""
+        signature = self.hasher.signature(shingles(text, self.shingle_size))
+        numbers = number_tokens(text)
+        now = time.time()
+
+        with self._lock:
+            candidates: Set[int] = set()
+            for key in self._band_keys(scope, signature):
+                candidates.update(self._buckets.get(key, ()))
+
+            best = None
+            for entry_id in candidates:
+                expires_at, _, candidate, candidate_numbers, _ = self._entries[entry_id]
+                if expires_at <= now or candidate_numbers != numbers:
+                    continue
+                similarity = self.hasher.similarity(signature, candidate)
+                if similarity >= self.threshold and (best is None or similarity > best[0]):
+                    best = (similarity, entry_id)
+
+            if best is None:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._entries.move_to_end(best[1])
+            return best[0], self._entries[best[1]][4]
+
+    def set(self, text: str, scope: str, response: LLMResponse):
+        """Store a response, evicting expired and least recently used entries"""
+        signature = self.hasher.signature(shingles(text, self.shingle_size))
+        now = time.time()
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (now + self.ttl, scope, signature, number_tokens(text), response)
+            for key in self._band_keys(scope, signature):
+                self._buckets.setdefault(key, set()).add(entry_id)
+
+            while self._entries:
+                oldest_id = next(iter(self._entries))
+                if len(self._entries) <= self.max_entries and self._entries[oldest_id][0] > now:
+                    break
+                self._remove(oldest_id)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return cache statistics"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'items': len(self._entries),
+                'max_items': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / total if total else 0.0,
+                'evictions': self._evictions
+            }
+
+# Global instance
+semantic_cache = SemanticResponseCache()
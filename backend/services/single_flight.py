@@ -0,0 +1,73 @@
+"""
+Request coalescing (single-flight)
+Concurrent identical calls share one in-flight computation
+"""
+
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, Union
+
+def content_key(*parts: Optional[Union[str, bytes, memoryview]]) -> str:
+    """SHA-256 over the given parts (None and empty values are distinct from each other)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            digest.update(b"\1")
+            continue
+        data = part.encode() if isinstance(part, str) else part
+        digest.update(b"\0" + len(data).to_bytes(8, 'big'))
+        digest.update(data)
+    return digest.hexdigest()
+
+class SingleFlight:
+    """
+    Deduplicate concurrent async calls by key
+
+    The first caller for a key starts the computation as its own task;
+    callers arriving while it runs await the same task. The task is
+    shielded, so a disconnecting caller never cancels the work the others
+    are waiting on. Results are not kept after completion (caching is the
+    job of the OCR and LLM caches).
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+        # Statistics
+        self._leaders = 0
+        self._followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True when another caller's call was reused"""
+        task = self._in_flight.get(key)
+        shared = task is not None
+
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self._leaders += 1
+        else:
+            self._followers += 1
+
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller went away
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return coalescing statistics"""
+        total = self._leaders + self._followers
+        return {
+            'in_flight': len(self._in_flight),
+            'leaders': self._leaders,
+            'coalesced': self._followers,
+            'coalesced_rate': self._followers / total if total else 0.0
+        }
+
+# Global instance
+single_flight = SingleFlight()
@@ -0,0 +1,369 @@
+"""
+Shared state backend (sessions, quota counters, results)
+Per-process memory → SQLite WAL file (one node) → Redis protocol (many nodes)
+"""
+
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+from services.result_store import BoundedTTLDict
+from config import settings
+
+M = TypeVar("M", bound=BaseModel)
+T = TypeVar("T")
+
+# update() callback: current value -> (new value or None to leave it, new TTL, result)
+Updater = Callable[[Optional[bytes]], Tuple[Optional[bytes], float, T]]
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+class StateBackend(ABC):
+    """
+    Byte-valued key/value store with per-key TTL and atomic counters
+
+    shared is True when every worker process sees the same data, so
+    callers can skip their in-process caches. blocking is True when calls
+    wait on disk, locks or the network, so async callers must run them
+    off the event loop.
+    """
+
+    name = "base"
+    shared = False
+    blocking = False
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Value of key, None when missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float):
+        """Store value under key for ttl seconds"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove key (no-op when missing)"""
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Atomically add to a counter; ttl applies when the counter is created"""
+
+    @abstractmethod
+    def update(self, key: str, fn: Updater) -> T:
+        """Atomic read-modify-write of one key; fn may run more than once"""
+
+    def incr_bounded(self, key: str, amount: int, limit: Optional[int] = None,
+                     ttl: Optional[float] = None) -> Optional[int]:
+        """
+        Atomically add amount unless the counter would leave [0, limit]
+
+        Returns the new value, or None when the change was refused.
+        """
+        def step(value: Optional[bytes]):
+            new_value = (int(value) if value else 0) + amount
+            if new_value < 0 or (limit is not None and new_value > limit):
+                return None, 0.0, None
+            return str(new_value).encode(), ttl or settings.session_ttl, new_value
+
+        return self.update(key, step)
+
+    def get_int(self, key: str) -> int:
+        value = self.get(key)
+        return int(value) if value is not None else 0
+
+    def ping(self) -> bool:
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': self.name, 'shared': self.shared}
+
+class MemoryStateBackend(StateBackend):
+    """Per-process state (single worker, development and tests)"""
+
+    name = "memory"
+    shared = False
+    blocking = False
+
+    def __init__(self, max_items: Optional[int] = None, ttl: Optional[float] = None):
+        self._data: BoundedTTLDict[bytes] = BoundedTTLDict(
+            max_items or settings.session_max_items, ttl or settings.session_ttl
+        )
+        self._update_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._data.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._data.set(key, value, ttl)
+
+    def delete(self, key: str):
+        if key in self._data:
+            del self._data[key]
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Counters here extend their TTL on every update"""
+        with self._update_lock:
+            value = self.get_int(key) + amount
+            self._data.set(key, str(value).encode(), ttl)
+            return value
+
+    def update(self, key: str, fn: Updater) -> T:
+        with self._update_lock:
+            value, ttl, result = fn(self.get(key))
+            if value is not None:
+                self._data.set(key, value, ttl)
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), **self._data.get_stats()}
+
+class SQLiteStateBackend(StateBackend):
+    """
+    State in a SQLite file in WAL mode
+
+    Every uvicorn worker on the same host opens the same file, so it is
+    a drop-in for Redis on a single node. Counters are updated inside
+    BEGIN IMMEDIATE transactions, which serialize writers across processes.
+    """
+
+    name = "sqlite"
+    shared = True
+    blocking = True
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = Path(db_path or settings.state_db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS app_state (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.execute("DELETE FROM app_state WHERE expires_at <= ?", (time.time(),))
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; multi-statement updates use explicit transactions
+            conn = sqlite3.connect(self.db_path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT value FROM app_state WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO app_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl)
+        )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._connect().execute("DELETE FROM app_state WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM app_state WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM app_state WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            value = (int(row[0]) if row else 0) + amount
+            expires_at = row[1] if row else now + (ttl or settings.session_ttl)
+            conn.execute(
+                "INSERT OR REPLACE INTO app_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, str(value).encode(), expires_at)
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def update(self, key: str, fn: Updater) -> T:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM app_state WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            value, ttl, result = fn(bytes(row[0]) if row else None)
+            if value is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO app_state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, now + ttl)
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def ping(self) -> bool:
+        try:
+            self._connect().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+class RedisStateBackend(StateBackend):
+    """
+    State in any Redis-protocol server (Redis, Upstash, KeyDB, Dragonfly)
+
+    Uses the synchronous client with a shared connection pool; every call
+    is a single round trip (counters use one MULTI pipeline).
+    """
+
+    name = "redis"
+    shared = True
+    blocking = True
+
+    # KEYS[1] counter; ARGV amount, limit (-1 = none), TTL in ms for a new counter
+    INCR_BOUNDED_SCRIPT = """
+        local current = redis.call('GET', KEYS[1])
+        local value = tonumber(current or '0') + tonumber(ARGV[1])
+        if value < 0 or (tonumber(ARGV[2]) >= 0 and value > tonumber(ARGV[2])) then
+            return false
+        end
+        if current then
+            redis.call('INCRBY', KEYS[1], ARGV[1])
+        else
+            redis.call('SET', KEYS[1], value, 'PX', ARGV[3])
+        end
+        return value
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: Optional[str] = None):
+        self.prefix = prefix if prefix is not None else settings.state_key_prefix
+        self.client = redis.Redis.from_url(
+            url or settings.redis_url,
+            socket_timeout=settings.state_socket_timeout,
+            socket_connect_timeout=settings.state_socket_timeout,
+            health_check_interval=30
+        )
+        self._incr_bounded = self.client.register_script(self.INCR_BOUNDED_SCRIPT)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(self.prefix + key, value, px=int(ttl * 1000))
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        pipeline = self.client.pipeline(transaction=True)
+        # Create with the TTL only if missing, then add (EXPIRE NX needs Redis 7)
+        pipeline.set(self.prefix + key, 0, px=int((ttl or settings.session_ttl) * 1000), nx=True)
+        pipeline.incrby(self.prefix + key, amount)
+        return int(pipeline.execute()[1])
+
+    def incr_bounded(self, key: str, amount: int, limit: Optional[int] = None,
+                     ttl: Optional[float] = None) -> Optional[int]:
+        """One EVALSHA round trip, no retries under contention"""
+        value = self._incr_bounded(
+            keys=[self.prefix + key],
+            args=[amount, -1 if limit is None else limit, int((ttl or settings.session_ttl) * 1000)]
+        )
+        return int(value) if value is not None else None
+
+    def update(self, key: str, fn: Updater) -> T:
+        """Optimistic WATCH/MULTI transaction, retried when another client wrote the key"""
+        key = self.prefix + key
+        with self.client.pipeline(transaction=True) as pipeline:
+            while True:
+                try:
+                    pipeline.watch(key)
+                    value, ttl, result = fn(pipeline.get(key))
+                    pipeline.multi()
+                    if value is not None:
+                        pipeline.set(key, value, px=max(1, int(ttl * 1000)))
+                    pipeline.execute()
+                    return result
+                except redis.WatchError:
+                    continue
+
+    def ping(self) -> bool:
+        try:
+            return bool(self.client.ping())
+        except redis.RedisError:
+            return False
+
+class ModelStore(Generic[M]):
+    """
+    Pydantic models stored as JSON under a key namespace
+
+    Dict-like ([], []=, in, get, del) so it replaces the module-level
+    dicts. Values are copies: changes to a returned model are not seen by
+    other workers until it is stored again.
+    """
+
+    def __init__(self, backend: StateBackend, namespace: str, model: Type[M], ttl: float):
+        self.backend = backend
+        self.namespace = namespace
+        self.model = model
+        self.ttl = ttl
+        self.blocking = backend.blocking
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str, default: Optional[M] = None) -> Optional[M]:
+        value = self.backend.get(self._key(key))
+        return self.model.model_validate_json(value) if value is not None else default
+
+    def __getitem__(self, key: str) -> M:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        return self.backend.get(self._key(key)) is not None
+
+    def __setitem__(self, key: str, value: M):
+        self.backend.set(self._key(key), value.model_dump_json().encode(), self.ttl)
+
+    def __delitem__(self, key: str):
+        self.backend.delete(self._key(key))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self.backend.get_stats()
+
+def create_state_backend(backend: Optional[str] = None) -> StateBackend:
+    """Build the configured state backend"""
+    backend = backend or settings.state_backend
+    if backend == "redis":
+        if REDIS_AVAILABLE and settings.redis_url:
+            return RedisStateBackend()
+        print("⚠️ STATE_BACKEND=redis needs the redis package and REDIS_URL, using memory")
+    elif backend == "sqlite":
+        return SQLiteStateBackend()
+    return MemoryStateBackend()
+
+# Global instance
+state_backend = create_state_backend()
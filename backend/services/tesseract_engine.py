@@ -0,0 +1,200 @@
+"""
+Tesseract engine backends
+Subprocess (pytesseract) → pooled in-process handles (tesserocr)
+"""
+
+import os
+import queue
+import shlex
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import pytesseract
+from PIL import Image
+
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+from config import settings
+
+def parse_tesseract_config(config: str) -> Tuple[Optional[int], Optional[int], Dict[str, str]]:
+    """
+    Split a tesseract CLI config string into (oem, psm, variables)
+
+    '--oem 3 --psm 6 -c key=value' -> (3, 6, {'key': 'value'})
+    """
+    oem = psm = None
+    variables: Dict[str, str] = {}
+    tokens = shlex.split(config)
+    index = 0
+    while index < len(tokens):
+        token = tokens[index]
+        value = tokens[index + 1] if index + 1 < len(tokens) else None
+        if token == '--oem' and value is not None:
+            oem = int(value)
+            index += 1
+        elif token == '--psm' and value is not None:
+            psm = int(value)
+            index += 1
+        elif token == '-c' and value is not None and '=' in value:
+            key, _, var_value = value.partition('=')
+            variables[key] = var_value
+            index += 1
+        index += 1
+    return oem, psm, variables
+
+class SubprocessTesseractEngine:
+    """
+    One tesseract process per call via pytesseract
+
+    Always available, but every call forks the binary and reloads the
+    traineddata from disk.
+    """
+
+    name = "subprocess"
+
+    def __init__(self, config: str, lang: Optional[str] = None):
+        self.config = config
+        self.lang = lang or settings.tesseract_lang
+
+    def image_to_data(self, image: Image.Image) -> dict:
+        """Run recognition and return pytesseract's image_to_data dict"""
+        return pytesseract.image_to_data(
+            image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT
+        )
+
+    def get_stats(self) -> Dict[str, object]:
+        return {'backend': self.name}
+
+class PooledTesseractEngine:
+    """
+    Pool of warm tesserocr (libtesseract C API) handles
+
+    Each handle keeps the language model loaded, so a call only pays for
+    recognition. Handles are created on demand up to pool_size and handed
+    out one per thread; tesserocr releases the GIL while recognizing, so
+    the pool scales across cores.
+    """
+
+    name = "pooled"
+
+    def __init__(self, config: str, lang: Optional[str] = None, pool_size: Optional[int] = None):
+        if not TESSEROCR_AVAILABLE:
+            raise RuntimeError("tesserocr is not installed")
+
+        self.lang = lang or settings.tesseract_lang
+        self.pool_size = pool_size or settings.tesseract_pool_size or os.cpu_count() or 1
+        self.oem, self.psm, self.variables = parse_tesseract_config(config)
+
+        self._handles: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_handle(self):
+        """Load a new Tesseract handle (reads traineddata once)"""
+        # tesserocr's PSM/OEM constants are plain ints, same numbering as the CLI
+        kwargs = {'lang': self.lang, 'init': True}
+        if self.psm is not None:
+            kwargs['psm'] = self.psm
+        if self.oem is not None:
+            kwargs['oem'] = self.oem
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        for key, value in self.variables.items():
+            api.SetVariable(key, value)
+        return api
+
+    @contextmanager
+    def _acquire(self):
+        """Borrow a handle, creating one if the pool is not full yet"""
+        try:
+            api = self._handles.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.pool_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    api = self._create_handle()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                api = self._handles.get()
+
+        try:
+            yield api
+        finally:
+            api.Clear()
+            self._handles.put(api)
+
+    def image_to_data(self, image: Image.Image) -> dict:
+        """
+        Run recognition and return a dict shaped like pytesseract's
+        image_to_data output (word level rows only)
+        """
+        data = {key: [] for key in (
+            'level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+            'left', 'top', 'width', 'height', 'conf', 'text'
+        )}
+
+        with self._acquire() as api:
+            api.SetImage(image)
+            api.Recognize()
+            iterator = api.GetIterator()
+            if iterator is None:
+                return data
+
+            block = paragraph = line = word = 0
+            level = tesserocr.RIL.WORD
+            for result in tesserocr.iterate_level(iterator, level):
+                if result.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                    block, paragraph, line = block + 1, 0, 0
+                if result.IsAtBeginningOf(tesserocr.RIL.PARA):
+                    paragraph, line = paragraph + 1, 0
+                if result.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line, word = line + 1, 0
+                word += 1
+
+                bounding_box = result.BoundingBox(level) or (0, 0, 0, 0)
+                x1, y1, x2, y2 = bounding_box
+                data['level'].append(5)
+                data['page_num'].append(1)
+                data['block_num'].append(block)
+                data['par_num'].append(paragraph)
+                data['line_num'].append(line)
+                data['word_num'].append(word)
+                data['left'].append(x1)
+                data['top'].append(y1)
+                data['width'].append(x2 - x1)
+                data['height'].append(y2 - y1)
+                data['conf'].append(result.Confidence(level))
+                data['text'].append(result.GetUTF8Text(level) or "")
+
+        return data
+
+    def get_stats(self) -> Dict[str, object]:
+        return {
+            'backend': self.name,
+            'pool_size': self.pool_size,
+            'handles_created': self._created,
+            'handles_idle': self._handles.qsize()
+        }
+
+def create_tesseract_engine(config: str, backend: Optional[str] = None):
+    """
+    Build the configured Tesseract backend
+
+    Falls back to the subprocess backend when tesserocr is not installed.
+    """
+    backend = backend or settings.tesseract_backend
+    if backend == "pooled":
+        if TESSEROCR_AVAILABLE:
+            return PooledTesseractEngine(config)
+        print("⚠️ tesserocr not installed, falling back to subprocess Tesseract backend")
+    return SubprocessTesseractEngine(config)
@@ -0,0 +1,188 @@
+"""
+Streaming multipart upload parser
+Reads image uploads chunk by chunk with an early size limit
+"""
+
+import os
+from dataclasses import dataclass, field
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, Dict, Optional
+
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+# Room for multipart boundaries, part headers and the small text fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadError(Exception):
+    """Malformed upload (missing file, bad content type, ...)"""
+
+class UploadTooLargeError(UploadError):
+    """Upload exceeds settings.max_file_size"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds the {max_size} byte limit")
+        self.max_size = max_size
+
+@dataclass
+class ImageUpload:
+    """Parsed multipart upload"""
+    data: bytes
+    filename: str
+    content_type: Optional[str] = None
+    fields: Dict[str, str] = field(default_factory=dict)
+
+class _UploadCollector:
+    """
+    MultipartParser callbacks that keep only the first file part
+
+    File bytes go into a SpooledTemporaryFile (memory up to
+    upload_spool_max_size, then disk); text fields are kept as strings.
+    """
+
+    def __init__(self, file_field: str, max_size: int):
+        self.file_field = file_field
+        self.max_size = max_size
+        self.fields: Dict[str, str] = {}
+        self.spool: Optional[SpooledTemporaryFile] = None
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.file_size = 0
+        self.pending_writes = []
+
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._part_name: Optional[str] = None
+        self._part_is_file = False
+        self._part_data = bytearray()
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._part_name = None
+        self._part_is_file = False
+        self._part_data = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._part_name = options.get(b"name", b"").decode("utf-8", "replace")
+
+        if b"filename" in options and self._part_name == self.file_field and self.spool is None:
+            self._part_is_file = True
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            content_type = self._headers.get(b"content-type")
+            self.content_type = content_type.decode("latin-1") if content_type else None
+            self.spool = SpooledTemporaryFile(max_size=settings.upload_spool_max_size)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._part_is_file:
+            self.file_size += end - start
+            if self.file_size > self.max_size:
+                raise UploadTooLargeError(self.max_size)
+            self.pending_writes.append(data[start:end])
+        elif self._part_name is not None:
+            self._part_data += data[start:end]
+            if len(self._part_data) > MULTIPART_OVERHEAD:
+                raise UploadError(f"Field '{self._part_name}' is too large")
+
+    def on_part_end(self):
+        if not self._part_is_file and self._part_name:
+            self.fields[self._part_name] = self._part_data.decode("utf-8", "replace")
+
+async def read_image_upload(headers, stream: AsyncIterator[bytes], file_field: str = "file",
+                            max_size: Optional[int] = None) -> ImageUpload:
+    """
+    Parse a multipart/form-data body without buffering it up front
+
+    The declared Content-Length is checked before any byte is read, and the
+    running size of the file part is checked on every chunk, so oversized
+    uploads are rejected without reading the rest of the body.
+
+    Raises:
+        UploadTooLargeError: when the file is larger than max_size
+        UploadError: when the body is not a valid single-image upload
+    """
+    max_size = max_size or settings.max_file_size
+
+    content_type, params = parse_options_header(headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected multipart/form-data with a boundary")
+
+    content_length = headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLargeError(max_size)
+
+    collector = _UploadCollector(file_field, max_size)
+    parser = MultipartParser(params[b"boundary"], collector.callbacks())
+    body_size = 0
+
+    try:
+        async for chunk in stream:
+            body_size += len(chunk)
+            if body_size > max_size + MULTIPART_OVERHEAD:
+                raise UploadTooLargeError(max_size)
+            parser.write(chunk)
+            if collector.pending_writes:
+                await _flush(collector)
+        parser.finalize()
+
+        if collector.spool is None or collector.file_size == 0:
+            raise UploadError(f"Missing file field '{file_field}'")
+
+        _, extension = os.path.splitext(collector.filename or "")
+        if extension.lower() not in settings.allowed_file_types:
+            raise UploadError(f"File type '{extension}' is not allowed")
+
+        collector.spool.seek(0)
+        data = await _read_spool(collector.spool)
+        return ImageUpload(
+            data=data,
+            filename=collector.filename,
+            content_type=collector.content_type,
+            fields=collector.fields
+        )
+    except ValueError as e:
+        # MultipartParser signals malformed bodies with ValueError subclasses
+        raise UploadError(str(e))
+    finally:
+        if collector.spool is not None:
+            collector.spool.close()
+
+async def _flush(collector: _UploadCollector):
+    """Write buffered file chunks, off the event loop once the spool is on disk"""
+    chunks, collector.pending_writes = collector.pending_writes, []
+    spool = collector.spool
+    if getattr(spool, "_rolled", False):
+        await run_in_threadpool(spool.writelines, chunks)
+    else:
+        spool.writelines(chunks)
+
+async def _read_spool(spool: SpooledTemporaryFile) -> bytes:
+    """Read the whole spool into a single bytes object"""
+    if getattr(spool, "_rolled", False):
+        return await run_in_threadpool(spool.read)
+    return spool.read()
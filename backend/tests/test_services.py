@@ -2,10 +2,33 @@ import pytest
 from unittest.mock import Mock, patch, AsyncMock
 from PIL import Image
 import io
+import json
+import time
 import base64
+import asyncio
+
+import httpx
 
 from services.ocr_service import OCRService, ocr_service
 from services.llm_service import LLMService, llm_service
+from services.ocr_executor import OCRExecutor, OCRQueueFullError
+from services.job_runner import JobRunner, JobQueueFullError, CallbackURLError, resolve_callback_url, sign_callback
+from services.ocr_cache import OCRResultCache
+from services.phash_index import PerceptualHashIndex, phash, hamming_distance, content_signature, signature_distance
+from services.metrics import LatencyHistogram, MetricsRegistry, DailyActivity
+from services.semantic_cache import SemanticResponseCache
+from services.llm_router import LLMRouter, CircuitBreaker
+from services.single_flight import SingleFlight, content_key
+from services.history_store import MemoryHistoryStore, SQLHistoryStore, RedisHistoryStore, create_history_store, parse_history_cursor
+from services.result_store import ResultStore, BoundedTTLDict, SharedResultStore, create_result_store
+from services.rate_limiter import GCRARateLimiter, gcra
+from services.quota import QuotaService, counter_ttl, create_quota_backend, QUOTA_COUNTER_GRACE
+from services.auth import TokenVerifier, JWKSCache, AuthError
+from services.billing import verify_stripe_signature, plan_change_from_event, WebhookSignatureError
+from services.state_backend import (
+    StateBackend, MemoryStateBackend, SQLiteStateBackend, ModelStore, create_state_backend
+)
+from services import tesseract_engine
 from config import settings
 
 class TestOCRService:
@@ -27,21 +50,39 @@ class TestOCRService:
         img.save(img_bytes, format='PNG')
         return base64.b64encode(img_bytes.getvalue()).decode('utf-8')
     
+    def create_tesseract_data(self) -> dict:
+        """Simula a saída de pytesseract.image_to_data (duas linhas, dois blocos)"""
+        return {
+            'page_num': [1, 1, 1, 1, 1, 1],
+            'block_num': [1, 1, 1, 1, 2, 2],
+            'par_num': [1, 1, 1, 1, 1, 1],
+            'line_num': [1, 1, 1, 2, 1, 1],
+            'text': ['', 'Extracted', 'text', 'here', ' ', 'x=2'],
+            'conf': ['-1', '95', '90.5', '85', '-1', '70'],
+            'left': [0, 10, 80, 10, 0, 10],
+            'top': [0, 10, 10, 30, 0, 60],
+            'width': [100, 60, 30, 40, 0, 25],
+            'height': [100, 12, 12, 12, 0, 12],
+        }
+    
     @patch('pytesseract.image_to_string')
     @patch('pytesseract.image_to_data')
     def test_tesseract_ocr_success(self, mock_data, mock_string, ocr_service_instance):
-        """Testa OCR com Tesseract bem-sucedido"""
-        mock_string.return_value = "Extracted text"
-        mock_data.return_value = {'conf': ['95', '90', '85']}
+        """Testa OCR com Tesseract bem-sucedido em uma única execução"""
+        mock_data.return_value = self.create_tesseract_data()
         
         image = self.create_test_image()
         result = ocr_service_instance._extract_with_tesseract(image)
         
-        assert result.text == "Extracted text"
+        assert result.text == "Extracted text\nhere\n\nx=2"
         assert result.provider.value == "tesseract"
         assert result.success is True
-        assert result.confidence > 0
+        assert result.confidence == pytest.approx((95 + 90.5 + 85 + 70) / 4 / 100)
         assert result.processing_time >= 0
+        assert [word.text for word in result.words] == ["Extracted", "text", "here", "x=2"]
+        assert result.words[0].left == 10
+        mock_data.assert_called_once()
+        mock_string.assert_not_called()
     
     def test_extract_text_integration(self, ocr_service_instance):
         """Testa a função extract_text com dados reais"""
@@ -59,6 +100,1592 @@ class TestOCRService:
             # Se falhar por dependências, pelo menos testamos a estrutura
             pass
 
+class TestAdaptivePreprocessing:
+    """Testes para o pré-processamento adaptativo"""
+    
+    def create_page(self, noise: float = 0.0):
+        """Cria uma página sintética em tons de cinza com ruído gaussiano opcional"""
+        import numpy as np
+        from PIL import ImageDraw
+        
+        img = Image.new('L', (600, 400), color=255)
+        draw = ImageDraw.Draw(img)
+        for line in range(15):
+            draw.text((20, 20 + line * 24), f"Questão {line}: resolva 2x + 3 = 7", fill=0)
+        gray = np.asarray(img, dtype=np.float32)
+        if noise:
+            gray = gray + np.random.default_rng(0).normal(0, noise, gray.shape)
+        return np.clip(gray, 0, 255).astype(np.uint8)
+    
+    @pytest.mark.parametrize("noise,profile", [(0, "none"), (3, "median"), (20, "nlmeans")])
+    def test_profile_follows_noise(self, noise, profile):
+        """Testa escolha do perfil de acordo com o ruído estimado"""
+        assert OCRService()._choose_preprocess_profile(self.create_page(noise)) == profile
+    
+    def test_low_contrast_bumps_profile(self):
+        """Testa se imagens com pouco contraste recebem um perfil mais forte"""
+        page = (self.create_page() * 0.3 + 150).astype('uint8')
+        assert OCRService()._choose_preprocess_profile(page) == "median"
+    
+    def test_clean_image_skips_nlmeans(self):
+        """Testa que imagens limpas não passam pelo fastNlMeansDenoising"""
+        from services.metrics import metrics
+        histogram = metrics.histogram("ocr_preprocess_seconds", profile="none")
+        before = histogram.count
+        
+        with patch('cv2.fastNlMeansDenoising') as mock_nlmeans:
+            processed = OCRService()._preprocess_image(Image.fromarray(self.create_page()).convert('RGB'))
+        
+        mock_nlmeans.assert_not_called()
+        assert processed.size == (600, 400)
+        assert histogram.count == before + 1
+
+class TestTiledOCR:
+    """Testes para o OCR em blocos paralelos de páginas grandes"""
+    
+    def create_page(self) -> Image.Image:
+        """Página binarizada com três questões: duas lado a lado e uma abaixo"""
+        from PIL import ImageDraw
+        
+        img = Image.new('L', (1600, 1200), color=255)
+        draw = ImageDraw.Draw(img)
+        for left, top in [(100, 100), (900, 120), (100, 700)]:
+            for line in range(3):
+                for word in range(4):
+                    x = left + word * 140
+                    y = top + line * 45
+                    draw.rectangle([x, y, x + 100, y + 28], fill=0)
+        return img
+    
+    def test_blocks_in_reading_order(self):
+        """Testa separação em blocos e ordem de leitura"""
+        blocks = OCRService._find_text_blocks(self.create_page())
+        
+        assert len(blocks) == 3
+        assert [b[0] < 200 for b in blocks] == [True, False, True]
+        assert blocks[0][1] < blocks[2][1]
+        assert blocks[1][1] < blocks[2][1]
+    
+    def test_blocks_recognized_and_merged(self):
+        """Testa OCR paralelo por bloco com palavras em coordenadas da página"""
+        service = OCRService()
+        page = self.create_page()
+        
+        def fake_image_to_data(image):
+            label = f"w{image.size[0]}x{image.size[1]}"
+            return {
+                'page_num': [1], 'block_num': [1], 'par_num': [1], 'line_num': [1],
+                'text': [label], 'conf': ['90'],
+                'left': [5], 'top': [7], 'width': [50], 'height': [20]
+            }
+        
+        service.tesseract_engine = Mock()
+        service.tesseract_engine.image_to_data.side_effect = fake_image_to_data
+        
+        with patch.object(service, '_preprocess_image', return_value=page):
+            result = service._extract_with_tesseract(page.convert('RGB'))
+        
+        blocks = OCRService._find_text_blocks(page)
+        assert result.success is True
+        assert service.tesseract_engine.image_to_data.call_count == 3
+        assert result.text == "\n\n".join(f"w{w}x{h}" for _, _, w, h in blocks)
+        assert [(word.left, word.top) for word in result.words] == [(x + 5, y + 7) for x, y, _, _ in blocks]
+        assert result.confidence == pytest.approx(0.9)
+    
+    def test_tesseract_concurrency_bounded_by_executor(self):
+        """Testa que blocos e hedging nunca rodam mais Tesseracts que OCR_MAX_WORKERS"""
+        import threading
+        executor = OCRExecutor(max_workers=2, max_queue_size=16, mode="thread")
+        service = OCRService(executor=executor)
+        page = self.create_page()
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+        
+        def fake_image_to_data(image):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return {
+                'page_num': [1], 'block_num': [1], 'par_num': [1], 'line_num': [1],
+                'text': ['x'], 'conf': ['90'],
+                'left': [0], 'top': [0], 'width': [10], 'height': [10]
+            }
+        
+        service.tesseract_engine = Mock()
+        service.tesseract_engine.image_to_data.side_effect = fake_image_to_data
+        
+        async def scenario():
+            hedged = [service._get_hedge_pool().submit(service._extract_with_tesseract, page) for _ in range(4)]
+            await asyncio.gather(*(executor.run(service._extract_with_tesseract, page) for _ in range(4)))
+            return [future.result() for future in hedged]
+        
+        try:
+            with patch.object(service, '_preprocess_image', return_value=page), \
+                 patch.object(settings, 'ocr_tiling_workers', 8):
+                results = asyncio.run(scenario())
+        finally:
+            executor.shutdown()
+        
+        assert all(result.success for result in results)
+        assert service.tesseract_engine.image_to_data.call_count == 8 * 3
+        assert peak[0] <= 2
+    
+    def test_small_page_single_pass(self):
+        """Testa que páginas pequenas não são divididas"""
+        service = OCRService()
+        
+        assert service._should_tile(Image.new('L', (800, 600), color=255)) is False
+        with patch.object(settings, 'ocr_tiling_enabled', False):
+            assert service._should_tile(self.create_page()) is False
+        assert service._should_tile(self.create_page()) is True
+
+class TestResolutionNormalization:
+    """Testes para a normalização de resolução antes do OCR"""
+    
+    def create_glyph_page(self, size, glyph_height: int) -> Image.Image:
+        """Cria uma página com blocos do tamanho de caracteres"""
+        from PIL import ImageDraw
+        
+        img = Image.new('RGB', size, color='white')
+        draw = ImageDraw.Draw(img)
+        glyph_width = max(2, glyph_height // 2)
+        for row in range(5):
+            for col in range(20):
+                x = 20 + col * glyph_width * 2
+                y = 20 + row * glyph_height * 2
+                draw.rectangle([x, y, x + glyph_width, y + glyph_height], fill='black')
+        return img
+    
+    def test_large_jpeg_fits_budget(self):
+        """Testa decodificação reduzida de JPEGs acima do limite de megapixels"""
+        img = self.create_glyph_page((4000, 3000), 120)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=80)
+        
+        with patch.object(settings, 'ocr_max_megapixels', 4.0):
+            opened = OCRService()._open_image(buffer.getvalue())
+        
+        assert opened.size[0] * opened.size[1] <= 4_000_000
+        assert opened.size[0] / opened.size[1] == pytest.approx(4 / 3, rel=0.01)
+    
+    def test_large_png_is_reduced(self):
+        """Testa redução de formatos sem suporte a draft"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (3000, 3000), color='white').save(buffer, format='PNG')
+        
+        with patch.object(settings, 'ocr_max_megapixels', 1.0):
+            opened = OCRService()._open_image(buffer.getvalue())
+        
+        assert opened.size[0] * opened.size[1] <= 1_000_000
+    
+    def test_big_text_is_downscaled(self):
+        """Testa redução quando o texto é muito maior que o alvo"""
+        service = OCRService()
+        img = self.create_glyph_page((2400, 1400), 90)
+        
+        with patch.object(settings, 'ocr_target_text_height', 30):
+            normalized = service._normalize_resolution(img)
+        
+        assert normalized.size[0] == pytest.approx(800, abs=20)
+    
+    def test_target_sized_text_is_untouched(self):
+        """Testa que imagens já no tamanho alvo não são reprocessadas"""
+        img = self.create_glyph_page((1400, 400), 30)
+        
+        assert OCRService()._normalize_resolution(img) is img
+    
+    def test_blank_image_is_untouched(self):
+        """Testa imagem sem texto"""
+        img = Image.new('RGB', (100, 100), color='white')
+        
+        assert OCRService()._normalize_resolution(img) is img
+
+class TestTesseractEngine:
+    """Testes para os backends do Tesseract"""
+    
+    def test_parse_config(self):
+        """Testa conversão da configuração de linha de comando"""
+        oem, psm, variables = tesseract_engine.parse_tesseract_config(
+            OCRService().tesseract_config
+        )
+        
+        assert (oem, psm) == (3, 6)
+        assert variables["tessedit_char_whitelist"].startswith("0123456789")
+    
+    def test_pooled_falls_back_without_tesserocr(self):
+        """Testa fallback para subprocess quando tesserocr não está instalado"""
+        with patch.object(tesseract_engine, 'TESSEROCR_AVAILABLE', False):
+            engine = tesseract_engine.create_tesseract_engine("--psm 6", backend="pooled")
+        
+        assert engine.name == "subprocess"
+    
+    def test_pooled_engine_reuses_handles(self):
+        """Testa reuso de handles e formato compatível com image_to_data"""
+        fake = Mock()
+        fake.RIL.BLOCK, fake.RIL.PARA, fake.RIL.TEXTLINE, fake.RIL.WORD = 1, 2, 3, 4
+        words = [("Questão", (0, 0, 50, 10), {1, 2, 3}), ("1", (55, 0, 60, 10), set()),
+                 ("x=2", (0, 20, 30, 30), {3})]
+        
+        def iterate_level(iterator, level):
+            for text, box, starts in words:
+                item = Mock()
+                item.IsAtBeginningOf.side_effect = lambda ril, starts=starts: ril in starts
+                item.BoundingBox.return_value = box
+                item.Confidence.return_value = 91.0
+                item.GetUTF8Text.return_value = text
+                yield item
+        
+        fake.iterate_level.side_effect = iterate_level
+        
+        with patch.object(tesseract_engine, 'TESSEROCR_AVAILABLE', True), \
+             patch.object(tesseract_engine, 'tesserocr', fake, create=True):
+            engine = tesseract_engine.PooledTesseractEngine("--oem 3 --psm 6 -c a=b", pool_size=2)
+            first = engine.image_to_data(Image.new('L', (60, 30)))
+            engine.image_to_data(Image.new('L', (60, 30)))
+        
+        assert fake.PyTessBaseAPI.call_count == 1
+        fake.PyTessBaseAPI.assert_called_with(lang=settings.tesseract_lang, init=True, psm=6, oem=3)
+        text, parsed = OCRService._parse_tesseract_data(first)
+        assert text == "Questão 1\nx=2"
+        assert parsed[1].left == 55 and parsed[1].width == 5
+
+class TestOCRResultCache:
+    """Testes para o cache de resultados de OCR"""
+    
+    def create_result(self, text: str = "Cached text"):
+        from models import OCRResult, OCRProvider
+        return OCRResult(
+            provider=OCRProvider.TESSERACT,
+            text=text,
+            confidence=0.9,
+            processing_time=1.5,
+            success=True
+        )
+    
+    def test_key_depends_on_providers_and_config(self):
+        """Testa se a chave muda com provedores e configuração"""
+        key = OCRResultCache.make_key(b"image", ["tesseract"], "--psm 6")
+        
+        assert key == OCRResultCache.make_key(b"image", ["tesseract"], "--psm 6")
+        assert key != OCRResultCache.make_key(b"image", ["google_vision", "tesseract"], "--psm 6")
+        assert key != OCRResultCache.make_key(b"image", ["tesseract"], "--psm 4")
+        assert key != OCRResultCache.make_key(b"other", ["tesseract"], "--psm 6")
+    
+    def test_memory_lru_eviction(self):
+        """Testa eviction LRU no nível de memória"""
+        cache = OCRResultCache(max_memory_items=2)
+        cache.set("a", self.create_result("a"))
+        cache.set("b", self.create_result("b"))
+        assert cache.get("a").text == "a"
+        cache.set("c", self.create_result("c"))
+        
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        stats = cache.get_stats()
+        assert stats["evictions"] == 1
+        assert stats["hits"] == 2
+        assert stats["misses"] == 1
+    
+    def test_persistent_tier(self, tmp_path):
+        """Testa se o nível persistente sobrevive a uma nova instância"""
+        OCRResultCache(cache_dir=str(tmp_path)).set("key", self.create_result())
+        
+        cache = OCRResultCache(cache_dir=str(tmp_path))
+        result = cache.get("key")
+        
+        assert result.text == "Cached text"
+        assert cache.get_stats()["disk_hits"] == 1
+    
+    def test_extract_text_uses_cache(self):
+        """Testa se uploads repetidos não executam o OCR novamente"""
+        cache = OCRResultCache(max_memory_items=10)
+        service = OCRService(result_cache=cache, near_duplicates=PerceptualHashIndex())
+        img = Image.new('RGB', (50, 50), color='white')
+        img_bytes = io.BytesIO()
+        img.save(img_bytes, format='PNG')
+        image_data = base64.b64encode(img_bytes.getvalue()).decode('utf-8')
+        
+        with patch.object(service, '_run_providers', return_value=self.create_result()) as mock_run:
+            first = service.extract_text(image_data, "free")
+            second = service.extract_text(image_data, "free")
+        
+        assert mock_run.call_count == 1
+        assert first.text == second.text == "Cached text"
+        assert cache.get_stats()["hits"] == 1
+
+class TestPerceptualHashIndex:
+    """Testes para a detecção de quase-duplicatas"""
+    
+    def create_worksheet(self, seed: int) -> Image.Image:
+        """Cria uma imagem sintética parecida com uma folha de exercícios"""
+        import random
+        from PIL import ImageDraw
+        
+        rng = random.Random(seed)
+        img = Image.new('RGB', (640, 480), color='white')
+        draw = ImageDraw.Draw(img)
+        for _ in range(40):
+            x, y = rng.randint(0, 600), rng.randint(0, 460)
+            draw.rectangle([x, y, x + rng.randint(10, 80), y + rng.randint(4, 16)], fill='black')
+        return img
+    
+    def reencode(self, image: Image.Image, size, quality: int = 60) -> Image.Image:
+        buffer = io.BytesIO()
+        image.resize(size).save(buffer, format='JPEG', quality=quality)
+        buffer.seek(0)
+        return Image.open(buffer).convert('RGB')
+    
+    def create_result(self, text: str):
+        from models import OCRResult, OCRProvider
+        return OCRResult(provider=OCRProvider.TESSERACT, text=text, confidence=0.9,
+                         processing_time=1.0, success=True)
+    
+    def test_phash_survives_resize_and_reencode(self):
+        """Testa estabilidade do hash após redimensionar e recomprimir"""
+        original = self.create_worksheet(1)
+        copy = self.reencode(original, (480, 360))
+        other = self.create_worksheet(2)
+        
+        assert hamming_distance(phash(original), phash(copy)) <= 4
+        assert hamming_distance(phash(original), phash(other)) > 40
+    
+    def create_exercise(self, numbers, size=(1200, 900)) -> Image.Image:
+        """Folha com o mesmo layout e números diferentes"""
+        from PIL import ImageDraw
+        from benchmarks.images import load_font
+        
+        img = Image.new('RGB', size, color='white')
+        draw = ImageDraw.Draw(img)
+        font = load_font(36)
+        question, a, b, c = numbers
+        draw.text((60, 80), f"Questao {question}: Calcule {a}x + {b} = {c}", fill='black', font=font)
+        draw.text((60, 160), "Mostre todos os passos da resolucao.", fill='black', font=font)
+        draw.text((60, 240), "Verifique a resposta substituindo o valor.", fill='black', font=font)
+        return img
+    
+    def test_find_within_threshold(self):
+        """Testa busca por distância de Hamming"""
+        index = PerceptualHashIndex(threshold=4, max_entries=10)
+        signature = content_signature(self.create_worksheet(1))
+        index.add("tesseract", 0b1011, signature, self.create_result("first"))
+        
+        distance, result = index.find("tesseract", 0b0011, signature)
+        assert distance == 1
+        assert result.text == "first"
+        assert index.find("tesseract", 0b1011 ^ 0b11111, signature) is None
+        assert index.find("google_vision,tesseract", 0b1011, signature) is None
+    
+    def test_hash_match_with_different_content_is_rejected(self):
+        """Testa que o hash só indica candidatos: o conteúdo precisa bater"""
+        index = PerceptualHashIndex(threshold=4, max_entries=10)
+        index.add("tesseract", 0b1011, content_signature(self.create_worksheet(1)), self.create_result("first"))
+        
+        assert index.find("tesseract", 0b1011, content_signature(self.create_worksheet(2))) is None
+        assert index.get_stats()["rejected"] == 1
+    
+    def test_signature_ignores_reencode_but_not_numbers(self):
+        """Testa a assinatura: cópias recomprimidas batem, números diferentes não"""
+        original = self.create_exercise((1, 2, 3, 11))
+        copy = self.reencode(original, (900, 675), quality=35)
+        
+        assert signature_distance(content_signature(original), content_signature(copy)) == 0
+        for numbers in [(1, 2, 3, 17), (1, 3, 3, 11), (2, 2, 3, 11), (2, 3, 5, 16)]:
+            other = content_signature(self.create_exercise(numbers))
+            assert signature_distance(content_signature(original), other) > 0
+    
+    def test_eviction_cleans_buckets(self):
+        """Testa se entradas removidas deixam de ser encontradas"""
+        index = PerceptualHashIndex(threshold=1, max_entries=1)
+        signature = content_signature(self.create_worksheet(1))
+        index.add("tesseract", 1, signature, self.create_result("old"))
+        index.add("tesseract", 1 << 200, signature, self.create_result("new"))
+        
+        assert index.find("tesseract", 1, signature) is None
+        assert index.find("tesseract", 1 << 200, signature)[1].text == "new"
+        assert index.get_stats()["items"] == 1
+    
+    def test_extract_text_reuses_near_duplicate(self):
+        """Testa reaproveitamento do OCR para uma cópia recomprimida"""
+        service = OCRService(result_cache=OCRResultCache(max_memory_items=10),
+                             near_duplicates=PerceptualHashIndex())
+        original = self.create_worksheet(3)
+        copy = self.reencode(original, (500, 375))
+        
+        def to_base64(image, fmt):
+            buffer = io.BytesIO()
+            image.save(buffer, format=fmt)
+            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        
+        with patch.object(service, '_run_providers', return_value=self.create_result("Questão 1")) as mock_run:
+            service.extract_text(to_base64(original, 'PNG'), "free")
+            result = service.extract_text(to_base64(copy, 'JPEG'), "free")
+        
+        assert mock_run.call_count == 1
+        assert result.text == "Questão 1"
+    
+    def test_extract_text_same_layout_different_numbers_is_not_reused(self):
+        """Testa que exercícios com o mesmo layout e números diferentes não compartilham OCR"""
+        service = OCRService(result_cache=OCRResultCache(max_memory_items=10),
+                             near_duplicates=PerceptualHashIndex(threshold=15))
+        pages = [(1, 2, 3, 11), (2, 3, 5, 16), (1, 2, 3, 17), (1, 2, 8, 11), (7, 2, 3, 11)]
+        
+        def to_base64(image):
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+        
+        results = [self.create_result(f"Questão {numbers}") for numbers in pages]
+        with patch.object(service, '_run_providers', side_effect=results) as mock_run:
+            texts = [service.extract_text(to_base64(self.create_exercise(numbers)), "free").text for numbers in pages]
+        
+        assert mock_run.call_count == len(pages)
+        assert texts == [result.text for result in results]
+        stats = service.near_duplicates.get_stats()
+        assert stats["hits"] == 0
+        assert stats["rejected"] > 0  # The hashes did collide, the content check refused them
+
+class TestHedgedOCR:
+    """Testes para a execução concorrente (hedged) dos provedores de OCR"""
+    
+    def fake_provider(self, provider: str, delay: float, confidence: float):
+        from models import OCRResult, OCRProvider
+        
+        def run(image):
+            time.sleep(delay)
+            return OCRResult(provider=OCRProvider(provider), text=f"{provider} text",
+                             confidence=confidence, processing_time=delay, success=True)
+        return run
+    
+    def test_hedge_beats_slow_primary(self):
+        """Testa se o segundo provedor vence quando o primeiro demora"""
+        service = OCRService()
+        service._extract_with_google_vision = self.fake_provider("google_vision", 1.0, 0.95)
+        service._extract_with_azure_cv = self.fake_provider("azure_cv", 0.05, 0.93)
+        
+        with patch.object(settings, 'ocr_hedge_min_samples', 10**6), \
+             patch.object(settings, 'ocr_hedge_delay', 0.05):
+            start = time.time()
+            result = service._run_providers_hedged(self.create_image(), ['google_vision', 'azure_cv', 'tesseract'])
+            elapsed = time.time() - start
+        
+        assert result.provider.value == "azure_cv"
+        assert elapsed < 0.5
+    
+    def test_fast_primary_skips_hedge(self):
+        """Testa que nenhum hedge é iniciado quando o primário responde rápido"""
+        service = OCRService()
+        service._extract_with_google_vision = self.fake_provider("google_vision", 0.01, 0.95)
+        service._extract_with_azure_cv = Mock()
+        
+        with patch.object(settings, 'ocr_hedge_min_samples', 10**6), \
+             patch.object(settings, 'ocr_hedge_delay', 0.5):
+            result = service._run_providers_hedged(self.create_image(), ['google_vision', 'azure_cv'])
+        
+        assert result.provider.value == "google_vision"
+        service._extract_with_azure_cv.assert_not_called()
+    
+    def test_low_confidence_starts_next_provider(self):
+        """Testa fallback imediato quando o resultado tem baixa confiança"""
+        service = OCRService()
+        service._extract_with_google_vision = self.fake_provider("google_vision", 0.01, 0.5)
+        service._extract_with_azure_cv = self.fake_provider("azure_cv", 0.01, 0.6)
+        
+        with patch.object(settings, 'ocr_hedge_min_samples', 10**6), \
+             patch.object(settings, 'ocr_hedge_delay', 5.0):
+            start = time.time()
+            result = service._run_providers_hedged(self.create_image(), ['google_vision', 'azure_cv'])
+        
+        assert time.time() - start < 1.0
+        assert result.provider.value == "azure_cv"
+    
+    def test_hedge_delay_from_histogram(self):
+        """Testa se o atraso do hedge usa o p95 observado"""
+        from services.metrics import metrics
+        service = OCRService()
+        histogram = metrics.histogram("ocr_provider_seconds", provider="hedge_test")
+        for _ in range(100):
+            histogram.observe(0.4)
+        
+        with patch.object(settings, 'ocr_hedge_min_samples', 20):
+            delay = service._hedge_delay("hedge_test")
+        
+        assert 0.25 <= delay <= 0.5
+    
+    def create_image(self) -> Image.Image:
+        return Image.new('RGB', (10, 10), color='white')
+
+class TestLatencyHistogram:
+    """Testes para o histograma de latência"""
+    
+    def test_quantiles(self):
+        """Testa estimativa de quantis"""
+        histogram = LatencyHistogram()
+        for value in [0.01] * 90 + [2.0] * 10:
+            histogram.observe(value)
+        
+        assert histogram.count == 100
+        assert histogram.quantile(0.5) <= 0.01
+        assert 1.5 <= histogram.quantile(0.95) <= 2.0
+        assert LatencyHistogram().quantile(0.95) is None
+    
+    def test_prometheus_exposition(self):
+        """Testa o formato de texto do Prometheus"""
+        registry = MetricsRegistry()
+        registry.describe("stage_seconds", "Stage latency")
+        registry.histogram("stage_seconds", stage="decode").observe(0.02)
+        registry.counter("requests_total", route='/a"b').inc(3)
+        
+        text = registry.render_prometheus()
+        
+        assert "# HELP stage_seconds Stage latency\n# TYPE stage_seconds histogram" in text
+        assert 'stage_seconds_bucket{stage="decode",le="0.01"} 0' in text
+        assert 'stage_seconds_bucket{stage="decode",le="0.025"} 1' in text
+        assert 'stage_seconds_bucket{stage="decode",le="+Inf"} 1' in text
+        assert 'stage_seconds_count{stage="decode"} 1' in text
+        assert '# TYPE requests_total counter\nrequests_total{route="/a\\"b"} 3' in text
+    
+    def test_timer_records_failures(self):
+        """Testa que o timer registra mesmo quando o bloco falha"""
+        registry = MetricsRegistry()
+        with pytest.raises(ValueError):
+            with registry.time("stage_seconds", stage="llm"):
+                raise ValueError("boom")
+        assert registry.histogram("stage_seconds", stage="llm").count == 1
+    
+    def test_daily_activity(self):
+        """Testa usuários ativos e planos do dia"""
+        activity = DailyActivity()
+        activity.record("u1", "free")
+        activity.record("u1", "free")
+        activity.record("u2", "pro")
+        assert activity.snapshot() == (2, 3, {"free": 2, "pro": 1})
+
+class TestSingleFlight:
+    """Testes para a coalescência de requisições idênticas"""
+    
+    def test_concurrent_calls_share_one_run(self):
+        """Testa que chamadas simultâneas com a mesma chave executam uma vez"""
+        flight = SingleFlight()
+        calls = []
+        
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "resultado"
+        
+        async def run():
+            results = await asyncio.gather(*[flight.do("k", compute) for _ in range(5)])
+            other = await flight.do("k", compute)
+            return results, other
+        
+        results, other = asyncio.run(run())
+        
+        assert [result for result, _ in results] == ["resultado"] * 5
+        assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+        assert other == ("resultado", False)  # Finished runs are not reused
+        assert len(calls) == 2
+        assert flight.get_stats()['coalesced'] == 4
+        assert flight.get_stats()['in_flight'] == 0
+    
+    def test_errors_reach_every_caller(self):
+        """Testa propagação de exceção para todos os chamadores"""
+        flight = SingleFlight()
+        
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("falhou")
+        
+        async def run():
+            return await asyncio.gather(*[flight.do("k", compute) for _ in range(3)], return_exceptions=True)
+        
+        assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+    
+    def test_cancelled_caller_does_not_cancel_others(self):
+        """Testa que a desconexão de um cliente não cancela o trabalho compartilhado"""
+        flight = SingleFlight()
+        
+        async def compute():
+            await asyncio.sleep(0.05)
+            return 42
+        
+        async def run():
+            leader = asyncio.ensure_future(flight.do("k", compute))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.do("k", compute))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+        
+        assert asyncio.run(run()) == (42, True)
+    
+    def test_content_key(self):
+        """Testa chave por conteúdo, distinguindo campos ausentes"""
+        assert content_key(b"img") == content_key("img")
+        assert content_key("a", None) != content_key("a", "")
+        assert content_key("ab", "c") != content_key("a", "bc")
+
+class TestHistoryStore:
+    """Testes para o índice de histórico por usuário"""
+    
+    @pytest.fixture(params=["memory", "sqlite"])
+    def store(self, request, tmp_path):
+        if request.param == "sqlite":
+            return SQLHistoryStore(str(tmp_path / "history.db"))
+        return MemoryHistoryStore()
+    
+    def fill(self, store):
+        from datetime import datetime, timedelta
+        base = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+        for index in range(5):
+            store.add("user-a", f"req-{index}", base + timedelta(minutes=index))
+        store.add("user-a", "req-tie", base + timedelta(minutes=4))
+        store.add("user-b", "other", base)
+        return base
+    
+    def test_latest_newest_first(self, store):
+        """Testa ordem decrescente e isolamento por usuário"""
+        self.fill(store)
+        
+        assert [rid for _, rid in store.latest("user-a", 3)] == ["req-tie", "req-4", "req-3"]
+        assert store.count("user-a") == 6
+        assert store.count("user-b") == 1
+        assert store.latest("nobody", 3) == []
+    
+    def test_cursor_pagination(self, store):
+        """Testa paginação por cursor sem repetir nem pular itens"""
+        self.fill(store)
+        
+        seen = []
+        cursor = None
+        while True:
+            page = store.latest("user-a", 2, cursor)
+            seen.extend(rid for _, rid in page)
+            if len(page) < 2:
+                break
+            cursor = page[-1]
+        
+        assert seen == ["req-tie", "req-4", "req-3", "req-2", "req-1", "req-0"]
+    
+    def test_add_is_idempotent_and_remove(self, store):
+        """Testa reindexação do mesmo pedido e remoção"""
+        base = self.fill(store)
+        store.add("user-a", "req-0", base)
+        assert store.count("user-a") == 6
+        
+        store.remove("user-a", "req-0", base)
+        assert [rid for _, rid in store.latest("user-a", 10)][-1] == "req-1"
+    
+    def test_entries_expire_with_results(self, tmp_path):
+        """Testa que entradas mais velhas que o TTL dos resultados somem do índice"""
+        from datetime import datetime, timedelta
+        now = datetime.now()
+        for store in (MemoryHistoryStore(ttl=3600), SQLHistoryStore(str(tmp_path / "history.db"), ttl=3600)):
+            store.add("user-a", "old", now - timedelta(hours=2))
+            store.add("user-a", "new", now - timedelta(minutes=5))
+            
+            assert [rid for _, rid in store.latest("user-a", 10)] == ["new"]
+            assert store.count("user-a") == 1
+    
+    def test_memory_sweep_drops_idle_users(self):
+        """Testa limpeza periódica de usuários que não voltaram"""
+        from datetime import datetime, timedelta
+        store = MemoryHistoryStore(ttl=3600)
+        store.add("idle", "old", datetime.now() - timedelta(hours=2))
+        for index in range(999):
+            store.add("active", f"req-{index}", datetime.now())
+        
+        assert "idle" not in store._index
+    
+    def test_shared_state_backend_shares_history(self, tmp_path):
+        """Testa que, com estado compartilhado, todos os workers veem o mesmo histórico"""
+        from datetime import datetime
+        state = SQLiteStateBackend(str(tmp_path / "state.db"))
+        worker_a = create_history_store("memory", state=state)
+        worker_b = create_history_store("memory", state=state)
+        
+        worker_a.add("user-a", "req-1", datetime.now())
+        
+        assert isinstance(worker_b, SQLHistoryStore)
+        assert [rid for _, rid in worker_b.latest("user-a", 10)] == ["req-1"]
+        assert isinstance(create_history_store("memory", state=MemoryStateBackend()), MemoryHistoryStore)
+        
+        redis_state = Mock(shared=True, prefix="ocr:")
+        redis_state.name = "redis"
+        assert isinstance(create_history_store("memory", state=redis_state), RedisHistoryStore)
+    
+    def test_redis_cursor_skips_ties_after_cursor(self):
+        """Testa que o cursor no Redis respeita o desempate por request_id"""
+        from datetime import datetime
+        state = Mock(prefix="ocr:")
+        store = RedisHistoryStore(state, ttl=3600)
+        created_at = datetime.now().replace(microsecond=0)
+        score = created_at.timestamp()
+        state.client.zrevrangebyscore.side_effect = [
+            [(b"req-c", score), (b"req-b", score), (b"req-a", score)],
+            [(b"req-old", score - 60)]
+        ]
+        
+        page = store.latest("user-a", 2, (created_at, "req-b"))
+        
+        assert [rid for _, rid in page] == ["req-a", "req-old"]
+        older_call = state.client.zrevrangebyscore.call_args_list[1]
+        assert older_call.args[:2] == ("ocr:history:user-a", f"({score}")
+        assert older_call.kwargs["num"] == 2
+    
+    def test_parse_cursor(self):
+        """Testa leitura e validação do cursor"""
+        created_at, request_id = parse_history_cursor("2024-03-01T10:00:00.123456,abc-1")
+        assert created_at.microsecond == 123456
+        assert request_id == "abc-1"
+        with pytest.raises(ValueError):
+            parse_history_cursor("2024-03-01T10:00:00")
+        with pytest.raises(ValueError):
+            parse_history_cursor("ontem,abc")
+
+class TestResultStore:
+    """Testes para os armazenamentos limitados de resultados e sessões"""
+    
+    def create_result(self, request_id: str):
+        from datetime import datetime
+        from models import ProcessingResult, RequestStatus
+        return ProcessingResult(
+            request_id=request_id,
+            status=RequestStatus.COMPLETED,
+            extracted_text="x" * 1000,
+            ai_explanation="Explicação longa",
+            processing_time_total=1.0,
+            created_at=datetime.now(),
+            user_id="user-1"
+        )
+    
+    def test_bounded_ttl_dict(self):
+        """Testa limite de tamanho e expiração"""
+        sessions = BoundedTTLDict(max_items=2, ttl=60)
+        sessions["a"] = 1
+        sessions["b"] = 2
+        assert sessions["a"] == 1  # "a" passa a ser o mais recente
+        sessions["c"] = 3
+        
+        assert "b" not in sessions
+        assert "a" in sessions and "c" in sessions
+        with patch('services.result_store.time.time', return_value=time.time() + 120):
+            assert sessions.get("a") is None
+        with pytest.raises(KeyError):
+            sessions["b"]
+    
+    def test_memory_only_eviction(self):
+        """Testa descarte dos resultados mais antigos sem spill"""
+        store = ResultStore(max_items=3, ttl=60)
+        for index in range(5):
+            store[f"r{index}"] = self.create_result(f"r{index}")
+        
+        assert "r0" not in store and store.get("r1") is None
+        assert store["r4"].ai_explanation == "Explicação longa"
+        assert store.get_stats()['items'] == 3
+        assert store.get_stats()['hot_items'] <= 3
+    
+    def test_eviction_callback(self):
+        """Testa aviso de resultados descartados pelo limite de tamanho"""
+        evicted = []
+        store = ResultStore(max_items=2, ttl=60, on_evict=lambda rid, summary: evicted.append((rid, summary.user_id)))
+        for index in range(4):
+            store[f"r{index}"] = self.create_result(f"r{index}")
+        
+        assert evicted == [("r0", "user-1"), ("r1", "user-1")]
+    
+    def test_spill_and_load(self, tmp_path):
+        """Testa spill para SQLite e carga do resultado completo sob demanda"""
+        store = ResultStore(max_items=10, ttl=60, spill_dir=str(tmp_path), hot_items=2)
+        for index in range(4):
+            store[f"r{index}"] = self.create_result(f"r{index}")
+        
+        stats = store.get_stats()
+        assert stats['hot_items'] == 2
+        assert stats['spilled'] == 2
+        
+        summary = store.get_summary("r0")
+        assert summary.text_preview == "x" * 200
+        assert not hasattr(summary, "ai_explanation")
+        
+        loaded = store["r0"]
+        assert loaded.extracted_text == "x" * 1000
+        assert store.get_stats()['disk_reads'] == 1
+    
+    def test_expired_results_are_gone(self, tmp_path):
+        """Testa expiração por idade"""
+        store = ResultStore(max_items=10, ttl=60, spill_dir=str(tmp_path), hot_items=1)
+        store["r0"] = self.create_result("r0")
+        store["r1"] = self.create_result("r1")
+        
+        with patch('services.result_store.time.time', return_value=time.time() + 120):
+            assert store.get("r0") is None
+            assert store.get_summary("r1") is None
+
+class TestStateBackend:
+    """Testes para o estado compartilhado entre workers"""
+    
+    def test_memory_counter(self):
+        """Testa contador em memória com expiração"""
+        backend = MemoryStateBackend(max_items=10, ttl=60)
+        assert backend.incr("usage:u1") == 1
+        assert backend.incr("usage:u1", 2) == 3
+        assert backend.get_int("usage:u1") == 3
+        assert not backend.shared
+        
+        with patch('services.result_store.time.time', return_value=time.time() + 120):
+            assert backend.get_int("usage:u1") == 0
+    
+    def test_sqlite_counter_shared_between_workers(self, tmp_path):
+        """Testa que dois backends no mesmo arquivo somam no mesmo contador"""
+        import threading
+        db_path = str(tmp_path / "state.db")
+        workers = [SQLiteStateBackend(db_path) for _ in range(4)]
+        
+        def count(backend):
+            for _ in range(25):
+                backend.incr("usage:u1", ttl=60)
+        
+        threads = [threading.Thread(target=count, args=(backend,)) for backend in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert SQLiteStateBackend(db_path).get_int("usage:u1") == 100
+    
+    def test_sqlite_expiry(self, tmp_path):
+        """Testa expiração de chaves no SQLite"""
+        backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+        backend.set("k", b"v", ttl=60)
+        assert backend.get("k") == b"v"
+        
+        with patch('services.state_backend.time.time', return_value=time.time() + 120):
+            assert backend.get("k") is None
+            assert backend.incr("k", ttl=60) == 1
+    
+    def test_model_store(self, tmp_path):
+        """Testa sessões visíveis em outro worker"""
+        from datetime import datetime
+        from models import UserProfile
+        db_path = str(tmp_path / "state.db")
+        sessions = ModelStore(SQLiteStateBackend(db_path), "session", UserProfile, 60)
+        sessions["token"] = UserProfile(id="u1", email="a@b.com", created_at=datetime.now())
+        
+        other = ModelStore(SQLiteStateBackend(db_path), "session", UserProfile, 60)
+        assert "token" in other
+        assert other["token"].id == "u1"
+        del other["token"]
+        assert sessions.get("token") is None
+    
+    def test_shared_result_store(self, tmp_path):
+        """Testa resultados gravados por um worker e lidos por outro"""
+        db_path = str(tmp_path / "state.db")
+        store = create_result_store(SQLiteStateBackend(db_path))
+        assert isinstance(store, SharedResultStore)
+        store["r0"] = TestResultStore().create_result("r0")
+        
+        other = create_result_store(SQLiteStateBackend(db_path))
+        assert "r0" in other
+        assert other["r0"].extracted_text == "x" * 1000
+        assert other.get_summary("r0").text_preview == "x" * 200
+        assert other.get("r1") is None
+        assert isinstance(create_result_store(MemoryStateBackend()), ResultStore)
+    
+    def test_redis_without_client_falls_back(self):
+        """Testa fallback para memória sem o pacote redis"""
+        with patch('services.state_backend.REDIS_AVAILABLE', False):
+            assert create_state_backend("redis").name == "memory"
+    
+    def test_backend_must_implement_interface(self):
+        """Testa que um backend incompleto não pode ser instanciado"""
+        class GetOnlyBackend(StateBackend):
+            def get(self, key):
+                return None
+        
+        with pytest.raises(TypeError):
+            StateBackend()
+        with pytest.raises(TypeError):
+            GetOnlyBackend()
+
+class TestGCRARateLimiter:
+    """Testes para o limitador por minuto (GCRA)"""
+    
+    def test_gcra_spacing(self):
+        """Testa rajada inicial e espaçamento exato entre requisições"""
+        tat, decision = gcra(None, 100.0, 30.0, 2)
+        assert decision.allowed and decision.remaining == 1
+        tat, decision = gcra(tat, 100.0, 30.0, 2)
+        assert decision.allowed and decision.remaining == 0
+        
+        rejected_tat, decision = gcra(tat, 110.0, 30.0, 2)
+        assert rejected_tat is None and not decision.allowed
+        assert decision.retry_after == pytest.approx(20.0)
+        assert decision.headers()["Retry-After"] == "20"
+        
+        _, decision = gcra(tat, 130.0, 30.0, 2)
+        assert decision.allowed
+    
+    def test_limiter_per_key_and_unlimited(self, tmp_path):
+        """Testa chaves independentes e limite desativado com valor <= 0"""
+        limiter = GCRARateLimiter(SQLiteStateBackend(str(tmp_path / "state.db")))
+        assert limiter.check("u1", 1).allowed
+        assert not limiter.check("u1", 1).allowed
+        assert limiter.check("u2", 1).allowed
+        assert limiter.check("u1", -1).allowed
+        assert limiter.get_stats() == {'allowed': 2, 'rejected': 1}
+
+class TestQuotaService:
+    """Testes para as cotas mensais com reserva atômica"""
+    
+    def test_concurrent_reservations_never_overshoot(self, tmp_path):
+        """Testa que workers concorrentes não ultrapassam o limite do plano"""
+        import threading
+        db_path = str(tmp_path / "state.db")
+        granted = []
+        
+        def worker():
+            quota = QuotaService(SQLiteStateBackend(db_path))
+            for _ in range(10):
+                if quota.reserve("u1", 10):
+                    granted.append(1)
+        
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(granted) == 10
+        assert QuotaService(SQLiteStateBackend(db_path)).usage("u1") == 10
+    
+    def test_release_refunds_once(self):
+        """Testa reembolso em falha e que commit/release são idempotentes"""
+        quota = QuotaService(MemoryStateBackend())
+        first = quota.reserve("u1", 1)
+        assert first.used == 1
+        assert quota.reserve("u1", 1) is None
+        
+        quota.release(first)
+        quota.release(first)
+        assert quota.usage("u1") == 0
+        
+        second = quota.reserve("u1", 1)
+        quota.commit(second)
+        quota.release(second)
+        assert quota.usage("u1") == 1
+        assert quota.get_stats()['in_flight'] == 0
+    
+    def test_unlimited_plan_still_counts(self):
+        """Testa plano ilimitado (-1)"""
+        quota = QuotaService(MemoryStateBackend())
+        for _ in range(5):
+            assert quota.reserve("u1", -1) is not None
+        assert quota.usage("u1") == 5
+    
+    def test_memory_counters_survive_session_churn(self):
+        """Testa que a carga de sessões não despeja contadores de cota da memória"""
+        sessions = MemoryStateBackend(max_items=10)
+        quota = QuotaService(create_quota_backend(sessions))
+        quota.reserve("u1", 10)
+        
+        for i in range(100):
+            sessions.set(f"session:{i}", b"x", 60)
+        
+        assert quota.backend is not sessions
+        assert quota.usage("u1") == 1
+    
+    def test_shared_backend_keeps_counters(self, tmp_path):
+        """Testa que backends compartilhados guardam os contadores junto do estado"""
+        backend = SQLiteStateBackend(str(tmp_path / "state.db"))
+        assert create_quota_backend(backend) is backend
+    
+    def test_counter_ttl_runs_to_end_of_month(self):
+        """Testa TTL do contador até o fim do período de cobrança"""
+        from datetime import datetime
+        assert counter_ttl(datetime(2024, 2, 29, 23, 0)) == 3600 + QUOTA_COUNTER_GRACE
+        assert counter_ttl(datetime(2024, 12, 1)) == 31 * 24 * 3600 + QUOTA_COUNTER_GRACE
+
+class TestTokenVerifier:
+    """Testes para a verificação de JWT com caches"""
+    
+    def make_claims(self, sub: str = "user-1", ttl: float = 600):
+        return {"sub": sub, "email": "a@b.com", "exp": time.time() + ttl,
+                "iat": time.time(), "app_metadata": {"plan": "pro"}}
+    
+    def test_claims_cached_until_expiry(self):
+        """Testa que a assinatura só é verificada uma vez por token"""
+        verifier = TokenVerifier(jwks=JWKSCache(url="https://jwks.test"))
+        with patch.object(verifier, '_decode', AsyncMock(return_value=self.make_claims())) as mock_decode:
+            asyncio.run(verifier.verify("token-a"))
+            claims = asyncio.run(verifier.verify("token-a"))
+            assert mock_decode.call_count == 1
+            assert claims["sub"] == "user-1"
+            
+            with patch('services.result_store.time.time', return_value=time.time() + 700):
+                asyncio.run(verifier.verify("token-a"))
+            assert mock_decode.call_count == 2
+        
+        assert verifier.get_stats()['claims_hit_rate'] == pytest.approx(1 / 3)
+    
+    def test_token_without_exp_is_not_cached(self):
+        """Testa que tokens sem exp não entram no cache"""
+        verifier = TokenVerifier(jwks=JWKSCache(url="https://jwks.test"))
+        claims = {"sub": "user-1"}
+        with patch.object(verifier, '_decode', AsyncMock(return_value=claims)) as mock_decode:
+            asyncio.run(verifier.verify("token-a"))
+            asyncio.run(verifier.verify("token-a"))
+        assert mock_decode.call_count == 2
+    
+    def test_profile_cache_and_invalidation(self):
+        """Testa cache de perfil e invalidação"""
+        from services.auth import profile_from_claims
+        loader = AsyncMock(side_effect=profile_from_claims)
+        verifier = TokenVerifier(jwks=JWKSCache(url="https://jwks.test"), profile_loader=loader)
+        
+        with patch.object(verifier, '_decode', AsyncMock(return_value=self.make_claims())):
+            profile = asyncio.run(verifier.get_user("token-a"))
+            profile.usage_count = 99  # Cópia: não altera o cache
+            again = asyncio.run(verifier.get_user("token-a"))
+            assert loader.call_count == 1
+            assert again.plan == "pro" and again.usage_count == 0
+            
+            verifier.invalidate_user("user-1")
+            asyncio.run(verifier.get_user("token-a"))
+            assert loader.call_count == 2
+            
+            verifier.invalidate_token("token-a")
+            asyncio.run(verifier.verify("token-a"))
+        assert verifier.get_stats()['verifications'] == 2
+    
+    def test_jwks_fetched_once_and_refresh_throttled(self):
+        """Testa cache das chaves JWKS e limite de refresh para kid desconhecido"""
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"keys": [{"kid": "k1", "kty": "RSA", "alg": "RS256"}]})
+        
+        jwks = JWKSCache(url="https://jwks.test/keys", transport=httpx.MockTransport(handler))
+        jwk_module = Mock()
+        jwk_module.construct.side_effect = lambda data, alg: f"key-{data['kid']}"
+        
+        async def scenario():
+            first = await jwks.get_key("k1")
+            second = await jwks.get_key("k1")
+            with pytest.raises(AuthError):
+                await jwks.get_key("rotated")
+            return first, second
+        
+        with patch('services.auth.jwk', jwk_module, create=True), \
+             patch('services.auth.JOSEError', ValueError, create=True):
+            first, second = asyncio.run(scenario())
+        
+        assert first == second == "key-k1"
+        assert len(requests) == 1
+    
+    def test_decode_without_jose(self):
+        """Testa erro claro quando python-jose não está instalado"""
+        verifier = TokenVerifier(jwks=JWKSCache(url="https://jwks.test"))
+        with patch('services.auth.JOSE_AVAILABLE', False):
+            with pytest.raises(AuthError):
+                asyncio.run(verifier.verify("token-a"))
+        assert verifier.get_stats()['failures'] == 1
+
+class TestBillingWebhooks:
+    """Testes para a assinatura e os eventos de assinatura do Stripe"""
+    
+    def sign(self, body: bytes, timestamp: int, secret: str = "whsec_test") -> str:
+        import hashlib
+        import hmac
+        digest = hmac.new(secret.encode(), str(timestamp).encode() + b"." + body, hashlib.sha256).hexdigest()
+        return f"t={timestamp},v1={digest}"
+    
+    def test_signature(self):
+        """Testa assinatura válida, adulterada, antiga e ausente"""
+        body = b'{"type":"customer.subscription.updated"}'
+        now = int(time.time())
+        verify_stripe_signature(body, self.sign(body, now), secret="whsec_test")
+        
+        for header in [self.sign(body + b" ", now), self.sign(body, now - 600), "t=abc", None]:
+            with pytest.raises(WebhookSignatureError):
+                verify_stripe_signature(body, header, secret="whsec_test")
+    
+    def test_plan_change_from_event(self):
+        """Testa upgrade ativo, cancelamento e eventos ignorados"""
+        subscription = {"status": "active", "current_period_end": time.time() + 3600,
+                        "metadata": {"user_id": "u1", "plan": "max"}}
+        
+        change = plan_change_from_event({"type": "customer.subscription.created", "data": {"object": subscription}})
+        assert (change.user_id, change.plan) == ("u1", "max")
+        assert change.ttl > 3600
+        
+        cancelled = plan_change_from_event({"type": "customer.subscription.deleted", "data": {"object": subscription}})
+        assert (cancelled.plan, cancelled.ttl) == ("free", None)
+        
+        unpaid = dict(subscription, status="unpaid")
+        assert plan_change_from_event({"type": "customer.subscription.updated", "data": {"object": unpaid}}).plan == "free"
+        assert plan_change_from_event({"type": "invoice.paid", "data": {"object": subscription}}) is None
+
+class TestOCRExecutor:
+    """Testes para o pool de workers de OCR"""
+    
+    def test_runs_job_off_event_loop(self):
+        """Testa execução de job em thread separada"""
+        import asyncio
+        import threading
+        
+        executor = OCRExecutor(max_workers=1, max_queue_size=4, mode="thread")
+        try:
+            thread_name = asyncio.run(executor.run(lambda: threading.current_thread().name))
+            assert thread_name.startswith("ocr-worker")
+        finally:
+            executor.shutdown()
+    
+    def test_plan_priority_order(self):
+        """Testa se jobs do plano max passam na frente do free"""
+        import asyncio
+        import threading
+        
+        executor = OCRExecutor(max_workers=1, max_queue_size=8, mode="thread")
+        gate = threading.Event()
+        order = []
+        
+        async def scenario():
+            blocker = asyncio.ensure_future(executor.run(gate.wait))
+            await asyncio.sleep(0.05)
+            jobs = [
+                asyncio.ensure_future(executor.run(order.append, "free", plan="free")),
+                asyncio.ensure_future(executor.run(order.append, "pro", plan="pro")),
+                asyncio.ensure_future(executor.run(order.append, "max", plan="max")),
+            ]
+            await asyncio.sleep(0.05)
+            gate.set()
+            await asyncio.gather(blocker, *jobs)
+        
+        try:
+            asyncio.run(scenario())
+            assert order == ["max", "pro", "free"]
+        finally:
+            executor.shutdown()
+    
+    def test_queue_full_raises(self):
+        """Testa backpressure quando a fila está cheia"""
+        import asyncio
+        import threading
+        
+        executor = OCRExecutor(max_workers=1, max_queue_size=1, mode="thread")
+        gate = threading.Event()
+        
+        async def scenario():
+            blocker = asyncio.ensure_future(executor.run(gate.wait))
+            await asyncio.sleep(0.05)
+            waiting = asyncio.ensure_future(executor.run(lambda: "ok"))
+            await asyncio.sleep(0)
+            with pytest.raises(OCRQueueFullError) as exc_info:
+                await executor.run(lambda: "rejected")
+            gate.set()
+            await asyncio.gather(blocker, waiting)
+            return exc_info.value
+        
+        try:
+            error = asyncio.run(scenario())
+            assert error.retry_after >= 1
+            assert executor.get_stats()["rejected"] == 1
+        finally:
+            executor.shutdown()
+    
+    def test_cancelled_job_does_not_skew_job_time(self):
+        """Testa que jobs cancelados na fila não contam como concluídos nem na média de tempo"""
+        import asyncio
+        import threading
+        
+        executor = OCRExecutor(max_workers=1, max_queue_size=4, mode="thread")
+        gate = threading.Event()
+        
+        async def scenario():
+            blocker = asyncio.ensure_future(executor.run(gate.wait))
+            await asyncio.sleep(0.05)
+            abandoned = asyncio.ensure_future(executor.run(lambda: "never"))
+            await asyncio.sleep(0)
+            abandoned.cancel()
+            await asyncio.sleep(0)
+            gate.set()
+            await blocker
+            await asyncio.sleep(0.1)
+        
+        try:
+            executor._avg_job_time = 4.0
+            asyncio.run(scenario())
+            stats = executor.get_stats()
+            assert stats["completed"] == 1
+            assert stats["cancelled"] == 1
+            assert stats["avg_job_time"] > 3.0
+        finally:
+            executor.shutdown()
+
+class TestJobRunnerBackpressure:
+    """Testes para o limite de jobs assíncronos aguardando vaga"""
+    
+    def test_admit_refuses_when_waiting_is_full(self):
+        """Testa recusa com Retry-After quando a fila de espera está cheia"""
+        runner = JobRunner(max_concurrent_jobs=1, max_waiting_jobs=2)
+        runner.admit()
+        runner.admit()
+        
+        with pytest.raises(JobQueueFullError) as exc_info:
+            runner.admit()
+        
+        assert exc_info.value.retry_after >= 1
+        stats = runner.get_stats()
+        assert stats["waiting"] == 2
+        assert stats["rejected"] == 1
+    
+    def test_admitted_slot_is_released_when_job_starts(self):
+        """Testa liberação da vaga de espera quando o job começa"""
+        runner = JobRunner(max_concurrent_jobs=1, max_waiting_jobs=1)
+        
+        async def job():
+            return None
+        
+        async def scenario():
+            runner.admit()
+            await runner.run("job-1", job, admitted=True)
+            runner.admit()
+        
+        asyncio.run(scenario())
+        assert runner.get_stats()["waiting"] == 1
+        assert runner.get_stats()["completed"] == 1
+    
+    def test_crashed_job_reports_failure(self):
+        """Testa que um job que quebra vira o resultado de on_error, entregue na callback"""
+        from models import ProcessingResponse, RequestStatus
+        runner = JobRunner(max_concurrent_jobs=1, max_waiting_jobs=1)
+        failed = ProcessingResponse(request_id="job-1", status=RequestStatus.FAILED, success=False, message="erro")
+        errors = []
+        
+        async def job():
+            raise RuntimeError("boom")
+        
+        async def on_error(error):
+            errors.append(error)
+            return failed
+        
+        with patch.object(runner, 'deliver_callback', new_callable=AsyncMock) as mock_callback:
+            result = asyncio.run(runner.run("job-1", job, "https://hooks.example.com/ocr", on_error=on_error))
+        
+        assert result is failed
+        assert str(errors[0]) == "boom"
+        mock_callback.assert_awaited_once_with("job-1", "https://hooks.example.com/ocr", failed)
+        assert runner.get_stats()["waiting"] == 0
+    
+    def test_cancel_admission_gives_slot_back(self):
+        """Testa devolução da vaga quando o job não chega a ser agendado"""
+        runner = JobRunner(max_concurrent_jobs=1, max_waiting_jobs=1)
+        runner.admit()
+        runner.cancel_admission()
+        
+        runner.admit()
+        assert runner.get_stats()["waiting"] == 1
+
+class TestJobRunnerCallbacks:
+    """Testes para a entrega segura de callbacks dos jobs assíncronos"""
+    
+    def payload(self):
+        from models import ProcessingResponse, RequestStatus
+        return ProcessingResponse(request_id="job-1", status=RequestStatus.COMPLETED, success=True, message="ok")
+    
+    def deliver(self, handler, addresses=("93.184.216.34",), url="https://hooks.example.com/ocr"):
+        """Entrega via MockTransport e retorna (resultado, requisições recebidas)"""
+        requests = []
+        
+        def record(request):
+            requests.append(request)
+            return handler(request)
+        
+        real_client = httpx.AsyncClient
+        
+        def client_factory(**kwargs):
+            return real_client(transport=httpx.MockTransport(record), **kwargs)
+        
+        runner = JobRunner()
+        with patch('services.job_runner._lookup', AsyncMock(return_value=list(addresses))), \
+             patch('services.job_runner.httpx.AsyncClient', side_effect=client_factory), \
+             patch('services.job_runner.asyncio.sleep', AsyncMock()):
+            delivered = asyncio.run(runner.deliver_callback("job-1", url, self.payload()))
+        return delivered, requests, runner
+    
+    @pytest.mark.parametrize("address", [
+        "127.0.0.1", "10.0.0.5", "172.16.3.4", "192.168.1.10", "169.254.169.254", "0.0.0.0", "::1",
+        "fe80::1", "fd00::1", "::ffff:10.0.0.1", "100.64.0.1"
+    ])
+    def test_private_addresses_are_refused(self, address):
+        """Testa recusa de loopback, redes privadas e endpoint de metadata"""
+        with patch('services.job_runner._lookup', AsyncMock(return_value=[address])):
+            with pytest.raises(CallbackURLError):
+                asyncio.run(resolve_callback_url("http://hooks.example.com/ocr"))
+    
+    def test_any_private_address_refuses_the_host(self):
+        """Testa recusa quando o host resolve para um endereço público e um privado"""
+        with patch('services.job_runner._lookup', AsyncMock(return_value=["93.184.216.34", "10.0.0.1"])):
+            with pytest.raises(CallbackURLError):
+                asyncio.run(resolve_callback_url("https://hooks.example.com/ocr"))
+    
+    def test_literal_ip_is_checked(self):
+        """Testa recusa de IP literal de metadata sem mock de DNS"""
+        with pytest.raises(CallbackURLError):
+            asyncio.run(resolve_callback_url("http://169.254.169.254/latest/meta-data/"))
+    
+    @pytest.mark.parametrize("url", ["ftp://example.com/x", "file:///etc/passwd", "/relative", "not a url"])
+    def test_non_http_urls_are_refused(self, url):
+        """Testa recusa de esquemas diferentes de http(s)"""
+        with pytest.raises(CallbackURLError):
+            asyncio.run(resolve_callback_url(url))
+    
+    def test_allowlist(self):
+        """Testa restrição de hosts por job_callback_allowed_hosts"""
+        lookup = AsyncMock(return_value=["93.184.216.34"])
+        with patch('services.job_runner._lookup', lookup), \
+             patch.object(settings, 'job_callback_allowed_hosts', ["example.com"]):
+            url, address = asyncio.run(resolve_callback_url("https://hooks.example.com/ocr"))
+            assert url.host == "hooks.example.com"
+            assert address == "93.184.216.34"
+            with pytest.raises(CallbackURLError):
+                asyncio.run(resolve_callback_url("https://example.com.evil.net/ocr"))
+    
+    def test_callback_is_signed_and_pinned(self):
+        """Testa assinatura HMAC e conexão ao endereço já validado"""
+        delivered, requests, _ = self.deliver(lambda request: httpx.Response(204))
+        
+        assert delivered is True
+        request = requests[0]
+        assert request.url.host == "93.184.216.34"
+        assert request.headers["host"] == "hooks.example.com"
+        assert request.extensions["sni_hostname"] == "hooks.example.com"
+        timestamp = int(request.headers["x-callback-timestamp"])
+        expected = sign_callback(request.content, timestamp)
+        assert request.headers["x-callback-signature"] == f"sha256={expected}"
+        assert json.loads(request.content)["request_id"] == "job-1"
+    
+    def test_redirects_are_not_followed(self):
+        """Testa que um redirect para rede interna não é seguido"""
+        redirect = lambda request: httpx.Response(302, headers={"Location": "http://169.254.169.254/"})
+        delivered, requests, _ = self.deliver(redirect)
+        
+        assert len(requests) == 1
+        assert requests[0].url.host == "93.184.216.34"
+    
+    def test_private_callback_is_never_sent(self):
+        """Testa que nenhuma requisição sai para um host que resolve para rede privada"""
+        delivered, requests, runner = self.deliver(lambda request: httpx.Response(200), addresses=["10.1.2.3"])
+        
+        assert delivered is False
+        assert requests == []
+        assert runner.get_stats()["callbacks_failed"] == 1
+
+class TestSemanticCache:
+    """Testes para o cache semântico de respostas do LLM"""
+    
+    QUESTION = ("Questão 12 (ENEM 2019) Um automóvel percorre 120 km em 1,5 hora. "
+                "Qual é a velocidade média do automóvel em km/h? a) 60 b) 80 c) 90 d) 100 e) 120")
+    NOISY = ("Questao 12 (ENEM 2019) Um automovei percorre 120 km em 1,5 hora. "
+             "Qual e a velocidade media do autornovel em km/h? a) 60 b) 80 c) 90 d) 100 e) 120")
+    
+    def create_response(self, text="Resposta"):
+        from models import LLMResponse, LLMProvider
+        return LLMResponse(provider=LLMProvider.GROQ, model="llama3-8b-8192",
+                           response=text, processing_time=1.0)
+    
+    def test_noisy_ocr_hits(self):
+        """Testa acerto com o mesmo enunciado e ruído de OCR"""
+        cache = SemanticResponseCache(threshold=0.7)
+        cache.set(self.QUESTION, "free:m:", self.create_response())
+        
+        hit = cache.get(self.NOISY, "free:m:")
+        
+        assert hit is not None
+        assert hit[0] >= 0.7
+        assert hit[1].response == "Resposta"
+    
+    def test_different_question_misses(self):
+        """Testa que outra questão não reaproveita a resposta"""
+        cache = SemanticResponseCache(threshold=0.7)
+        cache.set(self.QUESTION, "free:m:", self.create_response())
+        
+        other = "Questão 13 (ENEM 2019) Uma solução aquosa de cloreto de sódio tem concentração 2 mol/L."
+        assert cache.get(other, "free:m:") is None
+    
+    def test_different_numbers_miss(self):
+        """Testa que o mesmo exercício com outros dados não é reaproveitado"""
+        cache = SemanticResponseCache(threshold=0.7)
+        cache.set(self.QUESTION, "free:m:", self.create_response())
+        
+        assert cache.get(self.QUESTION.replace("1,5 hora", "2,5 horas"), "free:m:") is None
+    
+    def test_scopes_are_isolated(self):
+        """Testa isolamento por plano/modelo e matéria"""
+        cache = SemanticResponseCache()
+        free_scope = SemanticResponseCache.make_scope("free", "llama3-8b-8192", "Física")
+        cache.set(self.QUESTION, free_scope, self.create_response())
+        
+        assert cache.get(self.QUESTION, SemanticResponseCache.make_scope("max", "claude", "Física")) is None
+        assert cache.get(self.QUESTION, SemanticResponseCache.make_scope("free", "llama3-8b-8192", "Química")) is None
+        assert cache.get(self.QUESTION, SemanticResponseCache.make_scope("free", "llama3-8b-8192", "fisica")) is not None
+    
+    def test_ttl_and_eviction(self):
+        """Testa expiração e limite de tamanho"""
+        cache = SemanticResponseCache(max_entries=2, ttl=60)
+        for index in range(3):
+            cache.set(f"Texto numero {index} sobre um assunto diferente {'x' * index}", "s", self.create_response())
+        
+        assert cache.get_stats()['items'] == 2
+        assert cache.get_stats()['evictions'] == 1
+        
+        with patch('services.semantic_cache.time.time', return_value=time.time() + 120):
+            assert cache.get("Texto numero 2 sobre um assunto diferente xx", "s") is None
+    
+    def test_explain_uses_cache(self):
+        """Testa que o LLMService não chama o provedor em um acerto"""
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Explicação"}}]})
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(threshold=0.7), router=LLMRouter())
+        first = asyncio.run(service.explain(self.QUESTION, "free", subject="Física"))
+        second = asyncio.run(service.explain(self.NOISY, "free", subject="Física"))
+        
+        assert len(calls) == 1
+        assert second.response == first.response
+    
+    def test_different_questions_same_text_miss(self):
+        """Testa que perguntas diferentes sobre o mesmo texto OCR não compartilham respostas"""
+        calls = []
+        
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"choices": [{"message": {"content": f"Explicação {len(calls)}"}}]})
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(threshold=0.7), router=LLMRouter())
+        first = asyncio.run(service.explain(self.QUESTION, "free", question="Qual é o deslocamento total?", subject="Física"))
+        second = asyncio.run(service.explain(self.QUESTION, "free", question="Explique a velocidade média", subject="Física"))
+        third = asyncio.run(service.explain(self.QUESTION, "free", subject="Física"))
+        repeated = asyncio.run(service.explain(self.NOISY, "free", question="qual é o  deslocamento total?", subject="Física"))
+        
+        assert len(calls) == 3
+        assert len({first.response, second.response, third.response}) == 3
+        assert repeated.response == first.response
+
+class TestLLMRouter:
+    """Testes para o roteador de LLM com circuit breakers"""
+    
+    def test_circuit_opens_with_exponential_backoff(self):
+        """Testa abertura do circuito e backoff exponencial"""
+        breaker = CircuitBreaker(failure_threshold=3, backoff_base=5.0, backoff_factor=2.0, max_backoff=300.0)
+        
+        for _ in range(2):
+            breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+        
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker._calculate_backoff() == 5.0
+        assert breaker.allow() is False
+        
+        breaker.record_failure()
+        assert breaker._calculate_backoff() == 10.0
+    
+    def test_half_open_allows_single_probe(self):
+        """Testa sondagem única no estado half-open e fechamento após sucesso"""
+        breaker = CircuitBreaker(failure_threshold=1, backoff_base=5.0)
+        breaker.record_failure()
+        
+        with patch('services.llm_router.time.time', return_value=time.time() + 6):
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            assert breaker.allow() is True
+            assert breaker.allow() is False
+        
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+    
+    def test_orders_by_latency_and_skips_open(self):
+        """Testa ordenação pelo p50 e exclusão de alvos com circuito aberto"""
+        router = LLMRouter()
+        slow, fast, broken = ('anthropic', 'a'), ('openai', 'b'), ('openrouter', 'c')
+        
+        with patch.object(settings, 'llm_router_min_samples', 3):
+            assert router.order([slow, fast]) == [slow, fast]
+            for _ in range(3):
+                router.record(slow, 2.0, True)
+                router.record(fast, 0.5, True)
+            for _ in range(3):
+                router.record(broken, 0.1, False)
+            
+            assert router.order([slow, fast, broken]) == [fast, slow]
+        assert router.provider_health(['openrouter', 'openai', 'groq']) == {
+            'openrouter': False, 'openai': True, 'groq': True
+        }
+    
+    def test_failing_target_is_demoted_before_breaker_opens(self):
+        """Testa que um alvo rápido mas com muitas falhas perde a frente antes do circuito abrir"""
+        router = LLMRouter()
+        flaky, steady = ('groq', 'a'), ('openai', 'b')
+        
+        with patch.object(settings, 'llm_router_min_samples', 4), \
+             patch.object(settings, 'llm_circuit_failure_threshold', 100):
+            for _ in range(4):
+                router.record(steady, 1.0, True)
+            for _ in range(3):
+                router.record(flaky, 0.1, True)
+                router.record(flaky, 0.1, False)
+                router.record(flaky, 0.1, False)
+            router.record(flaky, 0.1, True)
+            
+            assert router.get_stats()['groq/a']['state'] == "closed"
+            assert router.order([flaky, steady]) == [steady, flaky]
+    
+    def test_error_rate_weighs_latency(self):
+        """Testa ordenação pelo tempo esperado até um sucesso (p50 / (1 - taxa de erro))"""
+        router = LLMRouter()
+        fast_lossy, slower_clean = ('groq', 'a'), ('openai', 'b')
+        
+        with patch.object(settings, 'llm_router_min_samples', 4), \
+             patch.object(settings, 'llm_circuit_failure_threshold', 100):
+            for _ in range(6):
+                router.record(slower_clean, 0.6, True)
+            for _ in range(3):
+                router.record(fast_lossy, 0.5, True)
+                router.record(fast_lossy, 0.5, True)
+                router.record(fast_lossy, 0.5, False)
+            
+            assert router.order([fast_lossy, slower_clean]) == [slower_clean, fast_lossy]
+    
+    def test_explain_skips_open_circuit(self):
+        """Testa que o LLMService não chama provedores com circuito aberto"""
+        paths = []
+        
+        def handler(request):
+            paths.append(request.url.path)
+            if request.url.path.endswith("/messages"):
+                return httpx.Response(500)
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Groq"}}]})
+        
+        service = LLMService(transport=httpx.MockTransport(handler),
+                             response_cache=SemanticResponseCache(), router=LLMRouter())
+        
+        with patch.object(settings, 'anthropic_api_key', 'sk-ant-test'), \
+             patch.object(settings, 'llm_circuit_failure_threshold', 2):
+            for index in range(4):
+                result = asyncio.run(service.explain(f"Texto {index}", "pro"))
+                assert result.provider.value == "groq"
+        
+        assert sum(path.endswith("/messages") for path in paths) == 2
+        assert service.router.get_stats()['anthropic/claude-3-haiku-20240307']['state'] == "open"
+
 class TestLLMService:
     """Testes para o serviço de LLM"""
     
@@ -87,9 +1714,246 @@ class TestLLMService:
         assert "processing_time" in result
         # Deve funcionar mesmo com texto vazio
     
+    def test_openai_style_completion(self):
+        """Testa chamada no formato chat/completions (Groq/OpenAI/OpenRouter)"""
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={
+                "choices": [{"message": {"content": " Explicação "}}],
+                "usage": {"total_tokens": 42}
+            })
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(), router=LLMRouter())
+        with patch.object(settings, 'groq_api_key', 'gsk-test'):
+            result = asyncio.run(service.complete('groq', 'llama3-8b-8192', 'Texto', system='Sistema'))
+        
+        body = json.loads(requests[0].content)
+        assert result.success is True
+        assert result.response == "Explicação"
+        assert result.tokens_used == 42
+        assert requests[0].url.path.endswith("/chat/completions")
+        assert requests[0].headers["authorization"] == "Bearer gsk-test"
+        assert body["messages"][0] == {"role": "system", "content": "Sistema"}
+    
+    def test_anthropic_style_completion(self):
+        """Testa chamada no formato messages da Anthropic"""
+        requests = []
+        
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={
+                "content": [{"type": "text", "text": "Resposta"}],
+                "usage": {"input_tokens": 10, "output_tokens": 5}
+            })
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(), router=LLMRouter())
+        with patch.object(settings, 'anthropic_api_key', 'sk-ant-test'):
+            result = asyncio.run(service.complete('anthropic', 'claude-3-haiku-20240307', 'Texto', system='Sistema'))
+        
+        body = json.loads(requests[0].content)
+        assert result.response == "Resposta"
+        assert result.tokens_used == 15
+        assert requests[0].url.path.endswith("/messages")
+        assert requests[0].headers["x-api-key"] == "sk-ant-test"
+        assert body["system"] == "Sistema"
+    
+    def test_explain_falls_back_and_reuses_clients(self):
+        """Testa fallback para o próximo provedor e reuso do cliente por provedor"""
+        def handler(request):
+            if request.url.path.endswith("/messages"):
+                return httpx.Response(529, json={"error": "overloaded"})
+            return httpx.Response(200, json={"choices": [{"message": {"content": "Groq"}}]})
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(), router=LLMRouter())
+        
+        async def run():
+            first = await service.explain("Texto", "pro")
+            client = service._get_client('groq')
+            second = await service.explain("Texto", "pro")
+            reused = service._get_client('groq') is client
+            await service.aclose()
+            return first, second, reused
+        
+        with patch.object(settings, 'anthropic_api_key', 'sk-ant-test'):
+            first, second, reused = asyncio.run(run())
+        
+        assert first.provider.value == "groq"
+        assert second.success is True
+        assert reused is True
+        assert service.get_stats()['clients'] == []
+    
+    def test_stream_falls_back_before_first_token(self):
+        """Testa streaming SSE com fallback quando o primeiro provedor falha"""
+        def handler(request):
+            if request.url.path.endswith("/messages"):
+                return httpx.Response(500)
+            body = (
+                'data: {"choices": [{"delta": {"content": "Olá"}}]}\n\n'
+                'data: {"choices": [{"delta": {"content": " mundo"}}]}\n\n'
+                'data: [DONE]\n\n'
+            )
+            return httpx.Response(200, text=body, headers={"content-type": "text/event-stream"})
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(), router=LLMRouter())
+        
+        async def collect():
+            return [item async for item in service.explain_stream("Texto", "pro")]
+        
+        with patch.object(settings, 'anthropic_api_key', 'sk-ant-test'):
+            items = asyncio.run(collect())
+        
+        assert items[:2] == ["Olá", " mundo"]
+        assert items[-1].response == "Olá mundo"
+        assert items[-1].provider.value == "groq"
+    
+    def test_anthropic_stream_events(self):
+        """Testa leitura dos eventos content_block_delta da Anthropic"""
+        def handler(request):
+            body = (
+                'event: message_start\ndata: {"type": "message_start"}\n\n'
+                'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"text": "A"}}\n\n'
+                'event: content_block_delta\ndata: {"type": "content_block_delta", "delta": {"text": "B"}}\n\n'
+                'event: message_stop\ndata: {"type": "message_stop"}\n\n'
+            )
+            return httpx.Response(200, text=body)
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(), router=LLMRouter())
+        
+        async def collect():
+            return [delta async for delta in service.stream('anthropic', 'claude-3-haiku-20240307', 'Texto')]
+        
+        assert asyncio.run(collect()) == ["A", "B"]
+    
+    def test_timeout_is_reported_as_failure(self):
+        """Testa que timeout vira resposta com erro, sem exceção"""
+        def handler(request):
+            raise httpx.ReadTimeout("timed out", request=request)
+        
+        service = LLMService(transport=httpx.MockTransport(handler), response_cache=SemanticResponseCache(), router=LLMRouter())
+        result = asyncio.run(service.complete('groq', 'llama3-8b-8192', 'Texto', timeout=0.5))
+        
+        assert result.success is False
+        assert "ReadTimeout" in result.error
+    
+    def test_route_skips_unconfigured_providers(self):
+        """Testa roteamento por plano sem chaves configuradas"""
+        service = LLMService()
+        
+        with patch.object(settings, 'anthropic_api_key', None):
+            assert service.route('pro') == [('groq', 'llama3-8b-8192')]
+            assert service.route('max') == []
+        with patch.object(settings, 'anthropic_api_key', 'sk-ant-test'):
+            assert service.route('max') == [
+                ('anthropic', 'claude-3-sonnet-20240229'),
+                ('anthropic', 'claude-3-haiku-20240307')
+            ]
+    
     def test_global_instances(self):
         """Testa se as instâncias globais estão disponíveis"""
         assert ocr_service is not None
         assert llm_service is not None
         assert hasattr(ocr_service, 'extract_text')
         assert hasattr(llm_service, 'get_explanation')
+
+class TestLoadTestFakes:
+    """Testes para os provedores falsos e a detecção de saturação do teste de carga"""
+    
+    def fake_providers(self, latency="fixed:0", error_rate=0.0):
+        from loadtest.fake_providers import FakeProviders, ProviderProfile, LatencyDistribution
+        profile = lambda status: ProviderProfile(LatencyDistribution.parse(latency), error_rate, status)
+        return FakeProviders(vision=profile(503), azure=profile(500), llm=profile(429), seed=1)
+    
+    def test_latency_distributions(self):
+        """Testa o parse e a amostragem das distribuições de latência"""
+        import random
+        from loadtest.fake_providers import LatencyDistribution
+        
+        rng = random.Random(3)
+        assert LatencyDistribution.parse("fixed:0.25").sample(rng) == 0.25
+        assert 0.1 <= LatencyDistribution.parse("uniform:0.1:0.2").sample(rng) <= 0.2
+        samples = sorted(LatencyDistribution.parse("lognormal:0.5:0.4").sample(rng) for _ in range(2001))
+        assert 0.45 < samples[1000] < 0.55  # Median
+        assert str(LatencyDistribution.parse("exponential:2")) == "exponential:2"
+        with pytest.raises(ValueError):
+            LatencyDistribution.parse("gamma:1")
+    
+    def test_azure_read_polling(self):
+        """Testa o fluxo read_in_stream + get_read_result do Azure falso"""
+        from fastapi.testclient import TestClient
+        from loadtest.fake_providers import create_app
+        
+        providers = self.fake_providers()
+        client = TestClient(create_app(providers))
+        providers.azure.latency = providers.azure.latency.parse("fixed:60")
+        
+        submitted = client.post("/vision/v3.2/read/analyze", content=b"image")
+        assert submitted.status_code == 202
+        location = submitted.headers["Operation-Location"]
+        assert "/vision/v3.2/read/analyzeResults/" in location
+        operation_id = location.split("/")[-1]
+        assert client.get(location).json() == {"status": "running"}
+        
+        providers.operations[operation_id] = 0.0  # Ready now
+        result = client.get(location).json()
+        assert result["status"] == "succeeded"
+        lines = [line["text"] for line in result["analyzeResult"]["readResults"][0]["lines"]]
+        assert lines[0] == "Resolva: 2x + 5 = 17"
+        assert client.get(location).status_code == 404
+    
+    def test_vision_annotate_and_error_rate(self):
+        """Testa a resposta do Vision falso e a taxa de erro configurada"""
+        from fastapi.testclient import TestClient
+        from loadtest.fake_providers import create_app
+        
+        request = {"requests": [{"image": {"content": "aGVsbG8="}, "features": [{"type": "TEXT_DETECTION"}]}]}
+        ok = TestClient(create_app(self.fake_providers())).post("/v1/images:annotate", json=request)
+        assert ok.json()["responses"][0]["textAnnotations"][0]["description"].startswith("Resolva")
+        
+        failing = self.fake_providers(error_rate=1.0)
+        response = TestClient(create_app(failing)).post("/v1/images:annotate", json=request)
+        assert response.status_code == 503
+        assert failing.errors == {"vision": 1}
+    
+    def test_llm_service_against_fake_endpoints(self):
+        """Testa que o LLMService entende as respostas falsas (OpenAI, Anthropic e streaming)"""
+        from loadtest.fake_providers import create_app, LLM_TEXT
+        
+        transport = httpx.ASGITransport(app=create_app(self.fake_providers()))
+        service = LLMService(transport=transport, response_cache=SemanticResponseCache(), router=LLMRouter())
+        
+        async def scenario():
+            groq = await service.complete('groq', 'llama3-8b-8192', 'Texto')
+            anthropic = await service.complete('anthropic', 'claude-3-haiku-20240307', 'Texto')
+            streamed = [delta async for delta in service.stream('openai', 'gpt-4o-mini', 'Texto')]
+            await service.aclose()
+            return groq, anthropic, "".join(streamed)
+        
+        with patch.object(settings, 'groq_base_url', 'http://fake/v1'), \
+             patch.object(settings, 'anthropic_base_url', 'http://fake/v1'), \
+             patch.object(settings, 'openai_base_url', 'http://fake/v1'), \
+             patch.object(settings, 'anthropic_api_key', 'loadtest'):
+            groq, anthropic, streamed = asyncio.run(scenario())
+        
+        assert groq.success and groq.response == LLM_TEXT
+        assert anthropic.success and anthropic.response == LLM_TEXT
+        assert streamed.strip() == LLM_TEXT
+    
+    def test_find_saturation(self):
+        """Testa a detecção do ponto de saturação"""
+        from loadtest.generator import StageResult, find_saturation
+        
+        def stage(concurrency, throughput, p95=1.0, failed=0):
+            return StageResult(concurrency, 30.0, 100, 100 - failed, throughput, {'p95': p95})
+        
+        growing = [stage(50, 20.0), stage(100, 38.0), stage(250, 80.0)]
+        assert find_saturation(growing)['saturated_at'] is None
+        
+        plateau = find_saturation(growing + [stage(500, 82.0), stage(1000, 60.0)])
+        assert plateau['saturated_at'] == 250
+        assert plateau['peak_throughput'] == 82.0
+        assert "500 students" in plateau['reason']
+        
+        assert find_saturation([stage(50, 20.0), stage(100, 39.0, failed=5)])['saturated_at'] == 50
+        assert find_saturation([stage(50, 20.0), stage(100, 39.0, p95=9.0)], p95_slo=5.0)['saturated_at'] == 50